@@ -0,0 +1,100 @@
+"""
+Compare the thread pool pagination of `get_items` with the asyncio engine
+against a local stand-in for the TIDAL API that adds a fixed latency to every
+request.
+
+    python benchmarks/aio_pagination.py --items 20000 --latency 0.1
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from mopidy_tidal import aio
+from mopidy_tidal.workers import get_items
+
+
+def make_server(total_items: int, latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *_):
+            pass
+
+        def do_GET(self):
+            params = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+            offset, limit = int(params["offset"]), int(params["limit"])
+            time.sleep(latency)
+            body = json.dumps(
+                {
+                    "items": [
+                        {"id": i}
+                        for i in range(offset, min(offset + limit, total_items))
+                    ],
+                    "totalNumberOfItems": total_items,
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 256
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--connections", type=int, default=64)
+    args = parser.parse_args()
+
+    server = make_server(args.items, args.latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+    http = requests.Session()
+
+    def tracks(limit, offset):
+        return http.get(
+            base_url + "playlists/1/tracks", params={"limit": limit, "offset": offset}
+        ).json()["items"]
+
+    start = time.monotonic()
+    threaded = get_items(tracks)
+    threaded_time = time.monotonic() - start
+
+    session = Mock(token_type=None, session_id="s", country_code="US")
+    session.config.api_v1_location = base_url
+    engine = aio.AsyncEngine()
+    engine.start()
+    client = aio.TidalAsyncClient(
+        engine, lambda: session, max_connections=args.connections
+    )
+    start = time.monotonic()
+    async_items = client.run(client.paginate("playlists/1/tracks"))
+    async_time = time.monotonic() - start
+    client.close()
+    engine.stop()
+    server.shutdown()
+
+    assert threaded == async_items, "The two engines returned different items"
+    pages = -(-args.items // 100)
+    print(f"{args.items} items, {pages} pages, {args.latency * 1000:.0f} ms/request")
+    print(f"thread pool (5 threads): {threaded_time:.2f}s")
+    print(f"asyncio ({args.connections} connections): {async_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
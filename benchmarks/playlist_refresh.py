@@ -0,0 +1,83 @@
+"""
+Compare the refresh of the tracks of many playlists one playlist at a time
+with the refresh across a pool of workers, against a fake TIDAL session that
+adds a fixed latency to every page of tracks.
+
+    python benchmarks/playlist_refresh.py --playlists 20 --tracks 250 --latency 0.1
+"""
+
+import argparse
+import tempfile
+import time
+from unittest.mock import Mock, patch
+
+from mopidy_tidal import context, playlists
+from mopidy_tidal.caches import CacheRegistry
+from mopidy_tidal.lanes import Lanes
+from mopidy_tidal.playlists import TidalPlaylistsProvider
+
+
+def make_track(i: int):
+    track = Mock(id=i, duration=100, track_num=1, disc_num=1)
+    track.name = f"Track-{i}"
+    track.artist.id = track.album.id = 0
+    track.artist.name = track.album.name = "Name"
+    track.artists = [track.artist]
+    return track
+
+
+def make_playlist(i: int, total_tracks: int, latency: float):
+    tracks = [make_track(i * total_tracks + j) for j in range(total_tracks)]
+
+    def page(limit, offset):
+        time.sleep(latency)
+        return tracks[offset : offset + limit]
+
+    page.__name__ = "tracks"
+    playlist = Mock(id=f"pl-{i}", num_tracks=total_tracks, last_updated=10)
+    playlist.name = f"Playlist-{i}"
+    playlist.tracks = page
+    return playlist
+
+
+def refresh(tidal_playlists) -> float:
+    backend = Mock(lanes=Lanes(), caches=CacheRegistry(persist=False))
+    backend._config = {"tidal": {"playlist_cache_refresh_secs": 0}}
+    provider = TidalPlaylistsProvider(backend)
+    provider._current_tidal_playlists = tidal_playlists
+    start = time.monotonic()
+    provider._refresh_playlists(include_items=True)
+    elapsed = time.monotonic() - start
+    backend.lanes.close()
+    assert len(provider._playlists) == len(tidal_playlists), "Playlists missing"
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--playlists", type=int, default=20)
+    parser.add_argument("--tracks", type=int, default=250)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        context.set_config({"core": {"cache_dir": cache_dir}, "tidal": {}})
+        tidal_playlists = [
+            make_playlist(i, args.tracks, args.latency) for i in range(args.playlists)
+        ]
+        with patch("mopidy_tidal.playlists.backend.BackendListener"):
+            with patch.object(playlists, "ITEMS_WORKERS", 1):
+                sequential_time = refresh(tidal_playlists)
+            pooled_time = refresh(tidal_playlists)
+
+    pages = -(-args.tracks // 100)
+    print(
+        f"{args.playlists} playlists of {args.tracks} tracks, {pages} pages each, "
+        f"{args.latency * 1000:.0f} ms/request"
+    )
+    print(f"one playlist at a time: {sequential_time:.2f}s")
+    print(f"{playlists.ITEMS_WORKERS} playlists at a time: {pooled_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -32,9 +32,29 @@ class Extension(ext.Extension):
         schema["client_secret"] = config.String(optional=True)
         schema["playlist_cache_refresh_secs"] = config.Integer(optional=True)
         schema["lazy"] = config.Boolean(optional=True)
+        schema["browse_timeout_secs"] = config.Integer(optional=True, minimum=0)
+        schema["lookup_timeout_secs"] = config.Integer(optional=True, minimum=0)
+        schema["search_timeout_secs"] = config.Integer(optional=True, minimum=0)
+        schema["images_timeout_secs"] = config.Integer(optional=True, minimum=0)
+        schema["async_engine"] = config.Boolean(optional=True)
+        schema["image_proxy"] = config.Boolean(optional=True)
+        schema["image_proxy_thumbnails"] = config.Boolean(optional=True)
+        schema["catalog_cache_ttl_secs"] = config.Integer(optional=True, minimum=0)
+        schema["artist_ep_singles"] = config.Boolean(optional=True)
+        schema["background_refresh_secs"] = config.Integer(optional=True, minimum=0)
+        schema["prefetch_tracks"] = config.Integer(optional=True, minimum=0)
+        schema["prefetch_metadata"] = config.Boolean(optional=True)
+        schema["audio_proxy"] = config.Boolean(optional=True)
+        schema["audio_cache_size_mb"] = config.Integer(optional=True, minimum=1)
+        schema["adaptive_quality"] = config.Boolean(optional=True)
+        schema["min_quality"] = config.String(
+            optional=True, choices=["LOSSLESS", "HIGH", "LOW"]
+        )
         return schema
 
     def setup(self, registry):
         from .backend import TidalBackend
+        from .web import factory as web_factory
 
         registry.add("backend", TidalBackend)
+        registry.add("http:app", {"name": "tidal", "factory": web_factory})
@@ -0,0 +1,367 @@
+from __future__ import unicode_literals
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import ssl
+from threading import Thread
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from requests import HTTPError, Response
+from tidalapi.playlist import Playlist as TidalPlaylist
+from tidalapi.user import Favorites
+
+from mopidy_tidal.workers import current_deadline
+
+logger = logging.getLogger(__name__)
+
+_client: Optional["TidalAsyncClient"] = None
+
+
+def get_client() -> Optional["TidalAsyncClient"]:
+    """
+    The client of the running asyncio engine, or None if the engine is
+    disabled.
+    """
+    return _client
+
+
+def set_client(client: Optional["TidalAsyncClient"]):
+    global _client
+    _client = client
+
+
+class AsyncEngine:
+    """
+    An asyncio event loop running on a dedicated thread. Synchronous code
+    submits coroutines to it through `run`, which blocks until the result is
+    available.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(
+            target=self._loop.run_forever, name="mopidy-tidal-aio", daemon=True
+        )
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+
+class AsyncHttpClient:
+    """
+    A minimal HTTP/1.1 client on top of asyncio streams. Connections are kept
+    alive and reused, and at most `max_connections` requests are in flight at
+    the same time.
+    """
+
+    def __init__(self, max_connections: int = 32):
+        self._max_connections = max_connections
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._idle: Dict[Tuple[str, str, int], List[Tuple]] = {}
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        # The semaphore must be created on the loop that uses it
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_connections)
+
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        key = (parts.scheme, parts.hostname, parts.port or (443 if secure else 80))
+        query = "&".join(q for q in (parts.query, urlencode(params or {})) if q)
+        target = (parts.path or "/") + (f"?{query}" if query else "")
+        head = "".join(
+            [f"{method} {target} HTTP/1.1\r\n", f"Host: {parts.netloc}\r\n"]
+            + [f"{name}: {value}\r\n" for name, value in (headers or {}).items()]
+            + ["Accept-Encoding: identity\r\n", "Connection: keep-alive\r\n\r\n"]
+        ).encode("latin-1")
+
+        async with self._semaphore:
+            for reuse in (True, False):
+                reader, writer, reused = await self._connect(key, reuse=reuse)
+                try:
+                    writer.write(head)
+                    await writer.drain()
+                    status, resp_headers, body, keep_alive = await self._read_response(
+                        reader
+                    )
+                except (ConnectionError, EOFError):
+                    writer.close()
+                    if reused:
+                        # The server dropped an idle connection: retry on a
+                        # new one
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+
+                if keep_alive:
+                    self._idle.setdefault(key, []).append((reader, writer))
+                else:
+                    writer.close()
+                return status, resp_headers, body
+
+    async def get_json(self, url: str, params=None, headers=None):
+        status, _, body = await self.request("GET", url, params, headers)
+        if status >= 400:
+            response = Response()
+            response.status_code = status
+            response.url = url
+            response._content = body
+            raise HTTPError(f"{status} Error for url: {url}", response=response)
+
+        return json.loads(body)
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    async def _connect(self, key, reuse: bool = True):
+        idle = self._idle.get(key, [])
+        while reuse and idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+
+        scheme, host, port = key
+        ssl_context = ssl.create_default_context() if scheme == "https" else None
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+        return reader, writer, False
+
+    @classmethod
+    async def _read_response(cls, reader: asyncio.StreamReader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+
+        version, status, *_ = status_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await cls._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        keep_alive = keep_alive and headers.get("connection", "").lower() != "close"
+        return int(status), headers, body, keep_alive
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if not size:
+                # Skip the trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+
+class TidalAsyncClient:
+    """
+    Asynchronous access to the same TIDAL API endpoints used by tidalapi. The
+    JSON responses are parsed through the session's tidalapi parsers, so the
+    returned objects are the same as those of the synchronous API.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        session_getter: Callable,
+        max_connections: int = 32,
+        http: Optional[AsyncHttpClient] = None,
+    ):
+        self._engine = engine
+        self._session_getter = session_getter
+        self._http = http or AsyncHttpClient(max_connections)
+
+    @property
+    def session(self):
+        return self._session_getter()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        return self._engine.run(coro, timeout)
+
+    def close(self):
+        self._engine.loop.call_soon_threadsafe(self._http.close)
+
+    def _url(self, path: str) -> str:
+        config = self.session.config
+        base_url = getattr(config, "api_v1_location", None) or config.api_location
+        return urljoin(base_url, path)
+
+    def _request_args(self, **params) -> Tuple[Dict, Dict]:
+        session = self.session
+        headers = {}
+        if session.token_type and session.access_token is not None:
+            headers["Authorization"] = f"{session.token_type} {session.access_token}"
+
+        request_params = {
+            "sessionId": session.session_id,
+            "countryCode": session.country_code,
+            **params,
+        }
+        return (
+            {k: v for k, v in request_params.items() if v is not None},
+            headers,
+        )
+
+    async def get(self, path: str, **params):
+        request_params, headers = self._request_args(**params)
+        return await self._http.get_json(self._url(path), request_params, headers)
+
+    def _map(self, json_obj, parse: Optional[Callable]) -> List:
+        if parse is None:
+            return list(json_obj.get("items", []))
+        return list(self.session.request.map_json(json_obj, parse=parse))
+
+    async def paginate(
+        self,
+        path: str,
+        parse: Optional[Callable] = None,
+        chunk_size: int = 100,
+        timeout: Optional[float] = None,
+    ) -> List:
+        """
+        Fetch all the items of a paginated endpoint. The first page tells the
+        total number of items, then all the other pages are requested
+        concurrently. If `timeout` expires, the outstanding pages are
+        cancelled and only the items up to the first missing page are
+        returned.
+        """
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + timeout if timeout is not None else None
+        first_page = await self.get(path, limit=chunk_size, offset=0)
+        total = first_page.get("totalNumberOfItems", 0)
+        pages = [first_page]
+        tasks = [
+            asyncio.ensure_future(self.get(path, limit=chunk_size, offset=offset))
+            for offset in range(chunk_size, total, chunk_size)
+        ]
+
+        if tasks:
+            done, pending = await asyncio.wait(
+                tasks,
+                timeout=max(0, expires_at - loop.time()) if expires_at else None,
+            )
+            for task in pending:
+                task.cancel()
+
+            for task in tasks:
+                if task not in done:
+                    logger.warning(
+                        "Deadline exceeded: returning the first %d pages of %s",
+                        len(pages),
+                        path,
+                    )
+                    break
+                pages.append(task.result())
+
+        items = []
+        for page in pages:
+            items.extend(self._map(page, parse))
+        return items
+
+    async def get_item(self, item_type: str, item_id: str):
+        json_obj = await self.get(f"{item_type}s/{item_id}")
+        return getattr(self.session, f"parse_{item_type}")(json_obj)
+
+    async def album_tracks(self, album_id) -> List:
+        return await self.paginate(
+            f"albums/{album_id}/tracks", self.session.parse_track
+        )
+
+    async def artist_top_tracks(self, artist_id, limit: int = 25) -> List:
+        json_obj = await self.get(f"artists/{artist_id}/toptracks", limit=limit)
+        return self._map(json_obj, self.session.parse_track)
+
+    async def expand_tracks(self, artists, albums) -> Tuple[List[List], List[List]]:
+        """
+        Get the top tracks of `artists` and the tracks of `albums`
+        concurrently.
+        """
+        artist_tracks, album_tracks = await asyncio.gather(
+            asyncio.gather(*[self.artist_top_tracks(a.id) for a in artists]),
+            asyncio.gather(*[self.album_tracks(a.id) for a in albums]),
+        )
+        return list(artist_tracks), list(album_tracks)
+
+    def _endpoint(self, func: Callable) -> Optional[Tuple[str, Callable]]:
+        owner = getattr(func, "__self__", None)
+        name = getattr(func, "__name__", None)
+        if isinstance(owner, Favorites) and name in {"tracks", "albums", "artists"}:
+            parse = getattr(self.session, f"parse_{name[:-1]}")
+            return f"{owner.base_url}/{name}", parse
+        if isinstance(owner, TidalPlaylist) and name == "tracks":
+            return f"playlists/{owner.id}/tracks", self.session.parse_track
+        return None
+
+    def get_items(self, func: Callable, chunk_size: int = 100) -> Optional[List]:
+        """
+        Paginate a tidalapi method on the event loop. Returns None if there
+        is no known endpoint for `func` or if the request failed, so the
+        caller can fall back to the synchronous API.
+        """
+        endpoint = self._endpoint(func)
+        if not endpoint:
+            return None
+
+        path, parse = endpoint
+        try:
+            return self.run(
+                self.paginate(
+                    path,
+                    parse,
+                    chunk_size=chunk_size,
+                    timeout=current_deadline().remaining(),
+                )
+            )
+        except (HTTPError, OSError, EOFError, ValueError) as err:
+            logger.warning(
+                "Asynchronous pagination of %s failed, falling back to the "
+                "synchronous API: %s",
+                path,
+                err,
+            )
+            return None
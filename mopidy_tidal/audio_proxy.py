@@ -0,0 +1,439 @@
+from __future__ import unicode_literals
+
+import logging
+import mimetypes
+import os
+import pathlib
+import re
+import tempfile
+import time
+from threading import Condition, Lock, Thread
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+import tornado.web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+
+from mopidy_tidal import Extension
+
+logger = logging.getLogger(__name__)
+
+LOCAL_PREFIX = "/tidal/audio/"
+CHUNK_SIZE = 64 * 1024
+
+_key_re = re.compile(r"^[0-9]+-[A-Za-z0-9_]+$")
+_range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+_cache: Optional["AudioCache"] = None
+_cache_lock = Lock()
+
+
+def get_track_key(track_id: str, quality: str) -> str:
+    """
+    Cache key of a track: the same track has different files per quality.
+    """
+    return f"{track_id}-{quality}"
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The first and last byte of a single-range `Range` header, or None if it
+    doesn't describe a satisfiable range of `size` bytes.
+    """
+    match = _range_re.match(header or "")
+    if not match or match.groups() == ("", ""):
+        return None
+
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last `end` bytes
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+
+    return (start, end) if start <= end else None
+
+
+class _Fill:
+    """
+    Download of a track file into the cache, readable while it progresses.
+    """
+
+    def __init__(self, tmp_file: str):
+        self.tmp_file = tmp_file
+        self.written = 0
+        self.size: Optional[int] = None
+        self.content_type = "application/octet-stream"
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.cond = Condition()
+
+    def wait_for(self, position: int, timeout: float) -> bool:
+        """
+        Wait until the byte at `position` is written or the download ends.
+        Returns False if nothing more will be written.
+        """
+        with self.cond:
+            self.cond.wait_for(
+                lambda: self.written > position or self.done or self.error,
+                timeout,
+            )
+            return self.written > position
+
+
+class AudioCache:
+    """
+    Size-bounded disk cache of the track files streamed from TIDAL. Files are
+    downloaded once, while they are streamed to the first client, and served
+    from disk afterwards. The least recently played files are evicted first.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int, timeout: float = 10):
+        """
+        :param cache_dir: Directory of the cached files
+        :param max_size: Max total size of the cached files, in bytes
+        :param timeout: Timeout of the upstream requests, in seconds
+        """
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        self._timeout = timeout
+        self._lock = Lock()
+        self._urls: Dict[str, str] = {}
+        self._fills: Dict[str, _Fill] = {}
+        # Paths of the complete files, by track key
+        self._files: Dict[str, str] = {}
+        self._http = requests.Session()
+        self.fetches = 0
+        # Called with the size and the duration of each complete download
+        self.on_download: Optional[Callable[[int, float], None]] = None
+        # Called with the key of a track when its first audio data of a
+        # request is sent
+        self.on_stream_start: Optional[Callable[[str], None]] = None
+        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if not name.startswith("."):
+                self._files[name.rsplit(".", 1)[0]] = os.path.join(cache_dir, name)
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return bool(_key_re.match(key))
+
+    def register(self, key: str, url: str):
+        """
+        Set the upstream URL of a track, to be used on the next cache miss.
+        """
+        with self._lock:
+            self._urls[key] = url
+
+    def get_file(self, key: str) -> Optional[str]:
+        """
+        The cached file of a track, if it is fully downloaded.
+        """
+        with self._lock:
+            path = self._files.get(key)
+        if not path:
+            return None
+
+        try:
+            # The modification time tells which files were played last
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._files.pop(key, None)
+            return None
+        return path
+
+    def get_fill(self, key: str) -> Optional[_Fill]:
+        """
+        The download of a track in progress, or a new one if the upstream URL
+        of the track is known.
+        """
+        with self._lock:
+            fill = self._fills.get(key)
+            if fill:
+                return fill
+
+            url = self._urls.get(key)
+            if not url:
+                return None
+
+            fd, tmp_file = tempfile.mkstemp(prefix=".", dir=self._cache_dir)
+            os.close(fd)
+            fill = self._fills[key] = _Fill(tmp_file)
+
+        Thread(
+            target=self._download,
+            args=(key, url, fill),
+            name="mopidy-tidal-audio-cache",
+            daemon=True,
+        ).start()
+        return fill
+
+    def _download(self, key: str, url: str, fill: _Fill):
+        logger.debug("Caching track %s", key)
+        self.fetches += 1
+        started_at = time.monotonic()
+        try:
+            with self._http.get(url, stream=True, timeout=self._timeout) as response:
+                response.raise_for_status()
+                with fill.cond:
+                    fill.content_type = response.headers.get(
+                        "Content-Type", fill.content_type
+                    )
+                    length = response.headers.get("Content-Length")
+                    fill.size = int(length) if length else None
+
+                with open(fill.tmp_file, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        f.flush()
+                        with fill.cond:
+                            fill.written += len(chunk)
+                            fill.cond.notify_all()
+
+            extension = mimetypes.guess_extension(fill.content_type) or ".bin"
+            path = os.path.join(self._cache_dir, key + extension)
+            with self._lock:
+                # Clients that find the temporary file gone find the cached one
+                os.replace(fill.tmp_file, path)
+                self._files[key] = path
+                # Only needed until the file is complete on disk. It is kept
+                # after a failure, so that the download can be retried
+                self._urls.pop(key, None)
+            if self.on_download:
+                self.on_download(fill.written, time.monotonic() - started_at)
+        except Exception as e:
+            logger.warning("Could not cache track %s: %s", key, e)
+            with fill.cond:
+                fill.error = e
+            try:
+                os.remove(fill.tmp_file)
+            except OSError:
+                pass
+        finally:
+            with fill.cond:
+                fill.done = True
+                fill.cond.notify_all()
+            with self._lock:
+                self._fills.pop(key, None)
+
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self._cache_dir):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self._max_size:
+                break
+
+            logger.debug("Evicting %s from the audio cache", path)
+            with self._lock:
+                self._files.pop(os.path.basename(path).rsplit(".", 1)[0], None)
+            os.remove(path)
+            total -= size
+
+    def open_upstream(self, key: str, range_header: str) -> Optional[requests.Response]:
+        """
+        Request a range of a track that isn't cached yet straight from the
+        upstream URL. Returns None if the URL isn't known (anymore), e.g.
+        because the file has been downloaded in the meantime.
+        """
+        with self._lock:
+            url = self._urls.get(key)
+        if not url:
+            return None
+
+        return self._http.get(
+            url,
+            headers={"Range": range_header},
+            stream=True,
+            timeout=self._timeout,
+        )
+
+    def close(self):
+        self._http.close()
+
+
+class AudioHandler(tornado.web.RequestHandler):
+    def initialize(self, cache: AudioCache):
+        self._cache = cache
+        self._key: Optional[str] = None
+        self._started = False
+
+    async def _run(self, func, *args):
+        return await IOLoop.current().run_in_executor(None, func, *args)
+
+    async def _write(self, chunk: bytes):
+        self.write(chunk)
+        await self.flush()
+        if not self._started:
+            self._started = True
+            if self._cache.on_stream_start:
+                self._cache.on_stream_start(self._key)
+
+    async def get(self, key):
+        if not self._cache.is_valid_key(key):
+            raise tornado.web.HTTPError(404)
+
+        self._key = key
+
+        self.set_header("Accept-Ranges", "bytes")
+        range_header = self.request.headers.get("Range")
+        try:
+            path = self._cache.get_file(key)
+            if path:
+                await self._serve_file(path, range_header)
+                return
+
+            fill = self._cache.get_fill(key)
+            if not fill:
+                raise tornado.web.HTTPError(404)
+            if range_header:
+                # Seeks don't wait for the download in progress
+                await self._proxy_range(key, range_header)
+            else:
+                await self._serve_fill(key, fill)
+        except StreamClosedError:
+            logger.debug("Client of track %s disconnected", key)
+
+    async def _serve_file(self, path: str, range_header: Optional[str]):
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        if range_header:
+            byte_range = parse_range(range_header, size)
+            if not byte_range:
+                self.set_header("Content-Range", f"bytes */{size}")
+                raise tornado.web.HTTPError(416)
+
+            start, end = byte_range
+            self.set_status(206)
+            self.set_header("Content-Range", f"bytes {start}-{end}/{size}")
+
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.set_header("Content-Type", content_type)
+        self.set_header("Content-Length", end - start + 1)
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await self._write(chunk)
+
+    async def _serve_fill(self, key: str, fill: _Fill):
+        # Headers are known once the download has started
+        await self._run(fill.wait_for, 0, self._cache._timeout)
+        if fill.error:
+            raise tornado.web.HTTPError(502)
+
+        try:
+            # The temporary file stays readable after it is moved into the
+            # cache, once it is open
+            f = open(fill.tmp_file, "rb")
+        except FileNotFoundError:
+            # The download completed in the meantime
+            path = self._cache.get_file(key)
+            if not path:
+                raise tornado.web.HTTPError(502)
+
+            await self._serve_file(path, None)
+            return
+
+        self.set_header("Content-Type", fill.content_type)
+        if fill.size is not None:
+            self.set_header("Content-Length", fill.size)
+
+        with f:
+            position = 0
+            while await self._run(fill.wait_for, position, self._cache._timeout):
+                chunk = f.read(min(CHUNK_SIZE, fill.written - position))
+                position += len(chunk)
+                await self._write(chunk)
+
+        if fill.error or not fill.done:
+            # Completing the response would pass a truncated file off as a
+            # whole one: the client has to see the connection drop
+            logger.warning("Download of a track interrupted: closing the stream")
+            self.request.connection.close()
+
+    async def _proxy_range(self, key: str, range_header: str):
+        response = await self._run(self._cache.open_upstream, key, range_header)
+        if response is None:
+            path = self._cache.get_file(key)
+            if not path:
+                raise tornado.web.HTTPError(404)
+
+            await self._serve_file(path, range_header)
+            return
+
+        with response:
+            self.set_status(response.status_code)
+            for header in ("Content-Type", "Content-Length", "Content-Range"):
+                if header in response.headers:
+                    self.set_header(header, response.headers[header])
+
+            chunks = response.iter_content(CHUNK_SIZE)
+            while True:
+                chunk = await self._run(next, chunks, None)
+                if chunk is None:
+                    break
+                await self._write(chunk)
+
+
+def get_cache(config) -> AudioCache:
+    """
+    The audio cache shared by the playback provider and the HTTP handler.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache(
+                os.path.join(Extension.get_cache_dir(config), "audio_files"),
+                max_size=(config["tidal"].get("audio_cache_size_mb") or 1024)
+                * 1024
+                * 1024,
+            )
+        return _cache
+
+
+def close():
+    """
+    Close the audio cache, if it was created.
+    """
+    global _cache
+    with _cache_lock:
+        cache, _cache = _cache, None
+    if cache:
+        cache.close()
+
+
+def get_local_url(config, key: str) -> Optional[str]:
+    """
+    The URL of a track on the local proxy, or None if Mopidy doesn't serve
+    HTTP.
+    """
+    http_config = config.get("http") or {}
+    if not http_config.get("enabled", True) or not http_config.get("port"):
+        return None
+
+    hostname = http_config.get("hostname") or "127.0.0.1"
+    if hostname in {"::", "0.0.0.0"}:
+        hostname = "127.0.0.1"
+    if ":" in hostname:
+        hostname = f"[{hostname}]"
+    return f"http://{hostname}:{http_config['port']}{LOCAL_PREFIX}{key}"
+
+
+def factory(config, core):
+    if not config["tidal"].get("audio_proxy"):
+        return []
+
+    return [(r"/audio/(.+)", AudioHandler, {"cache": get_cache(config)})]
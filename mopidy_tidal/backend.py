@@ -3,15 +3,36 @@ from __future__ import unicode_literals
 import json
 import logging
 import os
+from functools import partial
 
 from mopidy import backend
 from pykka import ThreadingActor
 from tidalapi import Config, Quality, Session
 
-from mopidy_tidal import Extension, context, library, playback, playlists
+from mopidy_tidal import (
+    Extension,
+    aio,
+    audio_proxy,
+    caches,
+    context,
+    image_proxy,
+    lanes,
+    library,
+    playback,
+    playlists,
+)
+from mopidy_tidal.favorites import favorite_kinds
+from mopidy_tidal.scheduler import Scheduler
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for a running background job when the backend stops
+SCHEDULER_STOP_TIMEOUT = 5
+
+# Fraction of their TTL after which cached catalogs are refreshed, so that
+# they are replaced before they expire, whatever the jitter
+CATALOG_REFRESH_RATIO = 0.8
+
 
 def _connecting_log(msg: str, level="info"):
     getattr(logger, level)("Connecting to TIDAL... " + msg)
@@ -21,12 +42,17 @@ class TidalBackend(ThreadingActor, backend.Backend):
     def __init__(self, config, audio):
         super(TidalBackend, self).__init__()
         self._active_session = None
+        self._async_engine = None
         self._logged_in = False
         self._config = config
         context.set_config(self._config)
+        # Created before the providers, which share its caches
+        self.caches = caches.CacheRegistry()
         self.playback = playback.TidalPlaybackProvider(audio=audio, backend=self)
         self.library = library.TidalLibraryProvider(backend=self)
         self.playlists = playlists.TidalPlaylistsProvider(backend=self)
+        self.scheduler = Scheduler()
+        self.lanes = lanes.Lanes()
         self.uri_schemes = ["tidal"]
 
     @property
@@ -71,9 +97,64 @@ class TidalBackend(ThreadingActor, backend.Backend):
             _connecting_log("using default client id & client secret from python-tidal")
 
         self._active_session = Session(config)
+        if self._config["tidal"].get("async_engine"):
+            self._start_async_engine()
         if not self._config["tidal"]["lazy"]:
             self._login()
 
+        refresh_secs = self._config["tidal"].get("background_refresh_secs")
+        if refresh_secs:
+            self._schedule_refresh_jobs(refresh_secs)
+            self.scheduler.start()
+
+    def on_stop(self):
+        self.scheduler.stop(timeout=SCHEDULER_STOP_TIMEOUT)
+        self.lanes.close()
+        self.library.images.close()
+        self.library.favorites.close()
+        # Shared with the HTTP handlers, which are stopped first
+        image_proxy.close()
+        audio_proxy.close()
+        if self._async_engine:
+            aio.get_client().close()
+            aio.set_client(None)
+            self._async_engine.stop()
+            self._async_engine = None
+
+    def _when_logged_in(self, func):
+        # Background jobs never trigger a (possibly interactive) login
+        def job():
+            if self._logged_in:
+                func()
+
+        return job
+
+    def _schedule_refresh_jobs(self, interval: float):
+        for kind in favorite_kinds:
+            self.scheduler.add_job(
+                f"favorite_{kind}",
+                self._when_logged_in(partial(self.library.favorites.refresh, kind)),
+                interval,
+            )
+
+        self.scheduler.add_job(
+            "playlists", self._when_logged_in(self.playlists.sync), interval
+        )
+        catalog_ttl = self._config["tidal"].get("catalog_cache_ttl_secs")
+        if catalog_ttl:
+            for name in ("mixes", "moods", "genres"):
+                self.scheduler.add_job(
+                    name,
+                    self._when_logged_in(partial(self.library.refresh_catalog, name)),
+                    catalog_ttl * CATALOG_REFRESH_RATIO,
+                )
+
+    def _start_async_engine(self):
+        logger.info("Starting the asyncio I/O engine")
+        self._async_engine = aio.AsyncEngine()
+        self._async_engine.start()
+        aio.set_client(aio.TidalAsyncClient(self._async_engine, lambda: self.session))
+
     def _login(self):
         # Always store tidal-oauth cache in mopidy core config data_dir
         data_dir = Extension.get_data_dir(self._config)
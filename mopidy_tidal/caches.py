@@ -0,0 +1,35 @@
+from __future__ import unicode_literals
+
+import logging
+
+from mopidy_tidal.playlists import PlaylistCache, PlaylistMetadataCache
+
+logger = logging.getLogger(__name__)
+
+
+class CacheRegistry:
+    """
+    Caches shared by the providers of a backend, so that the library and the
+    playlists providers don't keep their own copies of the same playlists,
+    and a playlist changed through one of them is never served stale by the
+    other one.
+    """
+
+    def __init__(self, persist: bool = True):
+        """
+        :param persist: Whether the caches should be persisted to disk
+            (default: True)
+        """
+        # Playlists with their tracks
+        self.playlists = PlaylistCache(persist=persist)
+        # Metadata of the playlists of the user, for listing them
+        self.playlist_metadata = PlaylistMetadataCache(persist=persist)
+
+    def invalidate_playlist(self, *uris: str):
+        """
+        Drop playlists from all the caches, so that the next read fetches
+        them again.
+        """
+        logger.debug("Invalidating playlists %r", uris)
+        self.playlists.prune(*uris)
+        self.playlist_metadata.prune(*uris)
@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T", bound=Hashable)
+
+# Least number of edits searched for the shortest edit script. The search
+# goes on up to an eighth of the total length of the sequences
+MIN_MAX_EDITS = 1000
+
+
+def diff(
+    old: Sequence[T], new: Sequence[T], max_edits: Optional[int] = None
+) -> Tuple[List[int], List[Tuple[int, T]]]:
+    """
+    The shortest edit script turning `old` into `new` (Myers' algorithm, in
+    O((N+M)·D) time and O(D²) space for D edits).
+
+    Returns the indices of the items of `old` to remove, and the items to
+    insert with their indices in `new`, both in ascending order. Applying
+    the removals to `old` and then the insertions in order gives `new`.
+
+    If more than `max_edits` edits are needed (default: the larger of
+    `MIN_MAX_EDITS` and (N+M)/8), a script that keeps a common subsequence
+    found greedily is returned instead, in O((N+M)·log N) time. It may be
+    longer than the shortest one, but never removes and inserts all the
+    items unless they have nothing in common.
+    """
+    # The common prefix and suffix are no edits
+    start = 0
+    while start < len(old) and start < len(new) and old[start] == new[start]:
+        start += 1
+
+    end_old, end_new = len(old), len(new)
+    while end_old > start and end_new > start and old[end_old - 1] == new[end_new - 1]:
+        end_old -= 1
+        end_new -= 1
+
+    a, b = old[start:end_old], new[start:end_new]
+    n, m = len(a), len(b)
+    if not n or not m:
+        return (
+            [start + i for i in range(n)],
+            [(start + i, item) for i, item in enumerate(b)],
+        )
+
+    if max_edits is None:
+        max_edits = max(MIN_MAX_EDITS, (len(old) + len(new)) // 8)
+    max_d = min(n + m, max_edits)
+    # Furthest x reached on each diagonal k = x - y, at v[offset + k]. Only
+    # the diagonals -d..d reached after each edit count d are kept for the
+    # backtracking
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace: List[List[int]] = []
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, a, b, start)
+
+        trace.append(v[offset - d : offset + d + 1 : 2])
+
+    return _greedy(a, b, start)
+
+
+def _greedy(a, b, start) -> Tuple[List[int], List[Tuple[int, T]]]:
+    # Match each item of `b` with its next occurrence in `a`, if any
+    positions: Dict[T, List[int]] = {}
+    for i, item in enumerate(a):
+        positions.setdefault(item, []).append(i)
+
+    removed, inserted = [], []
+    x = 0
+    for y, item in enumerate(b):
+        indices = positions.get(item, [])
+        i = bisect_left(indices, x)
+        if i == len(indices):
+            inserted.append((start + y, item))
+            continue
+
+        removed.extend(range(start + x, start + indices[i]))
+        x = indices[i] + 1
+
+    removed.extend(range(start + x, start + len(a)))
+    return removed, inserted
+
+
+def _backtrack(trace, a, b, start) -> Tuple[List[int], List[Tuple[int, T]]]:
+    removed, inserted = [], []
+    x, y = len(a), len(b)
+    for d in range(len(trace), 0, -1):
+        # Diagonals -(d-1)..d-1 reached with one edit less
+        prev = trace[d - 1]
+        k = x - y
+        if k == -d or (
+            k != d and prev[(k - 1 + d - 1) // 2] < prev[(k + 1 + d - 1) // 2]
+        ):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+
+        prev_x = prev[(prev_k + d - 1) // 2]
+        prev_y = prev_x - prev_k
+        if prev_k == k + 1:
+            inserted.append((start + prev_y, b[prev_y]))
+        else:
+            removed.append(start + prev_x)
+        x, y = prev_x, prev_y
+
+    removed.reverse()
+    inserted.reverse()
+    return removed, inserted
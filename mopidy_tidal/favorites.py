@@ -0,0 +1,207 @@
+from __future__ import unicode_literals
+
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+from mopidy.models import Ref
+from requests.exceptions import HTTPError
+
+from mopidy_tidal import ref_models_mappers
+from mopidy_tidal.lru_cache import LruCache
+from mopidy_tidal.workers import current_deadline, get_items
+
+logger = logging.getLogger(__name__)
+
+# Mappers of the refs of each kind of favorites
+favorite_kinds = {
+    "artists": ref_models_mappers.create_artists,
+    "albums": ref_models_mappers.create_albums,
+    "tracks": ref_models_mappers.create_tracks,
+}
+
+# Parsers of the favorites of each kind, on the TIDAL session
+favorite_parsers = {
+    "artists": "parse_artist",
+    "albums": "parse_album",
+    "tracks": "parse_track",
+}
+
+# Order in which the favorites are listed: the most recently added first.
+# tidalapi < 0.8.4 can't order them, so they are requested directly
+favorite_order = {"order": "DATE", "orderDirection": "DESC"}
+
+
+class FavoritesSnapshots:
+    """
+    Snapshots of the favorite artists, albums and tracks of the user, kept on
+    disk and served without waiting for the API. Each time a snapshot is
+    served, it is refreshed in the background: the number of favorites and
+    the most recently added ones are compared with the snapshot, and only
+    the new items are fetched. Any other change triggers a full resync.
+    """
+
+    def __init__(self, session_getter: Callable, head_size: int = 50):
+        """
+        :param session_getter: Returns the current TIDAL session
+        :param head_size: Number of known favorites that must match the
+            snapshot for an incremental update, and page size of the
+            incremental fetches (default: 50)
+        """
+        self._session_getter = session_getter
+        self._head_size = head_size
+        self._snapshots = LruCache(directory="favorites")
+        self._lock = Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.full_syncs = 0
+
+    def _key(self, kind: str) -> str:
+        return f"tidal:favorites:{kind}:{self._session_getter().user.id}"
+
+    def _get_snapshot(self, kind: str) -> Optional[List[Ref]]:
+        with self._lock:
+            return self._snapshots.get(self._key(kind))
+
+    def get(self, kind: str) -> List[Ref]:
+        """
+        The favorites of `kind` ("artists", "albums" or "tracks"), newest
+        first. They are only fetched synchronously if there's no snapshot.
+        """
+        refs = self._get_snapshot(kind)
+        if refs is None:
+            return self.refresh(kind)
+
+        self._refresh_in_background(kind)
+        return refs
+
+    def refresh(self, kind: str) -> List[Ref]:
+        """
+        Bring the snapshot of `kind` up to date, at most once across
+        concurrent callers, and return it.
+        """
+        with self._lock:
+            future = self._in_flight.get(kind)
+            owner = future is None
+            if owner:
+                future = self._in_flight[kind] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            refs = self._sync(kind)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(refs)
+        finally:
+            with self._lock:
+                self._in_flight.pop(kind, None)
+
+        return refs
+
+    def _refresh_in_background(self, kind: str):
+        with self._lock:
+            if kind in self._in_flight:
+                return
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    1, thread_name_prefix="mopidy-tidal-favorites-"
+                )
+            pool = self._pool
+
+        pool.submit(self._refresh_quietly, kind)
+
+    def _refresh_quietly(self, kind: str):
+        try:
+            self.refresh(kind)
+        except (HTTPError, OSError) as e:
+            logger.warning("Could not refresh the favorite %s: %s", kind, e)
+
+    def _sync(self, kind: str) -> List[Ref]:
+        favorites = self._session_getter().user.favorites
+        snapshot = self._get_snapshot(kind)
+        count = self._count(favorites, kind)
+        refs = None
+        if snapshot is not None:
+            refs = self._update(favorites, kind, snapshot, count)
+
+        if refs is None:
+            logger.info("Fetching all the favorite %s", kind)
+            self.full_syncs += 1
+            refs = self._fetch_all(favorites, kind)
+            if len(refs) < count or current_deadline().expired:
+                # Partial results (e.g. the deadline expired) aren't stored
+                return refs
+
+        if refs is not snapshot:
+            with self._lock:
+                self._snapshots[self._key(kind)] = refs
+
+        return refs
+
+    @staticmethod
+    def _count(favorites, kind: str) -> int:
+        # The total is returned with any page, even of a single item
+        response = favorites.requests.request(
+            "GET", f"{favorites.base_url}/{kind}", params={"limit": 1}
+        )
+        return response.json()["totalNumberOfItems"]
+
+    @staticmethod
+    def _fetch_page(favorites, kind: str, limit: int, offset: int) -> List:
+        return favorites.requests.map_request(
+            f"{favorites.base_url}/{kind}",
+            params={"limit": limit, "offset": offset, **favorite_order},
+            parse=getattr(favorites.session, favorite_parsers[kind]),
+        )
+
+    def _fetch_all(self, favorites, kind: str) -> List[Ref]:
+        def favorites_page(limit, offset):
+            return self._fetch_page(favorites, kind, limit, offset)
+
+        return favorite_kinds[kind](get_items(favorites_page))
+
+    def _update(
+        self, favorites, kind: str, snapshot: List[Ref], count: int
+    ) -> Optional[List[Ref]]:
+        """
+        Add the new favorites to `snapshot`, or return None if the favorites
+        changed in any other way.
+        """
+        new = count - len(snapshot)
+        if new < 0:
+            return None
+
+        # The new favorites come first, followed by the known ones
+        needed = new + min(len(snapshot), self._head_size)
+        mapper = favorite_kinds[kind]
+        head = []
+        while len(head) < needed:
+            page = self._fetch_page(favorites, kind, self._head_size, len(head))
+            head.extend(mapper(page))
+            if len(page) < self._head_size:
+                break
+
+        known = head[new:needed]
+        if len(head) < needed or [r.uri for r in known] != [
+            r.uri for r in snapshot[: len(known)]
+        ]:
+            logger.debug("The favorite %s changed: resyncing them", kind)
+            return None
+
+        if not new:
+            return snapshot
+
+        logger.debug("Adding %d new favorite %s", new, kind)
+        return head[:new] + snapshot
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -5,6 +5,7 @@ import logging
 from mopidy.models import Album, Artist, Playlist, Track
 
 from mopidy_tidal.helpers import to_timestamp
+from mopidy_tidal.images import image_ids
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +29,9 @@ def create_mopidy_artist(tidal_artist):
     if tidal_artist is None:
         return None
 
-    return Artist(uri="tidal:artist:" + str(tidal_artist.id), name=tidal_artist.name)
+    uri = "tidal:artist:" + str(tidal_artist.id)
+    image_ids.add(uri, tidal_artist)
+    return Artist(uri=uri, name=tidal_artist.name)
 
 
 def create_mopidy_albums(tidal_albums):
@@ -39,8 +42,10 @@ def create_mopidy_album(tidal_album, artist):
     if artist is None:
         artist = create_mopidy_artist(tidal_album.artist)
 
+    uri = "tidal:album:" + str(tidal_album.id)
+    image_ids.add(uri, tidal_album)
     return Album(
-        uri="tidal:album:" + str(tidal_album.id),
+        uri=uri,
         name=tidal_album.name,
         artists=[artist],
         date=_get_release_date(tidal_album),
@@ -75,8 +80,10 @@ def create_mopidy_track(artist, album, tidal_track):
 
 
 def create_mopidy_playlist(tidal_playlist, tidal_tracks):
+    uri = f"tidal:playlist:{tidal_playlist.id}"
+    image_ids.add(uri, tidal_playlist)
     return Playlist(
-        uri=f"tidal:playlist:{tidal_playlist.id}",
+        uri=uri,
         name=tidal_playlist.name,
         tracks=tidal_tracks,
         last_modified=to_timestamp(tidal_playlist.last_updated),
@@ -0,0 +1,232 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import pathlib
+import re
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, Optional
+
+import requests
+import tornado.web
+from mopidy.models import Image
+from tornado.ioloop import IOLoop
+
+from mopidy_tidal import Extension
+
+logger = logging.getLogger(__name__)
+
+# Images are fetched from here. Local URLs keep the same path.
+IMAGE_ORIGIN = "https://resources.tidal.com/images/"
+LOCAL_PREFIX = "/tidal/images/"
+
+# Sizes stored along with any image when thumbnails are enabled. They are
+# available for albums, artists and playlists alike.
+THUMBNAIL_SIZES = (160, 320)
+
+_path_re = re.compile(
+    r"^(?P<image_id>[0-9a-fA-F]+(?:/[0-9a-fA-F]+)*)/(\d+)x(\d+)\.jpg$"
+)
+
+_store: Optional["ImageStore"] = None
+_store_lock = Lock()
+
+
+def is_served(config) -> bool:
+    """
+    Whether Mopidy serves HTTP, so that the local image URLs are reachable.
+    """
+    http_config = config.get("http") or {}
+    return bool(http_config.get("enabled", True) and http_config.get("port"))
+
+
+def local_image(image: Image) -> Image:
+    """
+    Point an image served by the TIDAL origin to the local proxy.
+    """
+    if not image.uri.startswith(IMAGE_ORIGIN):
+        return image
+    return image.replace(uri=LOCAL_PREFIX + image.uri[len(IMAGE_ORIGIN) :])
+
+
+class ImageNotFound(Exception):
+    pass
+
+
+class ImageStore:
+    """
+    Disk cache of the image files of the TIDAL image origin. Misses are
+    fetched upstream once, however many clients ask for the same file at
+    the same time.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        origin: str = IMAGE_ORIGIN,
+        thumbnails: bool = False,
+        timeout: float = 10,
+    ):
+        self._cache_dir = cache_dir
+        self._origin = origin
+        self._thumbnails = thumbnails
+        self._timeout = timeout
+        self._lock = Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._http = requests.Session()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.fetches = 0
+
+    @staticmethod
+    def is_valid_path(path: str) -> bool:
+        return bool(_path_re.match(path))
+
+    def _file(self, path: str) -> str:
+        return os.path.join(self._cache_dir, *path.split("/"))
+
+    def get(self, path: str) -> bytes:
+        """
+        The content of the image file at `path`, relative to the origin.
+
+        :raises ImageNotFound: If the path is invalid or the origin has no
+            such image.
+        """
+        return self._get(path, store_thumbnails=self._thumbnails)
+
+    def _get(self, path: str, store_thumbnails: bool) -> bytes:
+        if not self.is_valid_path(path):
+            raise ImageNotFound(path)
+
+        cache_file = self._file(path)
+        if os.path.isfile(cache_file):
+            with open(cache_file, "rb") as f:
+                return f.read()
+
+        with self._lock:
+            future = self._in_flight.get(path)
+            owner = future is None
+            if owner:
+                future = self._in_flight[path] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            content = self._fetch(path)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(content)
+        finally:
+            with self._lock:
+                self._in_flight.pop(path, None)
+
+        if store_thumbnails:
+            self._store_thumbnails(path)
+        return content
+
+    def _fetch(self, path: str) -> bytes:
+        # Another caller may have stored the file in the meantime
+        cache_file = self._file(path)
+        if os.path.isfile(cache_file):
+            with open(cache_file, "rb") as f:
+                return f.read()
+
+        logger.debug("Fetching image %s from the origin", path)
+        self.fetches += 1
+        response = self._http.get(self._origin + path, timeout=self._timeout)
+        if response.status_code == 404:
+            raise ImageNotFound(path)
+        response.raise_for_status()
+
+        # Write to a temporary file first, so readers never see partial files
+        pathlib.Path(cache_file).parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        with os.fdopen(fd, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_file, cache_file)
+        return response.content
+
+    def _store_thumbnails(self, path: str):
+        image_id = _path_re.match(path).group("image_id")
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    2, thread_name_prefix="mopidy-tidal-thumbnails-"
+                )
+
+        for size in THUMBNAIL_SIZES:
+            thumbnail_path = f"{image_id}/{size}x{size}.jpg"
+            if thumbnail_path != path and not os.path.isfile(
+                self._file(thumbnail_path)
+            ):
+                self._pool.submit(self._store_thumbnail, thumbnail_path)
+
+    def _store_thumbnail(self, path: str):
+        try:
+            self._get(path, store_thumbnails=False)
+        except Exception as e:
+            logger.debug("Could not store the thumbnail %s: %s", path, e)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._http.close()
+
+
+class ImageHandler(tornado.web.RequestHandler):
+    def initialize(self, store: ImageStore):
+        self._store = store
+
+    async def get(self, path):
+        try:
+            content = await IOLoop.current().run_in_executor(
+                None, self._store.get, path
+            )
+        except ImageNotFound:
+            raise tornado.web.HTTPError(404)
+        except requests.RequestException as e:
+            logger.warning("Could not fetch image %s: %s", path, e)
+            raise tornado.web.HTTPError(502)
+
+        # Image files never change for a given path
+        self.set_header("Content-Type", "image/jpeg")
+        self.set_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.write(content)
+
+
+def get_store(config) -> ImageStore:
+    """
+    The image store of the HTTP handler, closed with the backend.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore(
+                os.path.join(Extension.get_cache_dir(config), "image_files"),
+                thumbnails=bool(config["tidal"].get("image_proxy_thumbnails")),
+            )
+        return _store
+
+
+def close():
+    """
+    Close the image store, if it was created.
+    """
+    global _store
+    with _store_lock:
+        store, _store = _store, None
+    if store:
+        store.close()
+
+
+def factory(config, core):
+    if not config["tidal"].get("image_proxy"):
+        return []
+
+    return [(r"/images/(.+)", ImageHandler, {"store": get_store(config)})]
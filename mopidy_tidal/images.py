@@ -0,0 +1,368 @@
+from __future__ import unicode_literals
+
+import concurrent.futures
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from mopidy.models import Image
+from requests.exceptions import HTTPError
+
+from mopidy_tidal import aio
+from mopidy_tidal.lru_cache import LruCache, TrackCache
+from mopidy_tidal.workers import current_deadline, map_within_deadline
+
+logger = logging.getLogger(__name__)
+
+_image_errors = (
+    AssertionError,
+    AttributeError,
+    HTTPError,
+    OSError,
+    concurrent.futures.TimeoutError,
+)
+
+# Same format as tidalapi's `Config.image_url`
+IMAGE_URL = "https://resources.tidal.com/images/%s/%ux%u.jpg"
+
+# Attribute holding the image ID of each item type, and the image sizes
+# available for it, from the largest to the smallest
+image_types = {
+    "album": ("cover", (1280, 640, 320, 160, 80)),
+    "artist": ("picture", (750, 480, 320, 160)),
+    "playlist": ("square_picture", (1080, 750, 640, 480, 320, 160)),
+}
+
+# Sizes tried on items of unknown types
+default_image_sizes = (750, 640, 480)
+
+
+def get_image_id(item_type: str, tidal_obj) -> Optional[str]:
+    attr = image_types.get(item_type, (None,))[0]
+    image_id = getattr(tidal_obj, attr, None) if attr else None
+    return image_id if isinstance(image_id, str) and image_id else None
+
+
+def create_images(item_type: str, image_id: str) -> List[Image]:
+    """
+    The images of all the sizes available for an item, given its image ID.
+    """
+    path = image_id.replace("-", "/")
+    return [
+        Image(uri=IMAGE_URL % (path, size, size), width=size, height=size)
+        for size in image_types[item_type][1]
+    ]
+
+
+class ImageIdRegistry:
+    """
+    The image IDs (album covers, artist and playlist pictures) of the items
+    mapped so far. The image URLs of an item can be derived locally from its
+    image ID, without fetching the item from the API again.
+    """
+
+    def __init__(self, max_size: int = 16384):
+        self._max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = Lock()
+        self.avoided_calls = 0
+
+    def add(self, uri: str, tidal_obj):
+        """
+        Record the image ID of a TIDAL object, if it has any.
+        """
+        image_id = get_image_id(uri.split(":")[1], tidal_obj)
+        if not image_id:
+            return
+
+        with self._lock:
+            self._ids[uri] = image_id
+            self._ids.move_to_end(uri)
+            while len(self._ids) > self._max_size:
+                self._ids.popitem(last=False)
+
+    def get_images(self, uri: str) -> Optional[List[Image]]:
+        """
+        Build the images of `uri` from its image ID, or return None if the ID
+        isn't known.
+        """
+        with self._lock:
+            image_id = self._ids.get(uri)
+            if not image_id:
+                return None
+            self.avoided_calls += 1
+
+        return create_images(uri.split(":")[1], image_id)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+image_ids = ImageIdRegistry()
+
+
+class ImagesGetter:
+    def __init__(
+        self,
+        session=None,
+        track_cache: Optional[TrackCache] = None,
+        session_getter: Optional[Callable] = None,
+    ):
+        self._session_getter = session_getter or (lambda: session)
+        self._track_cache = track_cache
+        self._image_cache = LruCache(directory="image")
+
+    @property
+    def _session(self):
+        return self._session_getter()
+
+    @staticmethod
+    def _log_image_not_found(obj):
+        logger.debug(
+            'No images available for %s "%s"',
+            type(obj).__name__,
+            getattr(obj, "name", getattr(obj, "title", getattr(obj, "id"))),
+        )
+
+    @classmethod
+    def _get_item_images(cls, item_type: str, obj) -> List[Image]:
+        if not hasattr(obj, "image"):
+            cls._log_image_not_found(obj)
+            return []
+
+        # Handle artists with missing images
+        if hasattr(obj, "picture") and getattr(obj, "picture", None) is None:
+            cls._log_image_not_found(obj)
+            return []
+
+        image_id = get_image_id(item_type, obj)
+        if image_id:
+            return create_images(item_type, image_id)
+
+        # No image ID to build the URLs from: let tidalapi build them
+        images = []
+        sizes = image_types.get(item_type, (None, default_image_sizes))[1]
+        for size in sizes:
+            try:
+                images.append(Image(uri=obj.image(size), width=size, height=size))
+            except ValueError:
+                pass
+
+        if not images:
+            cls._log_image_not_found(obj)
+        return images
+
+    def _get_api_getter(self, item_type: str):
+        client = aio.get_client()
+        if client and item_type in {"album", "artist", "playlist"}:
+            return lambda item_id: client.run(
+                client.get_item(item_type, item_id),
+                timeout=current_deadline().remaining(),
+            )
+        return getattr(self._session, item_type, None)
+
+    def _get_album_id(self, track_id: str, fetch: bool = True) -> Optional[str]:
+        album_id = self._track_cache and self._track_cache.get_album_id(track_id)
+        if not album_id and fetch:
+            album_id = str(self._session.track(track_id).album.id)
+        return album_id
+
+    def get_image_key(self, uri: str, fetch: bool = True) -> Optional[str]:
+        """
+        The URI of the item that holds the images of `uri`: tracks share the
+        images of their album. If `fetch` is False, None is returned when the
+        album of a track isn't known without an API call.
+        """
+        assert uri.startswith("tidal:"), f"Invalid TIDAL URI: {uri}"
+
+        parts = uri.split(":")
+        if parts[1] != "track":
+            return uri
+
+        # For tracks, retrieve the artwork of the associated album
+        album_id = parts[3] if len(parts) == 5 else self._get_album_id(parts[2], fetch)
+        return ":".join([parts[0], "album", album_id]) if album_id else None
+
+    def get_cached_images(self, key: str) -> Optional[List[Image]]:
+        return self._image_cache.get(key)
+
+    def _get_images(self, uri) -> List[Image]:
+        uri = self.get_image_key(uri)
+        if uri in self._image_cache:
+            # Cache hit
+            return self._image_cache[uri]
+
+        return self._fetch_images(uri)
+
+    def _fetch_images(self, uri) -> List[Image]:
+        images = image_ids.get_images(uri)
+        if images:
+            logger.debug(
+                "Image URLs for %r derived from its image ID (%d API calls avoided)",
+                uri,
+                image_ids.avoided_calls,
+            )
+            return images
+
+        parts = uri.split(":")
+        item_type, item_id = parts[1], parts[2]
+
+        logger.debug("Retrieving %r from the API", uri)
+        getter = self._get_api_getter(item_type)
+        if not getter:
+            logger.warning("The API item type %s has no session getters", item_type)
+            return []
+
+        item = getter(item_id)
+        if not item:
+            logger.debug("%r is not available on the backend", uri)
+            return []
+
+        images = self._get_item_images(item_type, item)
+        if not images:
+            logger.debug("%r has no associated images", uri)
+            return []
+
+        logger.debug("Image URLs for %r: %r", uri, [img.uri for img in images])
+        return images
+
+    def __call__(self, uri: str) -> Tuple[str, List[Image]]:
+        try:
+            return uri, self._get_images(uri)
+        except _image_errors as err:
+            logger.error("%s when processing URI %r: %s", type(err), uri, err)
+            return uri, []
+
+    def cache_update(self, images):
+        self._image_cache.update(images)
+
+
+class ImagesService(ImagesGetter):
+    """
+    Image resolver that lives as long as the backend. It keeps the image
+    cache warm in memory and reuses the same worker pool across requests.
+    URIs that share the same images (e.g. the tracks of an album) are
+    resolved once, and a request for an item that is already being
+    resolved by another caller waits for that result instead of issuing a
+    new API call. New entries are persisted in batches.
+    """
+
+    def __init__(self, *args, processes: int = 4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._processes = processes
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._pending: Dict[str, List[Image]] = {}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    self._processes, thread_name_prefix="mopidy-tidal-images-"
+                )
+            return self._pool
+
+    def _resolve(self, key: str) -> List[Image]:
+        """
+        Resolve the images of `key` at most once across concurrent callers.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                # Another caller may have just resolved it
+                images = self._image_cache.get(key)
+                if images is not None:
+                    return images
+
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        images = []
+        try:
+            images = self._fetch_images(key)
+            # Store the images in memory now, and on disk with the next batch
+            with self._lock:
+                self._image_cache.__setitem__(key, images, _sync_to_fs=False)
+                self._pending[key] = images
+        except _image_errors as err:
+            logger.error("%s when processing URI %r: %s", type(err), key, err)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_result(images)
+
+        return images
+
+    def _resolve_uri(self, uri: str) -> List[Image]:
+        try:
+            key = self.get_image_key(uri)
+        except _image_errors as err:
+            logger.error("%s when processing URI %r: %s", type(err), uri, err)
+            return []
+
+        images = self.get_cached_images(key)
+        return self._resolve(key) if images is None else images
+
+    def get_cached_images(self, key: str) -> Optional[List[Image]]:
+        with self._lock:
+            return super().get_cached_images(key)
+
+    def flush(self):
+        """
+        Persist the entries resolved since the last flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if pending:
+            with self._lock:
+                self._image_cache.update(pending)
+
+    def get_images(self, uris) -> Mapping[str, List[Image]]:
+        keys = {}
+        for uri in uris:
+            try:
+                keys[uri] = self.get_image_key(uri, fetch=False)
+            except _image_errors as err:
+                logger.error("%s when processing URI %r: %s", type(err), uri, err)
+                keys[uri] = None
+
+        images = {}
+        for uri, key in keys.items():
+            cached_images = self.get_cached_images(key) if key else None
+            if cached_images is not None:
+                images[uri] = cached_images
+
+        # Resolve each missing item only once. URIs whose item isn't known
+        # yet (e.g. short track URIs) are resolved on their own
+        tasks = {}
+        for uri, key in keys.items():
+            if uri not in images and uri.startswith("tidal:"):
+                tasks.setdefault(key or uri, []).append(uri)
+
+        results = map_within_deadline(self.pool, self._resolve_uri, tasks.keys())
+
+        # Items that weren't resolved in time are returned empty
+        for (key, task_uris), key_images in zip(tasks.items(), results):
+            for uri in task_uris:
+                images[uri] = key_images or []
+
+        self.flush()
+        return {uri: images.get(uri, []) for uri in uris}
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.flush()
@@ -0,0 +1,100 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Priority classes of the background provider work, from the most urgent.
+# Stream URLs of the tracks being played are resolved by the backend actor
+# itself, which is kept free of the work of these lanes.
+PREFETCH = "prefetch"
+BULK = "bulk"
+
+# Number of workers of each lane
+default_lanes = {
+    PREFETCH: 2,
+    BULK: 1,
+}
+
+
+class LaneStats:
+    def __init__(self):
+        self.tasks = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.tasks if self.tasks else 0.0
+
+    def __repr__(self):
+        return (
+            f"LaneStats(tasks={self.tasks}, mean_wait={self.mean_wait:.3f}, "
+            f"max_wait={self.max_wait:.3f})"
+        )
+
+
+class Lanes:
+    """
+    One worker pool per priority class, so that work of a class never queues
+    behind work of another one: stream URLs are prefetched on the prefetch
+    lane while long playlist refreshes run on the bulk lane. The time each task
+    waits in the queue of its lane is measured.
+    """
+
+    def __init__(self, lanes: Optional[Dict[str, int]] = None, slow_wait: float = 1):
+        """
+        :param lanes: Number of workers of each lane, by priority class
+            (default: `default_lanes`)
+        :param slow_wait: Queue waits longer than this many seconds are
+            logged (default: 1)
+        """
+        self._sizes = dict(lanes or default_lanes)
+        self._slow_wait = slow_wait
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self._lock = Lock()
+        self.stats = {lane: LaneStats() for lane in self._sizes}
+
+    def _pool(self, lane: str) -> ThreadPoolExecutor:
+        with self._lock:
+            pool = self._pools.get(lane)
+            if pool is None:
+                pool = self._pools[lane] = ThreadPoolExecutor(
+                    self._sizes[lane], thread_name_prefix=f"mopidy-tidal-{lane}-"
+                )
+            return pool
+
+    def _record_wait(self, lane: str, wait: float):
+        with self._lock:
+            stats = self.stats[lane]
+            stats.tasks += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+
+        if wait >= self._slow_wait:
+            logger.info("A %s task waited %.2fs in the queue", lane, wait)
+
+    def submit(self, lane: str, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queue `func(*args, **kwargs)` on `lane`.
+        """
+        queued_at = time.monotonic()
+
+        def task():
+            self._record_wait(lane, time.monotonic() - queued_at)
+            return func(*args, **kwargs)
+
+        return self._pool(lane).submit(task)
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+
+        for pool in pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        logger.debug("Provider lanes: %r", self.stats)
@@ -1,110 +1,38 @@
 from __future__ import unicode_literals
 
+import concurrent.futures
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Tuple
+from collections import OrderedDict
+from functools import partial
+from types import SimpleNamespace
+from typing import List, Mapping, Optional, Tuple
 
 from mopidy import backend, models
 from mopidy.models import Image, SearchResult
 from requests.exceptions import HTTPError
 
-from mopidy_tidal import full_models_mappers, ref_models_mappers
-from mopidy_tidal.lru_cache import LruCache
-from mopidy_tidal.playlists import PlaylistMetadataCache
+from mopidy_tidal import (
+    aio,
+    context,
+    full_models_mappers,
+    image_proxy,
+    ref_models_mappers,
+)
+from mopidy_tidal.favorites import FavoritesSnapshots
+from mopidy_tidal.images import ImagesGetter, ImagesService  # noqa: F401
+from mopidy_tidal.lru_cache import AlbumTracksIndex, LruCache, TrackCache, TtlCache
 from mopidy_tidal.utils import apply_watermark
-from mopidy_tidal.workers import get_items
+from mopidy_tidal.workers import (
+    current_deadline,
+    get_items,
+    map_within_deadline,
+    with_deadline,
+    worker_pool,
+)
 
 logger = logging.getLogger(__name__)
 
 
-class ImagesGetter:
-    def __init__(self, session):
-        self._session = session
-        self._image_cache = LruCache(directory="image")
-
-    @staticmethod
-    def _log_image_not_found(obj):
-        logger.debug(
-            'No images available for %s "%s"',
-            type(obj).__name__,
-            getattr(obj, "name", getattr(obj, "title", getattr(obj, "id"))),
-        )
-
-    @classmethod
-    def _get_image_uri(cls, obj):
-        method = None
-
-        if hasattr(obj, "image"):
-            # Handle artists with missing images
-            if hasattr(obj, "picture") and getattr(obj, "picture", None) is None:
-                cls._log_image_not_found(obj)
-                return
-
-            method = obj.image
-        else:
-            cls._log_image_not_found(obj)
-            return
-
-        dimensions = (750, 640, 480)
-        for dim in dimensions:
-            args = (dim,)
-            try:
-                return method(*args)
-            except ValueError:
-                pass
-
-        cls._log_image_not_found(obj)
-
-    def _get_api_getter(self, item_type: str):
-        return getattr(self._session, item_type, None)
-
-    def _get_images(self, uri) -> List[Image]:
-        assert uri.startswith("tidal:"), f"Invalid TIDAL URI: {uri}"
-
-        parts = uri.split(":")
-        item_type = parts[1]
-        if item_type == "track":
-            # For tracks, retrieve the artwork of the associated album
-            item_type = "album"
-            item_id = parts[3]
-            uri = ":".join([parts[0], "album", parts[3]])
-        else:
-            item_id = parts[2]
-
-        if uri in self._image_cache:
-            # Cache hit
-            return self._image_cache[uri]
-
-        logger.debug("Retrieving %r from the API", uri)
-        getter = self._get_api_getter(item_type)
-        if not getter:
-            logger.warning("The API item type %s has no session getters", item_type)
-            return []
-
-        item = getter(item_id)
-        if not item:
-            logger.debug("%r is not available on the backend", uri)
-            return []
-
-        img_uri = self._get_image_uri(item)
-        if not img_uri:
-            logger.debug("%r has no associated images", uri)
-            return []
-
-        logger.debug("Image URL for %r: %r", uri, img_uri)
-        return [Image(uri=img_uri, width=320, height=320)]
-
-    def __call__(self, uri: str) -> Tuple[str, List[Image]]:
-        try:
-            return uri, self._get_images(uri)
-        except (AssertionError, AttributeError, HTTPError) as err:
-            logger.error("%s when processing URI %r: %s", type(err), uri, err)
-            return uri, []
-
-    def cache_update(self, images):
-        self._image_cache.update(images)
-
-
 class TidalLibraryProvider(backend.LibraryProvider):
     root_directory = models.Ref.directory(uri="tidal:directory", name="Tidal")
 
@@ -112,8 +40,18 @@ class TidalLibraryProvider(backend.LibraryProvider):
         super(TidalLibraryProvider, self).__init__(*args, **kwargs)
         self._artist_cache = LruCache()
         self._album_cache = LruCache()
-        self._track_cache = LruCache()
-        self._playlist_cache = PlaylistMetadataCache()
+        self._track_cache = TrackCache()
+        # Shared with the playlists provider
+        self._playlist_cache = self.backend.caches.playlists
+        self._album_tracks_index = AlbumTracksIndex()
+        catalog_ttl = context.get_config()["tidal"].get("catalog_cache_ttl_secs") or 0
+        self._catalog_cache = TtlCache(catalog_ttl, directory="catalog")
+        self._artist_browse_cache = TtlCache(catalog_ttl, directory="artist_browse")
+        self.favorites = FavoritesSnapshots(session_getter=lambda: self._session)
+        self.images = ImagesService(
+            track_cache=self._track_cache, session_getter=lambda: self._session
+        )
+        self._lookup_workers = 4
 
     @property
     def _session(self):
@@ -160,6 +98,7 @@ class TidalLibraryProvider(backend.LibraryProvider):
 
         return []
 
+    @with_deadline("browse")
     def browse(self, uri):
         logger.info("Browsing uri %s", uri)
         if not uri or not uri.startswith("tidal:"):
@@ -173,25 +112,21 @@ class TidalLibraryProvider(backend.LibraryProvider):
             return ref_models_mappers.create_root()
 
         elif uri == "tidal:my_artists":
-            return ref_models_mappers.create_artists(
-                get_items(session.user.favorites.artists)
-            )
+            return self.favorites.get("artists")
         elif uri == "tidal:my_albums":
-            return ref_models_mappers.create_albums(
-                get_items(session.user.favorites.albums)
-            )
+            return self.favorites.get("albums")
         elif uri == "tidal:my_playlists":
             return self.backend.playlists.as_list()
         elif uri == "tidal:my_tracks":
-            return ref_models_mappers.create_tracks(
-                get_items(session.user.favorites.tracks)
-            )
+            return self.favorites.get("tracks")
         elif uri == "tidal:moods":
-            return ref_models_mappers.create_moods(session.moods())
+            return ref_models_mappers.create_moods(self._get_catalog("moods").values())
         elif uri == "tidal:mixes":
-            return ref_models_mappers.create_mixes([m for m in session.mixes()])
+            return ref_models_mappers.create_mixes(self._get_catalog("mixes").values())
         elif uri == "tidal:genres":
-            return ref_models_mappers.create_genres(session.genre.get_genres())
+            return ref_models_mappers.create_genres(
+                self._get_catalog("genres").values()
+            )
 
         # details
 
@@ -199,20 +134,13 @@ class TidalLibraryProvider(backend.LibraryProvider):
         nr_of_parts = len(parts)
 
         if nr_of_parts == 3 and parts[1] == "album":
-            return ref_models_mappers.create_tracks(
-                self._get_album_tracks(session, parts[2])
-            )
+            return [
+                models.Ref.track(uri=track.uri, name=track.name)
+                for track in self._get_indexed_album_tracks(session, parts[2])
+            ]
 
         if nr_of_parts == 3 and parts[1] == "artist":
-            top_10_tracks = ref_models_mappers.create_tracks(
-                self._get_artist_top_tracks(session, parts[2])[:10]
-            )
-
-            albums = ref_models_mappers.create_albums(
-                self._get_artist_albums(session, parts[2])
-            )
-
-            return albums + top_10_tracks
+            return self._browse_artist(session, parts[2])
 
         if nr_of_parts == 3 and parts[1] == "playlist":
             return ref_models_mappers.create_tracks(
@@ -237,30 +165,40 @@ class TidalLibraryProvider(backend.LibraryProvider):
         logger.debug("Unknown uri for browse request: %s", uri)
         return []
 
+    @with_deadline("search")
     def search(self, query=None, uris=None, exact=False):
         from mopidy_tidal.search import tidal_search
 
         try:
             artists, albums, tracks = tidal_search(
-                self._session, query=query, exact=exact
+                self._session,
+                query=query,
+                exact=exact,
+                album_index=self._album_tracks_index,
             )
             return SearchResult(artists=artists, albums=albums, tracks=tracks)
         except Exception as ex:
             logger.info("EX")
             logger.info("%r", ex)
 
+    @with_deadline("images")
     def get_images(self, uris):
         logger.info("Searching Tidal for images for %r" % uris)
-        images_getter = ImagesGetter(self._session)
-
-        with ThreadPoolExecutor(4, thread_name_prefix="mopidy-tidal-images-") as pool:
-            pool_res = pool.map(images_getter, uris)
+        images = self.images.get_images(uris)
+        config = context.get_config()
+        if not config["tidal"].get("image_proxy"):
+            return images
 
-        images = {uri: item_images for uri, item_images in pool_res}
+        if not image_proxy.is_served(config):
+            logger.warning("The image proxy requires the http extension")
+            return images
 
-        images_getter.cache_update(images)
-        return images
+        return {
+            uri: [image_proxy.local_image(image) for image in uri_images]
+            for uri, uri_images in images.items()
+        }
 
+    @with_deadline("lookup")
     def lookup(self, uris=None):
         logger.info("Lookup uris %r", uris)
         if isinstance(uris, str):
@@ -268,85 +206,209 @@ class TidalLibraryProvider(backend.LibraryProvider):
         if not hasattr(uris, "__iter__"):
             uris = [uris]
 
-        tracks = []
-        cache_updates = {}
+        uris = list(uris or [])
+        results = {}
+        misses = OrderedDict()
 
-        for uri in uris or []:
-            data = []
-            try:
-                parts = uri.split(":")
-                item_type = parts[1]
-                cache_name = f"_{parts[1]}_cache"
-                cache_miss = True
-
-                try:
-                    data = getattr(self, cache_name)[uri]
-                    cache_miss = not bool(data)
-                except (AttributeError, KeyError):
-                    pass
-
-                if cache_miss:
-                    try:
-                        lookup = getattr(self, f"_lookup_{parts[1]}")
-                    except AttributeError:
-                        continue
-
-                    data = cache_data = lookup(self._session, parts)
-                    cache_updates[cache_name] = cache_updates.get(cache_name, {})
-                    if item_type == "playlist":
-                        # Playlists should be persisted on the cache as objects,
-                        # not as lists of tracks. Therefore, _lookup_playlist
-                        # returns a tuple that we need to unpack
-                        data, cache_data = data
-
-                    cache_updates[cache_name][uri] = cache_data
-
-                if item_type == "playlist" and not cache_miss:
-                    tracks += data.tracks
-                else:
-                    tracks += data if hasattr(data, "__iter__") else [data]
-            except HTTPError as err:
-                logger.error("%s when processing URI %r: %s", type(err), uri, err)
+        for uri in uris:
+            parts = uri.split(":")
+            cached_tracks = self._get_cached_tracks(parts[1], uri)
+            if cached_tracks is not None:
+                results[uri] = cached_tracks
+            elif hasattr(self, f"_lookup_{parts[1]}"):
+                misses[uri] = parts
+
+        cache_updates = {}
+        for resolved, expired in self._resolve_misses(misses):
+            for uri, (data, cache_data) in resolved.items():
+                results[uri] = data if hasattr(data, "__iter__") else [data]
+                # Items retrieved after the deadline may be truncated, so
+                # they are returned but not cached. Tracks are cached below
+                if not expired and misses[uri][1] != "track":
+                    cache_name = f"_{misses[uri][1]}_cache"
+                    cache_updates.setdefault(cache_name, {})[uri] = cache_data
 
         for cache_name, new_data in cache_updates.items():
             getattr(self, cache_name).update(new_data)
 
+        # Return the tracks in the same order as the requested URIs
+        tracks = [track for uri in uris for track in results.get(uri, [])]
         self._track_cache.update({track.uri: track for track in tracks})
+        logger.debug("Track cache hit rate: %r", self._track_cache.hit_rate)
         logger.info("Returning %d tracks", len(tracks))
         return tracks
 
+    def _get_cached_tracks(self, item_type: str, uri: str) -> Optional[List]:
+        try:
+            data = getattr(self, f"_{item_type}_cache")[uri]
+        except (AttributeError, KeyError):
+            return None
+
+        if not data:
+            return None
+        if item_type == "playlist":
+            return list(data.tracks)
+        return list(data) if hasattr(data, "__iter__") else [data]
+
+    def _resolve_misses(self, misses: Mapping[str, List[str]]) -> List[Tuple]:
+        """
+        Resolve the URIs missing from the cache concurrently. Track URIs that
+        reference the same album are resolved with a single album fetch, and
+        an error only affects the URIs of the request that failed.
+
+        :return: A list of `({uri: (data, cache_data)}, expired)` tuples,
+            where `expired` tells if the deadline had already expired when the
+            request completed.
+        """
+        if not misses:
+            return []
+
+        session = self._session
+        requests = []
+        track_uris_by_album = OrderedDict()
+
+        for uri, parts in misses.items():
+            album_id = None
+            if parts[1] == "track":
+                album_id = (
+                    parts[3]
+                    if len(parts) == 5
+                    else self._track_cache.get_album_id(parts[2])
+                )
+
+            if album_id:
+                track_uris_by_album.setdefault(album_id, []).append(uri)
+            else:
+                requests.append(([uri], partial(self._lookup_uri, session, parts)))
+
+        for album_id, track_uris in track_uris_by_album.items():
+            requests.append(
+                (
+                    track_uris,
+                    partial(
+                        self._lookup_album_tracks,
+                        session,
+                        album_id,
+                        {uri: misses[uri] for uri in track_uris},
+                    ),
+                )
+            )
+
+        def run(request):
+            request_uris, func = request
+            try:
+                resolved = func()
+            except HTTPError as err:
+                logger.error(
+                    "%s when processing URIs %r: %s", type(err), request_uris, err
+                )
+                resolved = {}
+            return resolved, current_deadline().expired
+
+        with worker_pool(
+            self._lookup_workers, thread_name_prefix="mopidy-tidal-lookup-"
+        ) as pool:
+            return [res for res in map_within_deadline(pool, run, requests) if res]
+
+    def _lookup_uri(self, session, parts: List[str]) -> Mapping[str, Tuple]:
+        uri = ":".join(parts)
+        data = cache_data = getattr(self, f"_lookup_{parts[1]}")(session, parts)
+        if parts[1] == "playlist":
+            # Playlists should be persisted on the cache as objects,
+            # not as lists of tracks. Therefore, _lookup_playlist
+            # returns a tuple that we need to unpack
+            data, cache_data = data
+
+        return {uri: (data, cache_data)}
+
+    def _lookup_album_tracks(
+        self, session, album_id: str, parts_by_uri: Mapping[str, List[str]]
+    ) -> Mapping[str, Tuple]:
+        self._get_indexed_album_tracks(session, album_id)
+        resolved = {}
+
+        for uri, parts in parts_by_uri.items():
+            track = self._album_tracks_index.get_track(album_id, parts[-1])
+            if not track:
+                logger.warning("No such track on album %s: %s", album_id, uri)
+                continue
+
+            resolved[uri] = ([track], [track])
+
+        return resolved
+
     @classmethod
     def _get_playlist_tracks(cls, session, playlist_id):
         pl = session.playlist(playlist_id)
         getter_args = tuple()
         return get_items(pl.tracks, *getter_args)
 
+    def _get_catalog(self, name: str) -> Mapping[str, SimpleNamespace]:
+        """
+        Get a catalog of directories (moods, genres or mixes), indexed by ID.
+        Catalogs are cached for `catalog_cache_ttl_secs`.
+        """
+        catalog = self._catalog_cache.get(f"tidal:catalog:{name}")
+        return self.refresh_catalog(name) if catalog is None else catalog
+
+    def refresh_catalog(self, name: str) -> Mapping[str, SimpleNamespace]:
+        """
+        Fetch a catalog of directories (moods, genres or mixes) and cache it.
+        """
+        catalog = getattr(self, f"_fetch_{name}")(self._session)
+        if self._catalog_cache.ttl:
+            self._catalog_cache[f"tidal:catalog:{name}"] = catalog
+
+        return catalog
+
     @staticmethod
-    def _get_genre_items(session, genre_id):
-        from tidalapi.playlist import Playlist
+    def _fetch_moods(session) -> Mapping[str, SimpleNamespace]:
+        return OrderedDict(
+            (
+                m.api_path.split("/")[-1],
+                SimpleNamespace(title=m.title, api_path=m.api_path),
+            )
+            for m in session.moods()
+        )
 
-        filtered_genres = [g for g in session.genre.get_genres() if genre_id == g.path]
-        if filtered_genres:
-            return filtered_genres[0].items(Playlist)
-        return []
+    @staticmethod
+    def _fetch_genres(session) -> Mapping[str, SimpleNamespace]:
+        return OrderedDict(
+            (g.path, SimpleNamespace(name=g.name, path=g.path, playlists=g.playlists))
+            for g in session.genre.get_genres()
+        )
 
     @staticmethod
-    def _get_mood_items(session, mood_id):
-        filtered_moods = [
-            m for m in session.moods() if mood_id == m.api_path.split("/")[-1]
-        ]
+    def _fetch_mixes(session) -> Mapping[str, SimpleNamespace]:
+        return OrderedDict(
+            (m.id, SimpleNamespace(id=m.id, title=m.title, sub_title=m.sub_title))
+            for m in session.mixes()
+        )
 
-        if filtered_moods:
-            mood = filtered_moods[0].get()
-            return [p for p in mood]
-        return []
+    def _get_genre_items(self, session, genre_id):
+        genre = self._get_catalog("genres").get(genre_id)
+        if not (genre and genre.playlists):
+            return []
+
+        return session.request.map_request(
+            f"genres/{genre.path}/playlists", parse=session.parse_playlist
+        )
+
+    def _get_mood_items(self, session, mood_id):
+        mood = self._get_catalog("moods").get(mood_id)
+        if not mood:
+            return []
+
+        return [p for p in session.page.get(mood.api_path)]
 
     @staticmethod
     def _get_mix_tracks(session, mix_id):
-        filtered_mixes = [m for m in session.mixes() if mix_id == m.id]
-        if filtered_mixes:
-            return filtered_mixes[0].items()
-        return []
+        # The mix is retrieved together with its items
+        try:
+            return session.mix(mix_id).items()
+        except HTTPError as err:
+            logger.error("%s when fetching the mix %r: %s", type(err), mix_id, err)
+            return []
 
     def _lookup_playlist(self, session, parts):
         playlist_id = parts[2]
@@ -358,6 +420,60 @@ class TidalLibraryProvider(backend.LibraryProvider):
         # caching purposes
         return pl_tracks, pl
 
+    def _browse_artist(self, session, artist_id) -> List[models.Ref]:
+        """
+        The albums and top 10 tracks of an artist, preceded by its EPs and
+        singles if `artist_ep_singles` is set. The artist is fetched once, and
+        its sections are then fetched concurrently.
+        """
+        uri = f"tidal:artist:{artist_id}"
+        refs = self._artist_browse_cache.get(uri)
+        if refs is not None:
+            return refs
+
+        artist = session.artist(artist_id)
+        if not artist:
+            logger.warning("No such artist: %s", artist_id)
+            return []
+
+        sections = [
+            (artist.get_albums, ref_models_mappers.create_albums),
+            (
+                lambda: artist.get_top_tracks()[:10],
+                ref_models_mappers.create_tracks,
+            ),
+        ]
+        if context.get_config()["tidal"].get("artist_ep_singles"):
+            # Named get_albums_ep_singles by older versions of tidalapi
+            get_ep_singles = getattr(artist, "get_ep_singles", None) or getattr(
+                artist, "get_albums_ep_singles"
+            )
+            sections.insert(1, (get_ep_singles, ref_models_mappers.create_albums))
+
+        def get_section(getter):
+            try:
+                return getter()
+            except HTTPError as e:
+                logger.warning("Could not browse artist %s: %s", artist_id, e)
+
+        with worker_pool(len(sections), "mopidy-tidal-artist-") as pool:
+            results = map_within_deadline(
+                pool, get_section, [getter for getter, _ in sections]
+            )
+
+        refs = []
+        for (_, mapper), items in zip(sections, results):
+            refs.extend(mapper(items or []))
+
+        # Incomplete pages aren't cached
+        if (
+            all(items is not None for items in results)
+            and self._artist_browse_cache.ttl
+        ):
+            self._artist_browse_cache[uri] = refs
+
+        return refs
+
     @staticmethod
     def _get_artist_albums(session, artist_id):
         artist = session.artist(artist_id)
@@ -379,23 +495,42 @@ class TidalLibraryProvider(backend.LibraryProvider):
     def _lookup_track(self, session, parts):
         if len(parts) == 3:  # Track in format `tidal:track:<track_id>`
             track_id = parts[2]
-            track = session.track(track_id)
-            album_id = str(track.album.id)
+            album_id = self._track_cache.get_album_id(track_id)
+            if not album_id:
+                album_id = str(session.track(track_id).album.id)
         else:  # Track in format `tidal:track:<artist_id>:<album_id>:<track_id>`
             album_id = parts[3]
             track_id = parts[4]
-        tracks = self._get_album_tracks(session, album_id)
-        # We get a spurious coverage error since the next expression should never raise StopIteration
-        track = next(t for t in tracks if t.id == int(track_id))  # pragma: no cover
-        artist = full_models_mappers.create_mopidy_artist(track.artist)
-        album = full_models_mappers.create_mopidy_album(track.album, artist)
-        return [full_models_mappers.create_mopidy_track(artist, album, track)]
+
+        self._get_indexed_album_tracks(session, album_id)
+        track = self._album_tracks_index.get_track(album_id, track_id)
+        if not track:
+            logger.warning("No such track on album %s: %s", album_id, track_id)
+            return []
+
+        return [track]
+
+    def _get_indexed_album_tracks(self, session, album_id) -> List[models.Track]:
+        """
+        Get the tracks of an album from the album index, and fetch them only
+        if the album hasn't been seen yet.
+        """
+        tracks = self._album_tracks_index.get_album_tracks(album_id)
+        if tracks is None:
+            tracks = full_models_mappers.create_mopidy_tracks(
+                self._get_album_tracks(session, album_id)
+            )
+            if tracks:
+                self._album_tracks_index.add_album(album_id, tracks)
+
+        for track in tracks:
+            self._track_cache.add_alias(track)
+
+        return tracks
 
     def _lookup_album(self, session, parts):
         album_id = parts[2]
-        tracks = self._get_album_tracks(session, album_id)
-
-        return full_models_mappers.create_mopidy_tracks(tracks)
+        return self._get_indexed_album_tracks(session, album_id)
 
     @staticmethod
     def _get_artist_top_tracks(session, artist_id):
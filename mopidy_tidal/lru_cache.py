@@ -4,15 +4,23 @@ import logging
 import os
 import pathlib
 import pickle
+import time
 from collections import OrderedDict
-from typing import Optional
+from threading import RLock
+from typing import Iterable, List, Optional
 
 from mopidy_tidal import Extension, context
+from mopidy_tidal.workers import current_deadline
 
 logger = logging.getLogger(__name__)
 
 
 class LruCache(OrderedDict):
+    """
+    LRU cache, optionally persisted to disk. Entries can be read and written
+    from several threads, e.g. by concurrent lookups.
+    """
+
     def __init__(self, max_size: Optional[int] = 1024, persist=True, directory=""):
         """
         :param max_size: Max size of the cache in memory. Set 0 or None for no
@@ -22,6 +30,8 @@ class LruCache(OrderedDict):
         :param directory: If `persist=True`, store the cached entries in this
             subfolder of the cache directory (default: '')
         """
+        # Created first, as OrderedDict.__init__ may call update()
+        self._lock = RLock()
         super().__init__(self)
         if max_size:
             assert max_size > 0, f"Invalid cache size: {max_size}"
@@ -31,6 +41,8 @@ class LruCache(OrderedDict):
             Extension.get_cache_dir(context.get_config()), directory
         )
         self._persist = persist
+        self.hits = 0
+        self.misses = 0
         if persist:
             pathlib.Path(self._cache_dir).mkdir(parents=True, exist_ok=True)
 
@@ -44,6 +56,15 @@ class LruCache(OrderedDict):
     def persist(self):
         return self._persist
 
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """
+        Ratio of the lookups served by the cache, or None if there were no
+        lookups yet.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
     def _cache_filename(self, key: str) -> str:
         parts = key.split(":")
         assert len(parts) > 2, f"Invalid TIDAL ID: {key}"
@@ -88,6 +109,17 @@ class LruCache(OrderedDict):
         return value
 
     def __getitem__(self, key, *_, **__):
+        with self._lock:
+            try:
+                value = self._lookup(key)
+            except KeyError:
+                self.misses += 1
+                raise
+
+            self.hits += 1
+            return value
+
+    def _lookup(self, key):
         try:
             # Cache hit in memory
             return super().__getitem__(key)
@@ -100,16 +132,17 @@ class LruCache(OrderedDict):
         return self._get_from_storage(key)
 
     def __setitem__(self, key, value, _sync_to_fs=True, *_, **__):
-        if super().__contains__(key):
-            del self[key]
+        with self._lock:
+            if super().__contains__(key):
+                del self[key]
 
-        super().__setitem__(key, value)
-        if self.persist and _sync_to_fs:
-            cache_file = self._cache_filename(key)
-            with open(cache_file, "wb") as f:
-                pickle.dump(value, f)
+            super().__setitem__(key, value)
+            if self.persist and _sync_to_fs:
+                cache_file = self._cache_filename(key)
+                with open(cache_file, "wb") as f:
+                    pickle.dump(value, f)
 
-        self._check_limit()
+            self._check_limit()
 
     def __contains__(self, key):
         return self.get(key) is not None
@@ -129,21 +162,26 @@ class LruCache(OrderedDict):
         """
         Delete the specified keys both from memory and disk.
         """
-        for key in keys:
-            logger.debug("Pruning key %r from cache %s", key, self.__class__.__name__)
+        with self._lock:
+            for key in keys:
+                logger.debug(
+                    "Pruning key %r from cache %s", key, self.__class__.__name__
+                )
 
-            self._reset_stored_entry(key)
-            self.pop(key, None)
+                self._reset_stored_entry(key)
+                self.pop(key, None)
 
     def prune_all(self):
         """
         Prune all the keys in the cache.
         """
-        self.prune(*[*self.keys()])
+        with self._lock:
+            self.prune(*[*self.keys()])
 
     def update(self, *args, **kwargs):
-        super().update(*args, **kwargs)
-        self._check_limit()
+        with self._lock:
+            super().update(*args, **kwargs)
+            self._check_limit()
 
     def _check_limit(self):
         if self.max_size:
@@ -152,6 +190,154 @@ class LruCache(OrderedDict):
                 self.popitem(last=False)
 
 
+class TrackCache(LruCache):
+    """
+    Track cache keyed by track ID: the `tidal:track:<id>` and
+    `tidal:track:<artist_id>:<album_id>:<id>` forms of a URI share the same
+    entry. The album of the tracks seen so far is kept in an alias table, so
+    short URIs can be resolved without asking the API for the track first.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._aliases = {}
+        super().__init__(*args, **kwargs)
+        if self.persist:
+            self._migrate()
+
+    @staticmethod
+    def canonical_key(key: str) -> str:
+        parts = key.split(":")
+        if len(parts) == 5 and parts[1] == "track":
+            return ":".join(parts[:2] + parts[-1:])
+        return key
+
+    def add_alias(self, track):
+        """
+        Record the album of a track, given its Mopidy object.
+        """
+        parts = track.uri.split(":")
+        if len(parts) == 5:
+            with self._lock:
+                self._aliases[parts[4]] = parts[3]
+
+    def get_album_id(self, track_id) -> Optional[str]:
+        """
+        The ID of the album of a track, if the track has been seen before.
+        """
+        track_id = str(track_id)
+        if track_id not in self._aliases:
+            track = self.get(f"tidal:track:{track_id}")
+            if isinstance(track, (list, tuple)):
+                track = track[0] if track else None
+            if track is not None:
+                self.add_alias(track)
+
+        return self._aliases.get(track_id)
+
+    def __getitem__(self, key, *args, **kwargs):
+        return super().__getitem__(self.canonical_key(key), *args, **kwargs)
+
+    def __setitem__(self, key, value, *args, **kwargs):
+        tracks = value if isinstance(value, (list, tuple)) else [value]
+        with self._lock:
+            for track in tracks:
+                if hasattr(track, "uri"):
+                    self.add_alias(track)
+
+            super().__setitem__(self.canonical_key(key), value, *args, **kwargs)
+
+    def prune(self, *keys):
+        super().prune(*[self.canonical_key(key) for key in keys])
+
+    def _migrate(self):
+        """
+        Move the entries persisted under long-form track URIs to their
+        canonical keys.
+        """
+        migrated = 0
+        for root, _, files in os.walk(os.path.join(self._cache_dir, "track")):
+            for filename in files:
+                parts = filename[: -len(".cache")].replace(":", "-").split("-")
+                if not filename.endswith(".cache") or len(parts) != 5:
+                    continue
+
+                cache_file = os.path.join(root, filename)
+                key = self.canonical_key(":".join(parts))
+                try:
+                    if not os.path.isfile(self._cache_filename(key)):
+                        with open(cache_file, "rb") as f:
+                            self[key] = pickle.load(f)
+                        migrated += 1
+                except Exception as e:
+                    logger.warning("Could not migrate cache file %s: %s", cache_file, e)
+
+                os.unlink(cache_file)
+
+        if migrated:
+            logger.info("Migrated %d track cache entries to canonical keys", migrated)
+
+
+class AlbumTracksIndex(LruCache):
+    """
+    Index of the tracks of the albums retrieved so far. Entries are keyed by
+    `tidal:album:<album_id>` and map the IDs of the album tracks to their
+    Mopidy tracks, in album order.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("directory", "album_tracks")
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def _key(album_id) -> str:
+        return f"tidal:album:{album_id}"
+
+    def add_album(self, album_id, tracks: Iterable):
+        self[self._key(album_id)] = OrderedDict(
+            (track.uri.split(":")[-1], track) for track in tracks
+        )
+
+    def get_album_tracks(self, album_id) -> Optional[List]:
+        tracks = self.get(self._key(album_id))
+        return None if tracks is None else list(tracks.values())
+
+    def get_track(self, album_id, track_id):
+        return (self.get(self._key(album_id)) or {}).get(str(track_id))
+
+
+class TtlCache(LruCache):
+    """
+    Cache whose entries expire `ttl` seconds after they were stored. Expiry
+    times follow the wall clock, so they still hold after a restart.
+    """
+
+    def __init__(self, ttl: float, *args, **kwargs):
+        self._ttl = ttl
+        super().__init__(*args, **kwargs)
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def __getitem__(self, key, *args, **kwargs):
+        # An entry stored by another thread isn't pruned as expired
+        with self._lock:
+            expires_at, value = super().__getitem__(key, *args, **kwargs)
+            if time.time() >= expires_at:
+                logger.debug("Cache entry %s expired", key)
+                self.prune(key)
+                raise KeyError(key)
+
+            return value
+
+    def __setitem__(self, key, value, _sync_to_fs=True, *args, **kwargs):
+        # Entries loaded from the filesystem already carry their expiry time
+        if _sync_to_fs:
+            value = (time.time() + self._ttl, value)
+
+        super().__setitem__(key, value, _sync_to_fs, *args, **kwargs)
+
+
 class SearchCache(LruCache):
     def __init__(self, func):
         super().__init__(persist=False)
@@ -165,7 +351,11 @@ class SearchCache(LruCache):
         )
         if cached_result is None:
             cached_result = self._func(*args, **kwargs)
-            self[key] = cached_result
+            if current_deadline().expired:
+                # Don't cache results that may have been truncated
+                logger.info("Search deadline exceeded: result not cached")
+            else:
+                self[key] = cached_result
 
         return cached_result
 
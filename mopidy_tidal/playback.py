@@ -1,19 +1,307 @@
 from __future__ import unicode_literals
 
 import logging
+import re
+import time
+from concurrent.futures import Future
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
 
 from mopidy import backend
 
+from mopidy_tidal import audio_proxy, lanes
+from mopidy_tidal.prefetch import Prefetcher
+from mopidy_tidal.quality import QualitySelector
+
 logger = logging.getLogger(__name__)
 
+# How long the stream URLs that don't tell when they expire are kept. It is
+# already conservative, so no margin is taken from it.
+DEFAULT_URL_TTL = 60
+
+# Stream URLs that carry their expiry are dropped this many seconds before
+# it, so playback doesn't start on a URL that is about to become invalid
+URL_EXPIRY_MARGIN = 30
+
+_expiry_params = {"expires", "exp"}
+_expiry_re = re.compile(r"(?:^|[~&])exp=(\d+)")
+
+
+def get_url_expiry(url: str) -> Optional[float]:
+    """
+    The expiry time (as a UNIX timestamp) of a signed URL, if the signature
+    carries it: `Expires`/`exp` parameters, `exp=` fields of an Akamai token
+    or `<expiry>~<signature>` tokens.
+    """
+    for key, value in parse_qsl(urlsplit(url).query):
+        key = key.lower()
+        if key in _expiry_params and value.isdigit():
+            return float(value)
+
+        match = _expiry_re.search(value)
+        if match:
+            return float(match.group(1))
+
+        if key == "token":
+            expiry = value.split("~", 1)[0]
+            if expiry.isdigit():
+                return float(expiry)
+
+    return None
+
+
+class StreamUrlCache:
+    """
+    Signed stream URLs by track key (track ID and quality), kept until shortly
+    before they expire.
+    """
+
+    def __init__(
+        self, default_ttl: float = DEFAULT_URL_TTL, margin: float = URL_EXPIRY_MARGIN
+    ):
+        self._default_ttl = default_ttl
+        self._margin = margin
+        self._urls: Dict[str, Tuple[float, str]] = {}
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            expires_at, url = self._urls.get(key, (0, None))
+            if url and time.time() >= expires_at:
+                del self._urls[key]
+                return None
+            return url
+
+    def add(self, key: str, url: str):
+        now = time.time()
+        expires_at = get_url_expiry(url)
+        if expires_at is None:
+            expires_at = now + self._default_ttl
+        else:
+            expires_at -= self._margin
+
+        with self._lock:
+            if expires_at > now:
+                self._urls[key] = (expires_at, url)
+
+            # Drop the entries that expired in the meantime
+            for expired_key in [k for k, (exp, _) in self._urls.items() if exp <= now]:
+                del self._urls[expired_key]
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._urls.pop(key, None)
+
 
 class TidalPlaybackProvider(backend.PlaybackProvider):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stream_urls = StreamUrlCache()
+        self._lock = Lock()
+        # Stream URLs being prefetched, by track key
+        self._resolving: Dict[str, Future] = {}
+        self._prefetcher: Optional[Prefetcher] = None
+        self._quality_selector: Optional[QualitySelector] = None
+        # Track being loaded, its key, and when it was requested
+        self._current: Optional[Tuple[str, str, float]] = None
+        # Key of the track whose first audio data is awaited
+        self._starting: Optional[str] = None
+
+    @property
+    def prefetcher(self) -> Prefetcher:
+        if self._prefetcher is None:
+            tidal_config = self.backend._config["tidal"]
+            count = tidal_config.get("prefetch_tracks")
+            self._prefetcher = Prefetcher(
+                self.backend,
+                count=2 if count is None else count,
+                metadata=bool(tidal_config.get("prefetch_metadata")),
+            )
+        return self._prefetcher
+
+    @property
+    def quality_selector(self) -> Optional[QualitySelector]:
+        """
+        The selector of the stream quality, if it adapts to the connection.
+        """
+        tidal_config = self.backend._config["tidal"]
+        if self._quality_selector is None and tidal_config.get("adaptive_quality"):
+            self._quality_selector = QualitySelector(
+                min_quality=tidal_config.get("min_quality") or "LOW",
+                max_quality=tidal_config.get("quality") or "LOSSLESS",
+            )
+        return self._quality_selector
+
+    def _get_quality(self, record: bool = True) -> Optional[str]:
+        session = self.backend.session
+        if getattr(session, "is_pkce", False):
+            # tidalapi resolves the URLs of PKCE sessions at the quality of
+            # the session: the tracks are keyed by it
+            return session.config.quality
+
+        selector = self.quality_selector
+        if selector:
+            return selector.choose(record=record)
+        return self.backend._config["tidal"].get("quality")
+
     def translate_uri(self, uri):
         logger.info("TIDAL uri: %s", uri)
-        parts = uri.split(":")
-        track_id = int(parts[4])
-        session = self.backend.session
+        requested_at = time.monotonic()
+        track_id = uri.split(":")[-1]
+        quality = self._get_quality()
+        key = audio_proxy.get_track_key(track_id, quality)
+        self._current = (track_id, key, requested_at)
+        self._starting = key
+
+        cache, local_url = self._get_audio_proxy(key)
+        if cache and cache.get_file(key):
+            # Replays don't need any stream URL
+            newurl, source = local_url, "audio cache"
+        else:
+            newurl, source = self._get_or_resolve_stream_url(track_id, quality)
+            if cache:
+                cache.register(key, newurl)
+                newurl = local_url
 
-        newurl = session.track(track_id).get_url()
-        logger.info("transformed into %s", newurl)
+        logger.info(
+            "transformed into %s (%s in %.0f ms)",
+            newurl,
+            source,
+            (time.monotonic() - requested_at) * 1000,
+        )
+
+        self.prefetcher.schedule(uri)
         return newurl
+
+    def _get_audio_proxy(
+        self, key: str
+    ) -> Tuple[Optional[audio_proxy.AudioCache], Optional[str]]:
+        """
+        The audio cache and the local URL of a track, if tracks are played
+        through the audio proxy.
+        """
+        config = self.backend._config
+        if not config["tidal"].get("audio_proxy"):
+            return None, None
+
+        local_url = audio_proxy.get_local_url(config, key)
+        if not local_url:
+            logger.warning("The audio proxy requires the http extension")
+            return None, None
+
+        cache = audio_proxy.get_cache(config)
+        if self.quality_selector:
+            # The proxy sees the audio data: it measures the throughput and
+            # the startup latency
+            cache.on_download = self.quality_selector.record_throughput
+            cache.on_stream_start = self._on_stream_start
+        return cache, local_url
+
+    def _get_or_resolve_stream_url(
+        self, track_id: str, quality: Optional[str]
+    ) -> Tuple[str, str]:
+        key = audio_proxy.get_track_key(track_id, quality)
+        url = self._stream_urls.get(key)
+        if url:
+            return url, "cached"
+
+        with self._lock:
+            future = self._resolving.get(key)
+        if future:
+            try:
+                return future.result(), "prefetched"
+            except Exception as e:
+                logger.debug("Prefetch of track %s failed: %s", track_id, e)
+
+        # Background jobs wait until the stream is resolved. Bulk work runs on
+        # its own lane, so the actor is free to resolve it right away
+        with self.backend.scheduler.critical():
+            url = self._resolve_stream_url(track_id, quality)
+        return url, "resolved"
+
+    def _resolve_stream_url(self, track_id: str, quality: Optional[str]) -> str:
+        url = self._get_stream_url(self.backend.session, track_id, quality)
+        self._stream_urls.add(audio_proxy.get_track_key(track_id, quality), url)
+        return url
+
+    def prefetch(self, uris):
+        """
+        Resolve the stream URLs of the tracks `uris` in the background.
+        """
+        # Prefetched streams get the quality the next track would get now
+        quality = self._get_quality(record=False)
+        for uri in uris:
+            track_id = uri.split(":")[-1]
+            key = audio_proxy.get_track_key(track_id, quality)
+            with self._lock:
+                if key in self._resolving or self._stream_urls.get(key):
+                    continue
+                future = self._resolving[key] = self.backend.lanes.submit(
+                    lanes.PREFETCH, self._resolve_stream_url, track_id, quality
+                )
+
+            future.add_done_callback(lambda _, key=key: self._prefetched(key))
+
+    def _prefetched(self, key: str):
+        with self._lock:
+            self._resolving.pop(key, None)
+
+    def _get_stream_url(
+        self, session, track_id: str, quality: Optional[str] = None
+    ) -> str:
+        if getattr(session, "is_pkce", False):
+            # Let tidalapi tell which URLs PKCE sessions can get
+            return session.track(track_id).get_url()
+
+        # Same request as `Track.get_url`, without fetching the track first
+        if not self.quality_selector:
+            quality = session.config.quality
+        params = {
+            "urlusagemode": "STREAM",
+            "audioquality": quality,
+            "assetpresentation": "FULL",
+        }
+        response = session.request.request(
+            "GET", f"tracks/{track_id}/urlpostpaywall", params
+        )
+        return response.json()["urls"][0]
+
+    def on_source_setup(self, source):
+        if self._current:
+            track_id, _, requested_at = self._current
+            logger.info(
+                "Track %s: audio source ready %.0f ms after the request",
+                track_id,
+                (time.monotonic() - requested_at) * 1000,
+            )
+
+    def _on_stream_start(self, key: str):
+        # The source is set up before any audio is requested: the startup
+        # latency runs until the first audio data of the track is sent
+        with self._lock:
+            current = self._current
+            if not current or key != self._starting:
+                return
+            self._starting = None
+
+        track_id, _, requested_at = current
+        latency = time.monotonic() - requested_at
+        logger.info(
+            "Track %s: first audio data %.0f ms after the request",
+            track_id,
+            latency * 1000,
+        )
+        if self.quality_selector:
+            self.quality_selector.record_startup(latency)
+
+    def play(self):
+        if super().play():
+            return True
+
+        # The stream URL may have been rejected: don't reuse it
+        if self._current:
+            track_id, key, _ = self._current
+            logger.info("Playback of track %s failed: stream URL dropped", track_id)
+            self._stream_urls.invalidate(key)
+        return False
@@ -1,13 +1,16 @@
 from __future__ import unicode_literals
 
-import difflib
 import logging
-import operator
 import os
-import pathlib
-from concurrent.futures import ThreadPoolExecutor
-from threading import Event, Timer
-from typing import Collection, List, Optional, Tuple, Union
+import pickle
+import shutil
+import time
+from bisect import bisect_left, insort
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+from threading import Event, Lock, Timer
+from typing import Collection, Dict, List, NamedTuple, Optional, Tuple, Union
 
 from mopidy import backend
 from mopidy.models import Playlist as MopidyPlaylist
@@ -15,15 +18,37 @@ from mopidy.models import Ref
 from requests import HTTPError
 from tidalapi.playlist import Playlist as TidalPlaylist
 
-from mopidy_tidal import full_models_mappers
+from mopidy_tidal import full_models_mappers, lanes
+from mopidy_tidal.diff import diff
 from mopidy_tidal.full_models_mappers import create_mopidy_playlist
 from mopidy_tidal.helpers import to_timestamp
 from mopidy_tidal.lru_cache import LruCache
-from mopidy_tidal.utils import mock_track
-from mopidy_tidal.workers import get_items
+from mopidy_tidal.workers import (
+    current_deadline,
+    get_items,
+    map_within_deadline,
+    worker_pool,
+)
 
 logger = logging.getLogger(__name__)
 
+# Number of playlists whose tracks are loaded at the same time. Each of them
+# also fetches its pages in parallel.
+ITEMS_WORKERS = 4
+
+# How long the synced list of playlists tells whether the cached playlists
+# are fresh, unless `playlist_cache_refresh_secs` is set
+LIST_FRESHNESS_SECS = 300
+
+# Max number of tracks removed or added by one request
+REMOVE_BATCH_SIZE = 50
+ADD_BATCH_SIZE = 100
+
+# Playlists with more tracks than this are returned after their first window
+# of tracks is fetched, and the rest is loaded in the background
+LAZY_LOAD_MIN_TRACKS = 500
+WINDOW_SIZE = 100
+
 
 class PlaylistCache(LruCache):
     def __getitem__(
@@ -48,23 +73,158 @@ class PlaylistCache(LruCache):
         return playlist
 
 
+def _str_or_none(value) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+class PlaylistMetadata(NamedTuple):
+    """
+    What listing a playlist needs to know about it, without its tracks.
+    """
+
+    uri: str
+    name: Optional[str]
+    count: int
+    last_modified: int
+    owner: Optional[str] = None
+    image_id: Optional[str] = None
+
+    @classmethod
+    def from_tidal(cls, pl: TidalPlaylist) -> "PlaylistMetadata":
+        return cls(
+            uri="tidal:playlist:" + pl.id,
+            name=pl.name,
+            count=max(0, pl.num_tracks or 0),
+            last_modified=to_timestamp(pl.last_updated),
+            owner=_str_or_none(getattr(pl.creator, "name", None)),
+            image_id=_str_or_none(pl.square_picture or pl.picture),
+        )
+
+
 class PlaylistMetadataCache(PlaylistCache):
-    def _cache_filename(self, key: str) -> str:
-        parts = key.split(":")
-        assert len(parts) > 2, f"Invalid TIDAL ID: {key}"
-        parts[1] += "_metadata"
-        cache_dir = os.path.join(self._cache_dir, parts[1], parts[2][:2])
-        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
-        return os.path.join(cache_dir, f"{key}.cache")
+    """
+    Metadata of all the playlists, persisted together in one index file
+    rather than one file per playlist. A view of the playlists sorted by name
+    is maintained as entries are added and removed.
+    """
+
+    index_version = 1
+
+    def __init__(self, persist=True, directory=""):
+        # (name, uri) of the playlists, sorted
+        self._by_name: List[Tuple[str, str]] = []
+        super().__init__(max_size=None, persist=persist, directory=directory)
+        self._index_file = os.path.join(self._cache_dir, "playlist_metadata.index")
+        if persist:
+            self._load_index()
+
+    def _load_index(self):
+        if not os.path.isfile(self._index_file):
+            # Drop the entries of the previous format, with one file per
+            # playlist and a mock track per playlist item
+            shutil.rmtree(
+                os.path.join(self._cache_dir, "playlist_metadata"), ignore_errors=True
+            )
+            return
+
+        try:
+            with open(self._index_file, "rb") as f:
+                version, records = pickle.load(f)
+            assert version == self.index_version, f"Unknown version: {version}"
+            for record in records:
+                metadata = PlaylistMetadata(*record)
+                self._set(metadata.uri, metadata)
+        except Exception as e:
+            logger.warning(
+                "Could not load the playlist index %s: %s", self._index_file, e
+            )
+
+    def _save_index(self):
+        if not self.persist:
+            return
+
+        with self._lock:
+            records = [tuple(record) for record in self.values()]
+            tmp_file = self._index_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump((self.index_version, records), f)
+            os.replace(tmp_file, self._index_file)
+
+    def _get_from_storage(self, key):
+        # The whole index is loaded in memory
+        raise KeyError(key)
+
+    @staticmethod
+    def _sort_key(key: str, value) -> Tuple[str, str]:
+        return getattr(value, "name", None) or "", key
+
+    def _unindex(self, key: str):
+        value = dict.get(self, key)
+        if value is not None:
+            sort_key = self._sort_key(key, value)
+            i = bisect_left(self._by_name, sort_key)
+            if i < len(self._by_name) and self._by_name[i] == sort_key:
+                del self._by_name[i]
+
+    def _set(self, key: str, value):
+        with self._lock:
+            self._unindex(key)
+            super().__setitem__(key, value, _sync_to_fs=False)
+            insort(self._by_name, self._sort_key(key, value))
+
+    def __setitem__(self, key, value, *_, **__):
+        with self._lock:
+            self._set(key, value)
+            self._save_index()
+
+    def update(self, *args, **kwargs):
+        with self._lock:
+            for key, value in dict(*args, **kwargs).items():
+                self._set(key, value)
+            self._save_index()
+
+    def prune(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._unindex(key)
+                self.pop(key, None)
+            self._save_index()
+
+    def by_name(self) -> List[PlaylistMetadata]:
+        """
+        The playlists, sorted by name.
+        """
+        with self._lock:
+            return [dict.__getitem__(self, uri) for _, uri in self._by_name]
 
 
 class TidalPlaylistsProvider(backend.PlaylistsProvider):
     def __init__(self, *args, **kwargs):
         super(TidalPlaylistsProvider, self).__init__(*args, **kwargs)
-        self._playlists_metadata = PlaylistMetadataCache()
-        self._playlists = PlaylistCache()
-        self._current_tidal_playlists = []
+        # Shared with the library provider
+        self._playlists_metadata = self.backend.caches.playlist_metadata
+        self._playlists = self.backend.caches.playlists
+        # Synced list of the playlists of the user, by ID
+        self._tidal_playlists: Dict[str, TidalPlaylist] = {}
+        # When the list of playlists was last synced (monotonic time)
+        self._synced_at: Optional[float] = None
         self._playlists_loaded_event = Event()
+        # Held while the results of a sync or a refresh are swapped in. The
+        # API is never called with it held.
+        self._lock = Lock()
+        # Number of syncs and refreshes in progress, on any thread
+        self._refreshes = 0
+        # Background loads of large playlists, by URI
+        self._filling: Dict[str, Future] = {}
+        self._filling_lock = Lock()
+
+    @property
+    def _current_tidal_playlists(self) -> List[TidalPlaylist]:
+        return list(self._tidal_playlists.values())
+
+    @_current_tidal_playlists.setter
+    def _current_tidal_playlists(self, playlists: List[TidalPlaylist]):
+        self._tidal_playlists = {pl.id: pl for pl in playlists}
 
     def _calculate_added_and_removed_playlist_ids(
         self,
@@ -89,26 +249,55 @@ class TidalPlaylistsProvider(backend.PlaylistsProvider):
             for playlists in pool_res:
                 updated_playlists += playlists
 
-        self._current_tidal_playlists = updated_playlists
-        updated_ids = set(pl.id for pl in updated_playlists)
-        if not self._playlists_metadata:
-            return updated_ids, set()
-
-        current_ids = set(uri.split(":")[-1] for uri in self._playlists_metadata.keys())
-        added_ids = updated_ids.difference(current_ids)
-        removed_ids = current_ids.difference(updated_ids)
-        self._playlists_metadata.prune(
-            *[
+        if current_deadline().expired:
+            # The list may be truncated: pruning the cache against it would
+            # drop playlists that still exist upstream
+            logger.warning("Deadline exceeded: playlist updates not applied")
+            return set(), set()
+
+        with self._lock:
+            self._current_tidal_playlists = updated_playlists
+            self._synced_at = time.monotonic()
+            updated_ids = self._tidal_playlists.keys()
+            if not self._playlists_metadata:
+                return set(updated_ids), set()
+
+            prefix = "tidal:playlist:"
+            current_uris = set(self._playlists_metadata.keys())
+            added_ids = {
+                pl_id for pl_id in updated_ids if prefix + pl_id not in current_uris
+            }
+            removed_uris = [
                 uri
-                for uri in self._playlists_metadata.keys()
-                if uri.split(":")[-1] in removed_ids
+                for uri in current_uris
+                if uri[len(prefix) :] not in self._tidal_playlists
             ]
-        )
+            self._playlists_metadata.prune(*removed_uris)
+
+        return added_ids, {uri[len(prefix) :] for uri in removed_uris}
+
+    def _get_upstream_playlist(self, playlist_id: str) -> Optional[TidalPlaylist]:
+        """
+        The upstream version of a playlist, from the synced list of playlists
+        if it's fresh enough. A stale list is synced again in one batch, and
+        only the playlists missing from it are requested one by one.
+        """
+        if self._synced_at is not None:
+            max_age = (
+                self.backend._config["tidal"].get("playlist_cache_refresh_secs")
+                or LIST_FRESHNESS_SECS
+            )
+            if time.monotonic() - self._synced_at > max_age:
+                self.sync()
 
-        return added_ids, removed_ids
+            pl = self._tidal_playlists.get(playlist_id)
+            if pl:
+                return pl
+
+        return self.backend.session.playlist(playlist_id)
 
     def _has_changes(self, playlist: MopidyPlaylist):
-        upstream_playlist = self.backend.session.playlist(playlist.uri.split(":")[-1])
+        upstream_playlist = self._get_upstream_playlist(playlist.uri.split(":")[-1])
         if not upstream_playlist:
             return True
 
@@ -132,42 +321,118 @@ class TidalPlaylistsProvider(backend.PlaylistsProvider):
 
         return False
 
-    def as_list(self):
-        if not self._playlists_loaded_event.is_set():
+    @contextmanager
+    def _refreshing(self):
+        with self._lock:
+            self._refreshes += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._refreshes -= 1
+
+    def sync(self):
+        """
+        Update the list of playlists, and fetch the metadata of the new ones.
+        """
+        with self._refreshing():
             added_ids, _ = self._calculate_added_and_removed_playlist_ids()
             if added_ids:
-                self.refresh(include_items=False)
+                self._refresh_playlists(include_items=False)
+
+    def as_list(self):
+        # While the playlists are being refreshed, e.g. on the bulk lane, the
+        # cached ones are listed rather than waiting for the refresh
+        if not (self._playlists_loaded_event.is_set() or self._refreshes):
+            self.sync()
 
         logger.debug("Listing TIDAL playlists..")
-        refs = [
+        return [
             Ref.playlist(uri=pl.uri, name=pl.name)
-            for pl in self._playlists_metadata.values()
+            for pl in self._playlists_metadata.by_name()
         ]
 
-        return sorted(refs, key=operator.attrgetter("name"))
-
     def _lookup_mix(self, uri):
         mix_id = uri.split(":")[-1]
         session = self.backend.session
         return session.mix(mix_id)
 
-    def _get_or_refresh_playlist(self, uri) -> Optional[MopidyPlaylist]:
+    def _get_or_refresh_playlist(
+        self, uri, windowed: bool = False
+    ) -> Optional[MopidyPlaylist]:
         parts = uri.split(":")
         if parts[1] == "mix":
             mix = self._lookup_mix(uri)
             return full_models_mappers.create_mopidy_mix_playlist(mix)
 
         playlist = self._playlists.get(uri)
+        if playlist is not None and self._refreshes:
+            # Served from the cache until the refresh in progress completes
+            return playlist
+
         if (playlist is None) or (playlist and self._has_changes(playlist)):
-            self.refresh(uri, include_items=True)
+            if windowed:
+                window = self._get_window(parts[-1])
+                if window:
+                    return window
+            else:
+                with self._filling_lock:
+                    filling = self._filling.get(uri)
+                if filling:
+                    # The whole playlist is already being loaded in the
+                    # background: wait for it rather than loading it twice
+                    wait([filling])
+                    playlist = self._playlists.get(uri)
+                    if playlist is not None:
+                        return playlist
+
+            self._refresh(uri, include_items=True)
         return self._playlists.get(uri)
 
+    def _get_window(self, playlist_id: str) -> Optional[MopidyPlaylist]:
+        """
+        The first tracks of a large playlist, fetched in one request, while
+        the whole playlist is loaded into the cache on the bulk lane. A
+        `playlists_loaded` event is sent once it is there.
+        """
+        pl = self._tidal_playlists.get(playlist_id)
+        if not pl or (pl.num_tracks or 0) <= LAZY_LOAD_MIN_TRACKS:
+            return None
+
+        uri = "tidal:playlist:" + pl.id
+        with self._filling_lock:
+            future = None
+            if uri not in self._filling:
+                logger.info(
+                    'Loading the %d tracks of the playlist "%s" in the background',
+                    pl.num_tracks,
+                    pl.name,
+                )
+                future = self._filling[uri] = self.refresh(uri, include_items=True)
+
+        if future:
+            future.add_done_callback(lambda _: self._filled(uri))
+
+        tracks = full_models_mappers.create_mopidy_tracks(pl.tracks(WINDOW_SIZE, 0))
+        return MopidyPlaylist(
+            uri=uri,
+            name=pl.name,
+            tracks=tracks,
+            last_modified=to_timestamp(pl.last_updated),
+        )
+
+    def _filled(self, uri: str):
+        with self._filling_lock:
+            self._filling.pop(uri, None)
+
     def create(self, name):
         tidal_playlist = self.backend.session.user.create_playlist(name, "")
         pl = create_mopidy_playlist(tidal_playlist, [])
 
-        self._current_tidal_playlists.append(tidal_playlist)
-        self.refresh(pl.uri)
+        self._tidal_playlists[tidal_playlist.id] = tidal_playlist
+        # Listed right away, without waiting for the next sync
+        self._playlists_metadata[pl.uri] = PlaylistMetadata.from_tidal(tidal_playlist)
+        self._refresh(pl.uri)
         return pl
 
     def delete(self, uri):
@@ -193,44 +458,64 @@ class TidalPlaylistsProvider(backend.PlaylistsProvider):
             else:
                 raise e
 
-        self._playlists_metadata.prune(uri)
-        self._playlists.prune(uri)
+        self._tidal_playlists.pop(playlist_id, None)
+        self.backend.caches.invalidate_playlist(uri)
 
     def lookup(self, uri):
         return self._get_or_refresh_playlist(uri)
 
-    def refresh(self, *uris, include_items: bool = True):
+    def refresh(self, *uris, include_items: bool = True) -> Future:
+        """
+        Queue a refresh of the playlists on the bulk lane, so that the backend
+        can still serve playback requests while it runs.
+        """
+        return self.backend.lanes.submit(
+            lanes.BULK, self._refresh, *uris, include_items=include_items
+        )
+
+    def _refresh(self, *uris, include_items: bool = True):
+        with self._refreshing():
+            self._refresh_playlists(*uris, include_items=include_items)
+
+    def _refresh_playlists(self, *uris, include_items: bool = True):
         if uris:
             logger.info("Looking up playlists: %r", uris)
         else:
             logger.info("Refreshing TIDAL playlists..")
 
         session = self.backend.session
-        plists = self._current_tidal_playlists
-        mapped_playlists = {}
+        # The list may be swapped by a concurrent sync
+        tidal_playlists = self._tidal_playlists
+        if uris:
+            plists = [
+                tidal_playlists[uri.split(":")[-1]]
+                for uri in uris
+                if uri.split(":")[-1] in tidal_playlists
+            ]
+        else:
+            plists = list(tidal_playlists.values())
         playlist_cache = self._playlists if include_items else self._playlists_metadata
 
-        for pl in plists:
-            uri = "tidal:playlist:" + pl.id
-            # Skip or cache hit case
-            if (uris and uri not in uris) or pl in playlist_cache:
-                continue
+        # Skip or cache hit case
+        misses = [pl for pl in plists if pl not in playlist_cache]
+
+        # Cache miss case
+        load = partial(self._load_playlist, session, include_items=include_items)
+        if include_items and len(misses) > 1:
+            # Tracks are loaded concurrently across playlists, and the results
+            # keep the order of the playlists
+            with worker_pool(
+                min(ITEMS_WORKERS, len(misses)), "mopidy-tidal-playlist-items-"
+            ) as pool:
+                loaded = map_within_deadline(pool, load, misses)
+        else:
+            loaded = [load(pl) for pl in misses]
 
-            # Cache miss case
-            if include_items:
-                pl_tracks = self._retrieve_api_tracks(session, pl)
-                tracks = full_models_mappers.create_mopidy_tracks(pl_tracks)
-            else:
-                # Create as many mock tracks as the number of items in the playlist.
-                # Playlist metadata is concerned only with the number of tracks, not
-                # the actual list.
-                tracks = [mock_track] * pl.num_tracks
-
-            mapped_playlists[uri] = MopidyPlaylist(
-                uri=uri,
-                name=pl.name,
-                tracks=tracks,
-                last_modified=to_timestamp(pl.last_updated),
+        mapped_playlists = {pl.uri: pl for pl in loaded if pl}
+        if len(mapped_playlists) < len(misses):
+            logger.warning(
+                "Deadline exceeded: %d playlists not loaded",
+                len(misses) - len(mapped_playlists),
             )
 
         # When we trigger a playlists_loaded event the backend may call as_list
@@ -248,17 +533,46 @@ class TidalPlaylistsProvider(backend.PlaylistsProvider):
             ).start()
 
         # Update the right playlist cache and send the playlists_loaded event.
-        playlist_cache.update(mapped_playlists)
+        with self._lock:
+            playlist_cache.update(mapped_playlists)
         backend.BackendListener.send("playlists_loaded")
         logger.info("TIDAL playlists refreshed")
 
+    def _load_playlist(
+        self, session, pl: TidalPlaylist, include_items: bool = True
+    ) -> Union[MopidyPlaylist, PlaylistMetadata]:
+        if include_items:
+            pl_tracks = self._retrieve_api_tracks(session, pl)
+            tracks = full_models_mappers.create_mopidy_tracks(pl_tracks)
+        else:
+            return PlaylistMetadata.from_tidal(pl)
+
+        return MopidyPlaylist(
+            uri="tidal:playlist:" + pl.id,
+            name=pl.name,
+            tracks=tracks,
+            last_modified=to_timestamp(pl.last_updated),
+        )
+
     def get_items(self, uri) -> Optional[List[Ref]]:
-        playlist = self._get_or_refresh_playlist(uri)
+        # Only the listing of large playlists may be windowed: lookup() and
+        # save() need all their tracks, or editing them would drop the rest
+        playlist = self._get_or_refresh_playlist(uri, windowed=True)
         if not playlist:
             return
 
         return [Ref.track(uri=t.uri, name=t.name) for t in playlist.tracks]
 
+    @staticmethod
+    def _edit_items(session, method: str, path: str, etag, data=None):
+        """
+        Edit the tracks of a playlist, and return its new ETag.
+        """
+        response = session.request.request(
+            method, path, data=data, headers={"If-None-Match": etag}
+        )
+        return response.headers.get("etag", etag)
+
     def _retrieve_api_tracks(self, session, playlist):
         getter_args = tuple()
         return get_items(playlist.tracks, *getter_args)
@@ -272,26 +586,22 @@ class TidalPlaylistsProvider(backend.PlaylistsProvider):
         upstream_playlist = session.playlist(playlist_id)
 
         # Playlist rename case
-        if old_playlist.name != playlist.name:
+        renamed = old_playlist.name != playlist.name
+        if renamed:
             upstream_playlist.edit(title=playlist.name)
 
-        additions = []
-        removals = []
-        remove_offset = 0
-        diff_lines = difflib.ndiff(
+        removals, insertions = diff(
             [t.uri for t in old_playlist.tracks], [t.uri for t in playlist.tracks]
         )
 
-        for diff_line in diff_lines:
-            if diff_line.startswith("+ "):
-                additions.append(diff_line[2:].split(":")[-1])
-            else:
-                if diff_line.startswith("- "):
-                    removals.append(remove_offset)
-                remove_offset += 1
+        # tidalapi 0.7.0 removes one track per request and only appends: the
+        # items endpoint is called directly, which takes batches of indices
+        # and insertion positions. Each edit changes the ETag of the playlist
+        items_path = f"playlists/{playlist_id}/items"
+        etag = getattr(upstream_playlist, "_etag", None)
 
-        # Process removals in descending order so we don't have to recalculate
-        # the offsets while we remove tracks
+        # Remove the tracks in batches, from the last ones, so the offsets of
+        # the next batches don't change
         if removals:
             logger.info(
                 'Removing %d tracks from the playlist "%s"',
@@ -299,20 +609,62 @@ class TidalPlaylistsProvider(backend.PlaylistsProvider):
                 playlist.name,
             )
 
-            removals.reverse()
-            for idx in removals:
-                upstream_playlist.remove_by_index(idx)
-
-        # tidalapi currently only supports appending tracks to the end of the
-        # playlist
-        if additions:
+            batches = [
+                removals[i : i + REMOVE_BATCH_SIZE]
+                for i in range(0, len(removals), REMOVE_BATCH_SIZE)
+            ]
+            for batch in reversed(batches):
+                etag = self._edit_items(
+                    session,
+                    "DELETE",
+                    f"{items_path}/{','.join(map(str, batch))}",
+                    etag,
+                )
+
+        # Insert each run of consecutive new tracks at its position
+        if insertions:
             logger.info(
-                'Adding %d tracks to the playlist "%s"', len(additions), playlist.name
+                'Adding %d tracks to the playlist "%s"', len(insertions), playlist.name
             )
 
-            upstream_playlist.add(additions)
+            runs: List[Tuple[int, List[str]]] = []
+            for index, uri in insertions:
+                track_id = uri.split(":")[-1]
+                if runs and runs[-1][0] + len(runs[-1][1]) == index:
+                    if len(runs[-1][1]) < ADD_BATCH_SIZE:
+                        runs[-1][1].append(track_id)
+                        continue
+                runs.append((index, [track_id]))
+
+            for index, track_ids in runs:
+                etag = self._edit_items(
+                    session,
+                    "POST",
+                    items_path,
+                    etag,
+                    data={
+                        "onArtifactNotFound": "SKIP",
+                        # The upstream playlist has to match the saved one
+                        "onDupes": "ADD",
+                        "trackIds": ",".join(track_ids),
+                        "toIndex": index,
+                    },
+                )
+
+        if not (renamed or removals or insertions):
+            return
 
-        # remove all defunct tracks from cache
-        self._calculate_added_and_removed_playlist_ids()
-        # force update the whole playlist so all state is good
-        self.refresh(playlist.uri)
+        # Patch the cached playlist instead of fetching its tracks again. Only
+        # the playlist itself is read again, for its new modification time
+        upstream_playlist = session.playlist(playlist_id)
+        last_modified = to_timestamp(getattr(upstream_playlist, "last_updated", None))
+        self._playlists[playlist.uri] = playlist.replace(last_modified=last_modified)
+        metadata = self._playlists_metadata.get(playlist.uri)
+        self._playlists_metadata[playlist.uri] = PlaylistMetadata(
+            uri=playlist.uri,
+            name=playlist.name,
+            count=len(playlist.tracks),
+            last_modified=last_modified,
+            owner=metadata.owner if metadata else None,
+            image_id=metadata.image_id if metadata else None,
+        )
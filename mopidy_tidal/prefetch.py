@@ -0,0 +1,109 @@
+from __future__ import unicode_literals
+
+import logging
+from typing import Callable, List, Optional
+
+from pykka import ActorRegistry
+
+from mopidy_tidal import lanes
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for core to answer about the tracklist
+CORE_TIMEOUT = 10
+
+
+def get_core():
+    """
+    A proxy of the running Mopidy core actor, if any.
+    """
+    refs = ActorRegistry.get_by_class_name("Core")
+    return refs[0].proxy() if refs else None
+
+
+class Prefetcher:
+    """
+    Resolve the stream URLs (and optionally the metadata and cover art) of
+    the next tracks of the tracklist while the current one starts, so that
+    moving on to them doesn't wait for the API.
+
+    Core asks the backend for a track before making it current, so the
+    tracklist is queried from the prefetch lane once the backend call has
+    returned, never from the backend actor itself. The metadata is looked up
+    from the prefetch lane as well, without queueing behind the actor: the
+    caches of the library can be written from several threads.
+    """
+
+    def __init__(
+        self,
+        backend,
+        count: int = 2,
+        metadata: bool = False,
+        core_getter: Callable = get_core,
+    ):
+        """
+        :param backend: The TIDAL backend
+        :param count: Number of tracks to prefetch after the current one
+            (default: 2)
+        :param metadata: Whether to also prefetch the metadata and the cover
+            art of the tracks (default: False)
+        :param core_getter: Returns a proxy of the Mopidy core actor
+        """
+        self._backend = backend
+        self._count = count
+        self._metadata = metadata
+        self._core_getter = core_getter
+
+    @property
+    def enabled(self) -> bool:
+        return self._count > 0
+
+    def schedule(self, uri: str):
+        """
+        Prefetch the tracks that follow `uri` in the tracklist, in the
+        background.
+        """
+        if self.enabled:
+            self._backend.lanes.submit(lanes.PREFETCH, self._prefetch_after, uri)
+
+    def next_uris(self, uri: str) -> List[str]:
+        """
+        The URIs of the TIDAL tracks that are going to be played after `uri`,
+        following the playback mode (repeat, random, single) of the tracklist.
+        """
+        core = self._core_getter()
+        if not core:
+            return []
+
+        tracklist = core.tracklist
+        tl_tracks = tracklist.filter({"uri": [uri]}).get(timeout=CORE_TIMEOUT)
+        tl_track = tl_tracks[0] if tl_tracks else None
+        uris = []
+        seen = {uri}
+        while tl_track and len(uris) < self._count:
+            tl_track = tracklist.next_track(tl_track).get(timeout=CORE_TIMEOUT)
+            next_uri = tl_track.track.uri if tl_track else None
+            if not next_uri or next_uri in seen:
+                break
+
+            seen.add(next_uri)
+            if next_uri.startswith("tidal:track:"):
+                uris.append(next_uri)
+
+        return uris
+
+    def _prefetch_after(self, uri: str) -> Optional[List[str]]:
+        try:
+            uris = self.next_uris(uri)
+            if not uris:
+                return uris
+
+            logger.debug("Prefetching %r", uris)
+            self._backend.playback.prefetch(uris)
+            if self._metadata:
+                self._backend.library.lookup(uris=uris)
+                self._backend.library.images.get_images(uris)
+            return uris
+        except Exception as e:
+            logger.info("Could not prefetch the tracks after %s: %s", uri, e)
+            return None
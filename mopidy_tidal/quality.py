@@ -0,0 +1,115 @@
+from __future__ import unicode_literals
+
+import logging
+from collections import Counter
+from threading import Lock
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Stream qualities, from the lowest
+QUALITIES = ("LOW", "HIGH", "LOSSLESS")
+
+# Bitrate of the streams of each quality, in kbit/s
+bitrates = {
+    "LOW": 96,
+    "HIGH": 320,
+    "LOSSLESS": 1411,
+}
+
+
+def _ewma(average: Optional[float], sample: float, alpha: float) -> float:
+    return sample if average is None else alpha * sample + (1 - alpha) * average
+
+
+class QualitySelector:
+    """
+    Pick the stream quality of the next tracks from the download throughput
+    and the startup latency measured on the previous ones, between a lower
+    and an upper bound.
+
+    A quality is picked when the measured throughput exceeds its bitrate by
+    `headroom`, and slow starts cost one more quality step. Without any
+    measurement the upper bound is used.
+    """
+
+    def __init__(
+        self,
+        min_quality: str = "LOW",
+        max_quality: str = "LOSSLESS",
+        headroom: float = 1.5,
+        slow_startup: float = 3,
+        alpha: float = 0.3,
+    ):
+        """
+        :param min_quality: Lowest quality to pick (default: LOW)
+        :param max_quality: Highest quality to pick (default: LOSSLESS)
+        :param headroom: Throughput needed to pick a quality, as a multiple
+            of its bitrate (default: 1.5)
+        :param slow_startup: Tracks taking longer than this many seconds to
+            start lower the quality (default: 3)
+        :param alpha: Weight of the new samples in the moving averages
+            (default: 0.3)
+        """
+        low, high = QUALITIES.index(min_quality), QUALITIES.index(max_quality)
+        self._qualities = QUALITIES[min(low, high) : high + 1]
+        self._headroom = headroom
+        self._slow_startup = slow_startup
+        self._alpha = alpha
+        self._lock = Lock()
+        self.throughput: Optional[float] = None
+        self.startup_latency: Optional[float] = None
+        self.decisions: Counter = Counter()
+        self.last_quality: Optional[str] = None
+
+    def record_throughput(self, size: int, seconds: float):
+        """
+        Record the download of `size` bytes in `seconds`.
+        """
+        if size <= 0 or seconds <= 0:
+            return
+
+        kbps = size * 8 / 1000 / seconds
+        with self._lock:
+            self.throughput = _ewma(self.throughput, kbps, self._alpha)
+
+    def record_startup(self, seconds: float):
+        """
+        Record the time between the request of a track and the start of its
+        audio source.
+        """
+        with self._lock:
+            self.startup_latency = _ewma(self.startup_latency, seconds, self._alpha)
+
+    def choose(self, record: bool = True) -> str:
+        """
+        The quality of the next stream. Only recorded decisions are counted
+        in `decisions` and logged.
+        """
+        with self._lock:
+            throughput, latency = self.throughput, self.startup_latency
+            index = len(self._qualities) - 1
+            if throughput is not None:
+                while (
+                    index > 0
+                    and bitrates[self._qualities[index]] * self._headroom > throughput
+                ):
+                    index -= 1
+            if latency is not None and latency > self._slow_startup:
+                index = max(0, index - 1)
+
+            quality = self._qualities[index]
+            if not record:
+                return quality
+
+            self.decisions[quality] += 1
+            changed, self.last_quality = quality != self.last_quality, quality
+
+        if changed:
+            logger.info(
+                "Stream quality: %s (throughput: %s kbit/s, startup: %s s)",
+                quality,
+                "?" if throughput is None else f"{throughput:.0f}",
+                "?" if latency is None else f"{latency:.2f}",
+            )
+        return quality
@@ -4,6 +4,8 @@ import logging
 
 from mopidy.models import Ref
 
+from mopidy_tidal.images import image_ids
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,9 +26,9 @@ def create_artists(tidal_artists):
 
 
 def create_artist(tidal_artist):
-    return Ref.artist(
-        uri="tidal:artist:" + str(tidal_artist.id), name=tidal_artist.name
-    )
+    uri = "tidal:artist:" + str(tidal_artist.id)
+    image_ids.add(uri, tidal_artist)
+    return Ref.artist(uri=uri, name=tidal_artist.name)
 
 
 def create_playlists(tidal_playlists):
@@ -34,9 +36,9 @@ def create_playlists(tidal_playlists):
 
 
 def create_playlist(tidal_playlist):
-    return Ref.playlist(
-        uri="tidal:playlist:" + str(tidal_playlist.id), name=tidal_playlist.name
-    )
+    uri = "tidal:playlist:" + str(tidal_playlist.id)
+    image_ids.add(uri, tidal_playlist)
+    return Ref.playlist(uri=uri, name=tidal_playlist.name)
 
 
 def create_moods(tidal_moods):
@@ -73,7 +75,9 @@ def create_albums(tidal_albums):
 
 
 def create_album(tidal_album):
-    return Ref.album(uri="tidal:album:" + str(tidal_album.id), name=tidal_album.name)
+    uri = "tidal:album:" + str(tidal_album.id)
+    image_ids.add(uri, tidal_album)
+    return Ref.album(uri=uri, name=tidal_album.name)
 
 
 def create_tracks(tidal_tracks):
@@ -84,4 +88,5 @@ def create_track(tidal_track):
     uri = "tidal:track:{0}:{1}:{2}".format(
         tidal_track.artist.id, tidal_track.album.id, tidal_track.id
     )
+    image_ids.add("tidal:album:" + str(tidal_track.album.id), tidal_track.album)
     return Ref.track(uri=uri, name=tidal_track.name)
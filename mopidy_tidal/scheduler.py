@@ -0,0 +1,150 @@
+from __future__ import unicode_literals
+
+import heapq
+import logging
+import random
+import time
+from contextlib import contextmanager
+from threading import Condition, Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Run periodic jobs on a background thread, off the request path. Each run
+    is scheduled after a randomly jittered interval, so jobs started together
+    drift apart and don't hit the API at the same time. Jobs that become due
+    while playback-critical work is in flight are postponed until it ends.
+    """
+
+    def __init__(
+        self,
+        jitter: float = 0.1,
+        initial_delay: float = 5,
+        busy_delay: float = 1,
+    ):
+        """
+        :param jitter: Maximum relative deviation of each interval
+            (default: 0.1)
+        :param initial_delay: Seconds before the first run of the jobs
+            (default: 5)
+        :param busy_delay: Seconds to wait before retrying a job that was
+            postponed by playback-critical work (default: 1)
+        """
+        self._jitter = jitter
+        self._initial_delay = initial_delay
+        self._busy_delay = busy_delay
+        self._jobs: Dict[str, Tuple[Callable, float]] = {}
+        self._queue: List[Tuple[float, str]] = []
+        self._cond = Condition()
+        self._critical = 0
+        self._thread: Optional[Thread] = None
+        self._stopped = False
+        self.runs: Dict[str, int] = {}
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+    def add_job(self, name: str, func: Callable, interval: float):
+        """
+        Run `func` every `interval` seconds (with jitter), starting shortly
+        after the scheduler is started.
+        """
+        with self._cond:
+            self._jobs[name] = (func, interval)
+            self.runs.setdefault(name, 0)
+            due = time.monotonic() + self._jittered(self._initial_delay)
+            heapq.heappush(self._queue, (due, name))
+            self._cond.notify()
+
+    @property
+    def busy(self) -> bool:
+        with self._cond:
+            return self._critical > 0
+
+    @contextmanager
+    def critical(self):
+        """
+        Mark the enclosed block as playback-critical: no job starts while it
+        runs.
+        """
+        with self._cond:
+            self._critical += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._critical -= 1
+                self._cond.notify()
+
+    def start(self):
+        with self._cond:
+            if self._thread:
+                return
+            self._stopped = False
+            self._thread = Thread(
+                target=self._run, name="mopidy-tidal-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stop the scheduler. A job that is running is left to complete.
+
+        :param timeout: Max seconds to wait for the running job, if any. The
+            thread is a daemon, so it doesn't keep the process alive
+            (default: wait until it completes)
+        """
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopped = True
+            self._cond.notify()
+
+        if thread:
+            thread.join(timeout)
+
+    def _next_job(self) -> Optional[Tuple[str, Callable]]:
+        """
+        Wait until a job is due and no critical work is in flight, and
+        return it. Returns None once the scheduler is stopped.
+        """
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+
+                due, name = self._queue[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+
+                heapq.heappop(self._queue)
+                func, interval = self._jobs[name]
+                if self._critical:
+                    logger.debug("Playback in progress: postponing the %s job", name)
+                    heapq.heappush(self._queue, (now + self._busy_delay, name))
+                    continue
+
+                heapq.heappush(self._queue, (now + self._jittered(interval), name))
+                return name, func
+
+        return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if not job:
+                return
+
+            name, func = job
+            logger.debug("Running the %s job", name)
+            try:
+                func()
+            except Exception as e:
+                logger.warning("The %s job failed: %s", name, e)
+            finally:
+                self.runs[name] += 1
@@ -1,8 +1,8 @@
 from __future__ import unicode_literals
 
+import concurrent.futures
 import logging
 from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import IntEnum
 from typing import (
@@ -11,6 +11,7 @@ from typing import (
     Iterable,
     List,
     Mapping,
+    Optional,
     Sequence,
     Tuple,
     Type,
@@ -18,16 +19,20 @@ from typing import (
 )
 
 from lru_cache import SearchCache
+from requests import HTTPError
 from tidalapi.album import Album
 from tidalapi.artist import Artist
 from tidalapi.media import Track
 
+from mopidy_tidal import aio
 from mopidy_tidal.full_models_mappers import (
     create_mopidy_albums,
     create_mopidy_artists,
     create_mopidy_tracks,
 )
+from mopidy_tidal.lru_cache import AlbumTracksIndex
 from mopidy_tidal.utils import remove_watermark
+from mopidy_tidal.workers import current_deadline, map_within_deadline, worker_pool
 
 logger = logging.getLogger(__name__)
 
@@ -153,20 +158,46 @@ def _expand_album_tracks(album: Album) -> List[Track]:
 
 def _expand_results_tracks(
     results: Tuple[List[Artist], List[Album], List[Track]],
+    album_index: Optional[AlbumTracksIndex] = None,
 ) -> Tuple[List[Artist], List[Album], List[Track]]:
     results_ = list(results)
     artists = results_[0]
     albums = results_[1]
 
-    with ThreadPoolExecutor(4, thread_name_prefix="mopidy-tidal-search-") as pool:
-        pool_res = pool.map(_expand_artist_top_tracks, artists)
-        for tracks in pool_res:
-            results_[2].extend(tracks)
+    client = aio.get_client()
+    expanded = None
+    if client:
+        try:
+            expanded = client.run(
+                client.expand_tracks(artists, albums),
+                timeout=current_deadline().remaining(),
+            )
+        except concurrent.futures.TimeoutError:
+            logger.warning("Deadline exceeded: search results not expanded")
+            expanded = ([], [])
+        except (HTTPError, OSError, EOFError, ValueError) as err:
+            logger.warning("Asynchronous search expansion failed: %s", err)
+
+    if expanded is None:
+        with worker_pool(4, thread_name_prefix="mopidy-tidal-search-") as pool:
+            # Expansions that don't complete before the deadline are skipped
+            expanded = (
+                map_within_deadline(
+                    pool, _expand_artist_top_tracks, artists, default=[]
+                ),
+                map_within_deadline(pool, _expand_album_tracks, albums, default=[]),
+            )
 
-        pool_res = pool.map(_expand_album_tracks, albums)
+    for pool_res in expanded:
         for tracks in pool_res:
             results_[2].extend(tracks)
 
+    if album_index is not None:
+        # Expansions skipped after the deadline are empty: don't index them
+        for album, tracks in zip(albums, expanded[1]):
+            if tracks:
+                album_index.add_album(album.id, create_mopidy_tracks(tracks))
+
     # Remove any duplicate tracks from results
     tracks_by_id = OrderedDict({track.id: track for track in results_[2]})
     results_[2] = list(tracks_by_id.values())
@@ -174,7 +205,7 @@ def _expand_results_tracks(
 
 
 @SearchCache
-def tidal_search(session, query, exact=False):
+def tidal_search(session, query, exact=False, album_index=None):
     logger.info("Searching Tidal for: %r", query)
     query = query.copy()
 
@@ -203,7 +234,7 @@ def tidal_search(session, query, exact=False):
     if exact:
         results = list(_get_exact_result(query, tuple(results), field_meta))
 
-    _expand_results_tracks(results)
+    _expand_results_tracks(results, album_index)
     for i, field_type in enumerate(
         (SearchField.ARTIST, SearchField.ALBUM, SearchField.TITLE)
     ):
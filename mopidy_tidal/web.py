@@ -0,0 +1,10 @@
+from __future__ import unicode_literals
+
+from mopidy_tidal import audio_proxy, image_proxy
+
+
+def factory(config, core):
+    """
+    Routes of the local image and audio proxies, served under `/tidal/`.
+    """
+    return image_proxy.factory(config, core) + audio_proxy.factory(config, core)
@@ -1,5 +1,122 @@
-from concurrent.futures import ThreadPoolExecutor
-from typing import Callable
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable, List, Optional
+
+from mopidy_tidal import context
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        :param timeout: Time budget in seconds. Set 0 or None for no limit
+            (default: None)
+        """
+        self._expires_at = time.monotonic() + timeout if timeout else None
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left before the deadline, or None if there is no deadline.
+        """
+        if self._expires_at is None:
+            return None
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self._expires_at is not None and time.monotonic() >= self._expires_at
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "mopidy_tidal_deadline", default=None
+)
+
+
+def current_deadline() -> Deadline:
+    """
+    The deadline of the operation in progress in this thread. If no operation
+    set one, a deadline that never expires is returned.
+    """
+    return _current_deadline.get() or Deadline()
+
+
+@contextmanager
+def deadline(timeout: Optional[float]):
+    """
+    Run the enclosed block with a time budget of `timeout` seconds. Nested
+    deadlines can only shorten the enclosing one, never extend it.
+    """
+    new_deadline = Deadline(timeout)
+    outer = _current_deadline.get()
+    if outer and outer.remaining() is not None:
+        remaining = new_deadline.remaining()
+        if remaining is None or outer.remaining() < remaining:
+            new_deadline = outer
+
+    token = _current_deadline.set(new_deadline)
+    try:
+        yield new_deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def with_deadline(operation: str):
+    """
+    Decorate a provider method so that it runs within the time budget
+    configured through `<operation>_timeout_secs`.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            timeout = context.get_config()["tidal"].get(f"{operation}_timeout_secs")
+            with deadline(timeout):
+                return method(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def worker_pool(processes: int, thread_name_prefix: str):
+    """
+    A thread pool that doesn't wait for outstanding requests on exit if the
+    current deadline has expired: queued requests are cancelled and running
+    ones are left to complete in the background.
+    """
+    pool = ThreadPoolExecutor(processes, thread_name_prefix=thread_name_prefix)
+    try:
+        yield pool
+    finally:
+        pool.shutdown(wait=not current_deadline().expired, cancel_futures=True)
+
+
+def map_within_deadline(pool, func: Callable, items: Iterable, default=None) -> List:
+    """
+    Like `pool.map`, but stop waiting when the current deadline expires. The
+    results that aren't available by then are cancelled and replaced by
+    `default`, so the output keeps the same order as `items`. The requests
+    run in a copy of the caller's context, so they share its deadline.
+    """
+    futures = [
+        pool.submit(contextvars.copy_context().run, func, item) for item in items
+    ]
+    done, not_done = wait(futures, timeout=current_deadline().remaining())
+    if not_done:
+        logger.warning(
+            "Deadline exceeded: cancelling %d outstanding requests", len(not_done)
+        )
+        for future in not_done:
+            future.cancel()
+
+    return [future.result() if future in done else default for future in futures]
 
 
 def func_wrapper(args):
@@ -19,18 +136,31 @@ def get_items(
     This function performs pagination on a function that supports
     `limit`/`offset` parameters and it runs API requests in parallel to speed
     things up.
+
+    If the current deadline expires, the outstanding page requests are
+    cancelled and only the items up to the first missing page are returned.
+
+    If the asyncio engine is enabled and `func` maps to a known endpoint, the
+    pages are fetched on the event loop instead of a thread pool.
     """
+    from mopidy_tidal import aio
+
+    client = aio.get_client()
+    if client and not args:
+        items = client.get_items(func, chunk_size=chunk_size)
+        if items is not None:
+            return list(map(parse, items))
+
     items = []
     offsets = [-chunk_size]
     remaining = chunk_size * processes
 
-    with ThreadPoolExecutor(
-        processes, thread_name_prefix=f"mopidy-tidal-{func.__name__}-"
-    ) as pool:
+    with worker_pool(processes, f"mopidy-tidal-{func.__name__}-") as pool:
         while remaining == chunk_size * processes:
             offsets = [offsets[-1] + chunk_size * (i + 1) for i in range(processes)]
 
-            pool_results = pool.map(
+            pool_results = map_within_deadline(
+                pool,
                 func_wrapper,
                 [
                     (
@@ -46,10 +176,18 @@ def get_items(
 
             new_items = []
             for results in pool_results:
+                if results is None:
+                    # Page not retrieved in time: drop everything after it
+                    break
                 new_items.extend(results)
 
             remaining = len(new_items)
             items.extend(new_items)
+            if current_deadline().expired:
+                logger.warning(
+                    "Deadline exceeded: returning the first %d items", len(items)
+                )
+                break
 
     items = [_ for _ in items if _]
     sorted_items = list(
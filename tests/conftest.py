@@ -1,3 +1,6 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer
 from typing import Iterable
 from unittest.mock import Mock
 
@@ -181,3 +184,64 @@ def compare():
     """
 
     return _compare
+
+
+def _favorites_api(favorites, items):
+    favorites.requests.request.return_value.json.side_effect = lambda: {
+        "totalNumberOfItems": len(items)
+    }
+    favorites.requests.map_request.side_effect = lambda url, params, parse: items[
+        params["offset"] : params["offset"] + params["limit"]
+    ]
+
+
+@pytest.fixture
+def favorites_api():
+    """Serve favorites from a mocked TIDAL favorites endpoint.
+
+    Args:
+        favorites: The mocked favorites of the TIDAL user.
+        items: The favorites, the most recently added first.
+    """
+
+    return _favorites_api
+
+
+def _wait_for(condition, timeout=2):
+    expires_at = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < expires_at, "Timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def wait_for():
+    """Wait until a condition holds, or fail.
+
+    Args:
+        condition: Callable returning whether the condition holds.
+        timeout: Seconds to wait for at most (default: 2).
+    """
+
+    return _wait_for
+
+
+@pytest.fixture
+def origin(origin_handler):
+    """Local HTTP server standing in for a TIDAL origin.
+
+    Test modules provide the request handler as the `origin_handler` fixture.
+    The server records the requested paths in `requests`, and its handler can
+    read the delay to add to each response from `latency`.
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), origin_handler)
+    server.daemon_threads = True
+    server.requests = []
+    server.latency = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
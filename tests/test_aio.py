@@ -0,0 +1,153 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from requests import HTTPError
+from tidalapi.user import Favorites
+
+from mopidy_tidal import aio
+from mopidy_tidal.workers import get_items
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        server.requests.append((url.path, params, dict(self.headers)))
+        if not url.path.endswith("/tracks"):
+            return self._send(404, {"userMessage": "Not found"})
+
+        offset, limit = int(params["offset"]), int(params["limit"])
+        if offset in server.slow_offsets:
+            sleep(server.latency)
+        items = [
+            {"id": i} for i in range(offset, min(offset + limit, server.total_items))
+        ]
+        self._send(200, {"items": items, "totalNumberOfItems": server.total_items})
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if self.server.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(body), 64):
+                chunk = body[i : i + 64]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.total_items = 1234
+    server.chunked = False
+    server.latency = 0
+    server.slow_offsets = ()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(api_server, mocker):
+    session = mocker.Mock()
+    session.config.api_v1_location = (
+        f"http://127.0.0.1:{api_server.server_address[1]}/v1/"
+    )
+    session.token_type = "Bearer"
+    session.access_token = "token"
+    session.session_id = "session"
+    session.country_code = "US"
+    session.parse_track = lambda json_obj: json_obj["id"]
+    session.request.map_json = lambda json_obj, parse: list(
+        map(parse, json_obj["items"])
+    )
+    engine = aio.AsyncEngine()
+    engine.start()
+    client = aio.TidalAsyncClient(engine, lambda: session, max_connections=4)
+    yield client
+    client.close()
+    engine.stop()
+
+
+def test_paginate(client, api_server):
+    items = client.run(client.paginate("users/1/favorites/tracks"))
+    assert items == [{"id": i} for i in range(1234)]
+    assert len(api_server.requests) == 13
+    path, params, headers = api_server.requests[0]
+    assert path == "/v1/users/1/favorites/tracks"
+    assert params == {
+        "sessionId": "session",
+        "countryCode": "US",
+        "limit": "100",
+        "offset": "0",
+    }
+    assert headers["Authorization"] == "Bearer token"
+
+
+def test_paginate_parse_chunked(client, api_server):
+    api_server.chunked = True
+    items = client.run(client.paginate("playlists/1/tracks", parse=lambda j: j["id"]))
+    assert items == list(range(1234))
+
+
+def test_paginate_reuses_connections(client, api_server, mocker):
+    open_connection = mocker.spy(aio.asyncio, "open_connection")
+    client.run(client.paginate("playlists/1/tracks"))
+    client.run(client.paginate("playlists/1/tracks"))
+    assert len(api_server.requests) == 26
+    assert open_connection.call_count <= 4
+
+
+def test_paginate_timeout_returns_ordered_prefix(client, api_server):
+    api_server.latency = 0.5
+    api_server.slow_offsets = (500,)
+    items = client.run(client.paginate("playlists/1/tracks", timeout=0.2))
+    assert items == [{"id": i} for i in range(500)]
+
+
+def test_get_error(client):
+    with pytest.raises(HTTPError) as e:
+        client.run(client.get("albums/1"))
+    assert e.value.response.status_code == 404
+
+
+def test_get_items_bridge(client, api_server, mocker):
+    favorites = Favorites(client.session, 1)
+    mocker.patch("mopidy_tidal.aio._client", client)
+    assert get_items(favorites.tracks) == list(range(1234))
+    assert api_server.requests[0][0] == "/v1/users/1/favorites/tracks"
+
+
+def test_get_items_bridge_unknown_endpoint(client, mocker):
+    mocker.patch("mopidy_tidal.aio._client", client)
+
+    def get_page(limit, offset):
+        return list(range(offset, min(offset + limit, 150)))
+
+    assert get_items(get_page) == list(range(150))
+
+
+def test_get_items_bridge_falls_back_on_error(client, api_server, mocker):
+    favorites = Favorites(client.session, 1)
+    assert client.get_items(favorites.albums) is None
+    assert api_server.requests[0][0] == "/v1/users/1/favorites/albums"
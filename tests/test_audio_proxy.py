@@ -0,0 +1,240 @@
+import asyncio
+import os
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import tornado.web
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from mopidy_tidal import audio_proxy
+from mopidy_tidal.audio_proxy import AudioCache, parse_range
+
+track = bytes(range(256)) * 1024
+key = "1234-LOSSLESS"
+
+
+class FakeOriginHandler(BaseHTTPRequestHandler):
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        byte_range = parse_range(self.headers.get("Range"), len(track))
+        server.requests.append((self.path, self.headers.get("Range")))
+        if self.path == "/truncated.flac":
+            # The connection drops halfway through the file
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/flac")
+            self.send_header("Content-Length", str(len(track)))
+            self.end_headers()
+            self.wfile.write(track[: len(track) // 2])
+            return
+
+        if self.path != "/1234.flac":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, len(track) - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", "audio/flac")
+        self.send_header("Content-Length", str(end - start + 1))
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(track)}")
+        self.end_headers()
+        self.wfile.write(track[start : end + 1])
+
+
+@pytest.fixture
+def origin_handler():
+    return FakeOriginHandler
+
+
+@pytest.fixture
+def cache(origin, tmp_path):
+    cache = AudioCache(str(tmp_path / "audio_files"), max_size=10 * len(track))
+    cache.register(key, origin.url + "/1234.flac")
+    yield cache
+    cache.close()
+
+
+async def fetch_all(wait_for, cache, requests):
+    sock, port = bind_unused_port()
+    app = tornado.web.Application(
+        [(r"/tidal/audio/(.+)", audio_proxy.AudioHandler, {"cache": cache})]
+    )
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+    client = AsyncHTTPClient()
+    responses = []
+    try:
+        for path, headers in requests:
+            responses.append(
+                await client.fetch(
+                    f"http://127.0.0.1:{port}/tidal/audio/{path}",
+                    headers=headers,
+                    raise_error=False,
+                )
+            )
+            if path == key:
+                # Let the download in progress land in the cache
+                await asyncio.get_running_loop().run_in_executor(
+                    None, wait_for, lambda: not cache._fills
+                )
+        return responses
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def fetch(wait_for):
+    """Request tracks from the audio handler, in order."""
+
+    def fetch(cache, *requests):
+        return asyncio.run(fetch_all(wait_for, cache, requests))
+
+    return fetch
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=900-2000", (900, 999)),
+        ("bytes=1000-", None),
+        ("bytes=-", None),
+        ("bytes=0-1,5-6", None),
+        (None, None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+def test_stream_through_and_replay(cache, origin, fetch):
+    first, replay = fetch(cache, (key, {}), (key, {}))
+    assert first.code == replay.code == 200
+    assert first.body == replay.body == track
+    assert replay.headers["Content-Type"] == "audio/flac"
+    assert origin.requests == [("/1234.flac", None)]
+    assert cache.get_file(key).endswith(".flac")
+
+
+def test_download_reported(cache, origin, fetch):
+    downloads = []
+    cache.on_download = lambda size, seconds: downloads.append((size, seconds))
+    fetch(cache, (key, {}))
+    assert len(downloads) == 1
+    assert downloads[0][0] == len(track)
+    assert downloads[0][1] > 0
+
+
+def test_stream_start_reported(cache, origin, fetch):
+    started = []
+    cache.on_stream_start = started.append
+    fetch(cache, (key, {}), (key, {"Range": "bytes=0-9"}))
+    # Once per request, when its first audio data is sent
+    assert started == [key, key]
+
+
+def test_range_from_disk(cache, origin, fetch):
+    _, partial, suffix, invalid = fetch(
+        cache,
+        (key, {}),
+        (key, {"Range": "bytes=1000-1999"}),
+        (key, {"Range": "bytes=-10"}),
+        (key, {"Range": f"bytes={len(track)}-"}),
+    )
+    assert partial.code == 206
+    assert partial.body == track[1000:2000]
+    assert partial.headers["Content-Range"] == f"bytes 1000-1999/{len(track)}"
+    assert suffix.body == track[-10:]
+    assert invalid.code == 416
+    assert len(origin.requests) == 1
+
+
+def test_range_before_cached(cache, origin, fetch, wait_for):
+    (partial,) = fetch(cache, (key, {"Range": "bytes=10-19"}))
+    assert partial.code == 206
+    assert partial.body == track[10:20]
+    assert ("/1234.flac", "bytes=10-19") in origin.requests
+
+    # The whole track is cached in the meantime
+    wait_for(lambda: cache.get_file(key))
+    assert open(cache.get_file(key), "rb").read() == track
+
+
+def test_range_after_download(cache, origin, mocker, fetch):
+    fetch(cache, (key, {}))
+    path = cache.get_file(key)
+    assert key not in cache._urls
+
+    # The seek was accepted while the file was still being downloaded
+    mocker.patch.object(cache, "get_file", side_effect=[None, path])
+    mocker.patch.object(cache, "get_fill")
+    (partial,) = fetch(cache, (key, {"Range": "bytes=10-19"}))
+    assert partial.code == 206
+    assert partial.body == track[10:20]
+    assert len(origin.requests) == 1
+
+
+def test_download_completed_before_read(cache, origin, mocker, fetch, wait_for):
+    # The origin answered before the handler could open the temporary file
+    fill = cache.get_fill(key)
+    wait_for(lambda: fill.done)
+    path = cache.get_file(key)
+    mocker.patch.object(cache, "get_file", side_effect=[None, path])
+    mocker.patch.object(cache, "get_fill", return_value=fill)
+    (response,) = fetch(cache, (key, {}))
+    assert response.code == 200
+    assert response.body == track
+
+
+def test_interrupted_download(cache, origin, fetch):
+    truncated = "5678-LOSSLESS"
+    cache.register(truncated, origin.url + "/truncated.flac")
+    # The client sees the connection drop rather than a complete response
+    with pytest.raises(HTTPClientError):
+        fetch(cache, (truncated, {}))
+    assert cache.get_file(truncated) is None
+    # The download can be retried
+    assert truncated in cache._urls
+
+
+def test_unknown_track(cache, fetch):
+    unknown, invalid = fetch(cache, ("9999-LOSSLESS", {}), ("../../etc/passwd", {}))
+    assert unknown.code == invalid.code == 404
+
+
+def test_eviction(cache, tmp_path, fetch):
+    cache._max_size = 2 * len(track) + 1
+    cache_dir = tmp_path / "audio_files"
+    for i, name in enumerate(("1-LOSSLESS.flac", "2-LOSSLESS.flac")):
+        path = cache_dir / name
+        path.write_bytes(track)
+        os.utime(path, (i, i))
+
+    fetch(cache, (key, {}))
+    assert sorted(os.listdir(cache_dir)) == ["1234-LOSSLESS.flac", "2-LOSSLESS.flac"]
+
+
+@pytest.mark.parametrize(
+    "http_config, url",
+    [
+        ({"hostname": "::", "port": 6680}, "http://127.0.0.1:6680/tidal/audio/1-LOW"),
+        ({"hostname": "::1", "port": 6680}, "http://[::1]:6680/tidal/audio/1-LOW"),
+        ({"enabled": False, "hostname": "::", "port": 6680}, None),
+        (None, None),
+    ],
+)
+def test_local_url(http_config, url):
+    assert audio_proxy.get_local_url({"http": http_config}, "1-LOW") == url
+
+
+def test_factory_disabled(config):
+    assert audio_proxy.factory(config, None) == []
@@ -3,6 +3,7 @@ from pathlib import Path
 
 import pytest
 
+from mopidy_tidal import audio_proxy, image_proxy
 from mopidy_tidal.backend import TidalBackend
 from mopidy_tidal.context import set_config
 from mopidy_tidal.library import TidalLibraryProvider
@@ -240,3 +241,66 @@ def test_loads_session(get_backend, mocker, config):
     session.login_oauth_simple.assert_not_called()
     session.load_oauth_session.assert_called_once_with(**args)
     session_factory.assert_called_once()
+
+
+@pytest.mark.gt_3_7
+def test_background_refresh_jobs(get_backend, mocker, config):
+    config["tidal"]["background_refresh_secs"] = 600
+    config["tidal"]["catalog_cache_ttl_secs"] = 3600
+    backend, _, _, _, session = get_backend(config=config)
+    session.check_login.return_value = True
+    start = mocker.patch.object(backend.scheduler, "start")
+    backend.on_start()
+    start.assert_called_once_with()
+    assert set(backend.scheduler.runs) == {
+        "favorite_artists",
+        "favorite_albums",
+        "favorite_tracks",
+        "playlists",
+        "mixes",
+        "moods",
+        "genres",
+    }
+    # Catalogs are refreshed before their TTL expires
+    assert backend.scheduler._jobs["playlists"][1] == 600
+    assert backend.scheduler._jobs["moods"][1] == 2880
+
+
+@pytest.mark.gt_3_7
+def test_stop_waits_for_jobs_with_timeout(get_backend, mocker):
+    backend, *_ = get_backend()
+    stop = mocker.patch.object(backend.scheduler, "stop")
+    backend.on_stop()
+    stop.assert_called_once_with(timeout=5)
+
+
+@pytest.mark.gt_3_7
+def test_background_refresh_skipped_before_login(get_backend, mocker, config):
+    config["tidal"]["lazy"] = True
+    config["tidal"]["background_refresh_secs"] = 600
+    backend, *_ = get_backend(config=config)
+    mocker.patch.object(backend.scheduler, "start")
+    sync = mocker.patch.object(backend.playlists, "sync")
+    backend.on_start()
+    backend.scheduler._jobs["playlists"][0]()
+    sync.assert_not_called()
+    backend._logged_in = True
+    backend.scheduler._jobs["playlists"][0]()
+    sync.assert_called_once_with()
+
+
+@pytest.mark.gt_3_7
+def test_stop_closes_proxies(get_backend, mocker, config):
+    backend, *_ = get_backend()
+    mocker.patch.object(image_proxy, "_store", None)
+    mocker.patch.object(audio_proxy, "_cache", None)
+    config["tidal"].update({"image_proxy": True, "audio_proxy": True})
+    store = image_proxy.factory(config, None)[0][2]["store"]
+    cache = audio_proxy.factory(config, None)[0][2]["cache"]
+    close_store = mocker.spy(store, "close")
+    close_cache = mocker.spy(cache, "close")
+    backend.on_stop()
+    close_store.assert_called_once_with()
+    close_cache.assert_called_once_with()
+    assert image_proxy._store is None
+    assert audio_proxy._cache is None
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+from mopidy.models import Playlist, Track
+
+from mopidy_tidal.caches import CacheRegistry
+from mopidy_tidal.lanes import Lanes
+from mopidy_tidal.library import TidalLibraryProvider
+from mopidy_tidal.playlists import PlaylistMetadata, TidalPlaylistsProvider
+
+
+@pytest.fixture
+def providers(config, mocker):
+    backend = mocker.Mock(caches=CacheRegistry(persist=False), lanes=Lanes())
+    backend._config = config
+    library = TidalLibraryProvider(backend=backend)
+    playlists = TidalPlaylistsProvider(backend=backend)
+    yield backend, library, playlists
+    backend.lanes.close()
+
+
+def test_playlists_shared(providers):
+    backend, library, playlists = providers
+    assert library._playlist_cache is playlists._playlists
+    assert playlists._playlists_metadata is backend.caches.playlist_metadata
+
+
+def test_saved_playlist_not_stale_in_library(providers, mocker):
+    backend, library, playlists = providers
+    uri = "tidal:playlist:101"
+    tracks = [Track(uri=f"tidal:track:{i}", name=f"Track-{i}") for i in range(3)]
+    backend.caches.playlists[uri] = Playlist(
+        uri=uri, name="Playlist", tracks=tracks, last_modified=10
+    )
+    assert library.lookup(uri) == tracks
+
+    playlists._current_tidal_playlists = [mocker.Mock(id="101", last_updated=10)]
+    playlists._synced_at = time.monotonic()
+    backend.session.playlist.return_value.last_updated = 20
+    playlists.save(Playlist(uri=uri, name="Playlist", tracks=tracks[:2]))
+
+    assert library.lookup(uri) == tracks[:2]
+    assert backend.session.request.request.call_args.args == (
+        "DELETE",
+        "playlists/101/items/2",
+    )
+
+
+def test_deleted_playlist_invalidated(providers):
+    backend, library, playlists = providers
+    uri = "tidal:playlist:101"
+    backend.caches.playlists[uri] = Playlist(uri=uri, name="Playlist")
+    backend.caches.playlist_metadata[uri] = PlaylistMetadata(uri, "Playlist", 0, 10)
+    playlists.delete(uri)
+    assert uri not in backend.caches.playlists
+    assert uri not in backend.caches.playlist_metadata
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from mopidy_tidal.diff import diff
+
+
+def apply(old, removed, inserted):
+    removed = set(removed)
+    result = [item for i, item in enumerate(old) if i not in removed]
+    for index, item in inserted:
+        result.insert(index, item)
+    return result
+
+
+@pytest.mark.parametrize(
+    "old, new, removed, inserted",
+    [
+        ("", "", [], []),
+        ("abc", "abc", [], []),
+        ("abc", "", [0, 1, 2], []),
+        ("", "ab", [], [(0, "a"), (1, "b")]),
+        ("abcd", "acd", [1], []),
+        ("abc", "abxc", [], [(2, "x")]),
+        ("abcabba", "cbabac", [0, 1, 5], [(1, "b"), (5, "c")]),
+    ],
+)
+def test_diff(old, new, removed, inserted):
+    assert diff(list(old), list(new)) == (removed, inserted)
+
+
+def test_diff_random():
+    rng = random.Random(42)
+    for _ in range(500):
+        old = [rng.randint(0, 5) for _ in range(rng.randint(0, 20))]
+        new = [rng.randint(0, 5) for _ in range(rng.randint(0, 20))]
+        assert apply(old, *diff(old, new)) == new
+
+
+def test_diff_large():
+    old = list(range(5000))
+    new = [i for i in old if i % 10]
+    for i in range(100):
+        new.insert(i * 40, -i - 1)
+
+    removed, inserted = diff(old, new)
+    assert len(removed) == 500
+    assert len(inserted) == 100
+    assert apply(old, removed, inserted) == new
+
+
+def test_diff_max_edits():
+    # Past the edit limit, the tracks left after a bulk cleanup are kept
+    rng = random.Random(42)
+    old = list(range(5000))
+    dropped = set(rng.sample(old, 1250))
+    new = [i for i in old if i not in dropped]
+    removed, inserted = diff(old, new, max_edits=100)
+    assert removed == sorted(dropped)
+    assert inserted == []
+
+    old = list(range(1000))
+    new = old[::-1]
+    removed, inserted = diff(old, new, max_edits=100)
+    assert len(removed) == len(inserted) == 999
+    assert apply(old, removed, inserted) == new
+
+
+def test_diff_max_edits_random():
+    rng = random.Random(42)
+    for _ in range(500):
+        old = [rng.randint(0, 5) for _ in range(rng.randint(0, 20))]
+        new = [rng.randint(0, 5) for _ in range(rng.randint(0, 20))]
+        removed, inserted = diff(old, new, max_edits=2)
+        assert apply(old, removed, inserted) == new
+        assert len(removed) + len(inserted) <= len(old) + len(new)
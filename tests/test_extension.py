@@ -2,7 +2,7 @@ from __future__ import unicode_literals
 
 import pytest
 
-from mopidy_tidal import Extension
+from mopidy_tidal import Extension, web
 from mopidy_tidal.backend import TidalBackend
 
 
@@ -25,6 +25,22 @@ def test_get_config_schema():
     assert "client_id" in schema
     assert "client_secret" in schema
     assert "lazy" in schema
+    assert "browse_timeout_secs" in schema
+    assert "lookup_timeout_secs" in schema
+    assert "search_timeout_secs" in schema
+    assert "images_timeout_secs" in schema
+    assert "async_engine" in schema
+    assert "image_proxy" in schema
+    assert "image_proxy_thumbnails" in schema
+    assert "catalog_cache_ttl_secs" in schema
+    assert "artist_ep_singles" in schema
+    assert "background_refresh_secs" in schema
+    assert "prefetch_tracks" in schema
+    assert "prefetch_metadata" in schema
+    assert "audio_proxy" in schema
+    assert "audio_cache_size_mb" in schema
+    assert "adaptive_quality" in schema
+    assert "min_quality" in schema
 
 
 @pytest.mark.gt_3_7
@@ -32,7 +48,11 @@ def test_setup(mocker):
     ext = Extension()
     registry = mocker.Mock()
     ext.setup(registry)
-    registry.add.assert_called_once()
+    assert registry.add.call_count == 2
     args = registry.add.mock_calls[0].args
     assert args[0] == "backend"
     assert type(args[1]) is type(TidalBackend)
+    args = registry.add.mock_calls[1].args
+    assert args[0] == "http:app"
+    assert args[1]["name"] == "tidal"
+    assert args[1]["factory"] is web.factory
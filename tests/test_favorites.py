@@ -0,0 +1,154 @@
+import pytest
+import tidalapi
+from mopidy.models import Ref
+from requests.exceptions import HTTPError
+from tidalapi.user import Favorites
+
+from mopidy_tidal.favorites import FavoritesSnapshots
+
+
+def track_ref(i):
+    return Ref.track(uri=f"tidal:track:0:0:{i}", name=f"Track-{i}")
+
+
+@pytest.fixture
+def favorite_tracks(mocker):
+    """Favorite tracks of the user, the most recently added first."""
+    tracks = []
+    for i in range(120):
+        track = mocker.Mock(id=i)
+        track.name = f"Track-{i}"
+        track.artist.id = 0
+        track.album.id = 0
+        tracks.insert(0, track)
+    return tracks
+
+
+@pytest.fixture
+def snapshots(mocker, config, favorite_tracks, favorites_api):
+    session = mocker.Mock()
+    session.user.id = 1
+    favorites = session.user.favorites
+    favorites_api(favorites, favorite_tracks)
+    snapshots = FavoritesSnapshots(session_getter=lambda: session, head_size=10)
+    yield snapshots, favorites
+    snapshots.close()
+
+
+def test_full_sync(snapshots):
+    snapshots, favorites = snapshots
+    refs = snapshots.get("tracks")
+    assert refs == [track_ref(i) for i in reversed(range(120))]
+    assert snapshots.full_syncs == 1
+
+
+def test_served_from_snapshot(snapshots, mocker):
+    snapshots, favorites = snapshots
+    refresh = mocker.patch.object(snapshots, "_refresh_in_background")
+    refs = snapshots.refresh("tracks")
+    favorites.requests.map_request.reset_mock()
+    assert snapshots.get("tracks") == refs
+    favorites.requests.map_request.assert_not_called()
+    refresh.assert_called_once_with("tracks")
+
+
+def test_snapshot_persisted(snapshots, mocker):
+    snapshots, favorites = snapshots
+    refs = snapshots.refresh("tracks")
+    other = FavoritesSnapshots(session_getter=snapshots._session_getter)
+    mocker.patch.object(other, "_refresh_in_background")
+    assert other.get("tracks") == refs
+    assert other.full_syncs == 0
+
+
+def test_unchanged(snapshots):
+    snapshots, favorites = snapshots
+    snapshots.refresh("tracks")
+    favorites.requests.map_request.reset_mock()
+    snapshots.refresh("tracks")
+    # Only the head page is checked
+    favorites.requests.map_request.assert_called_once()
+    assert snapshots.full_syncs == 1
+
+
+def test_incremental_update(snapshots, favorite_tracks, mocker):
+    snapshots, favorites = snapshots
+    snapshots.refresh("tracks")
+    for i in range(120, 135):
+        track = mocker.Mock(id=i)
+        track.name = f"Track-{i}"
+        track.artist.id = 0
+        track.album.id = 0
+        favorite_tracks.insert(0, track)
+
+    favorites.requests.map_request.reset_mock()
+    assert snapshots.refresh("tracks") == [track_ref(i) for i in reversed(range(135))]
+    # 15 new tracks and 10 known ones
+    assert favorites.requests.map_request.call_count == 3
+    assert snapshots.full_syncs == 1
+
+
+def test_removal_resyncs(snapshots, favorite_tracks):
+    snapshots, favorites = snapshots
+    snapshots.refresh("tracks")
+    del favorite_tracks[50]
+    refs = snapshots.refresh("tracks")
+    assert len(refs) == 119
+    assert track_ref(69) not in refs
+    assert snapshots.full_syncs == 2
+
+
+def test_reordering_resyncs(snapshots, favorite_tracks):
+    snapshots, favorites = snapshots
+    snapshots.refresh("tracks")
+    favorite_tracks.insert(0, favorite_tracks.pop(60))
+    refs = snapshots.refresh("tracks")
+    assert refs[0] == track_ref(59)
+    assert snapshots.full_syncs == 2
+
+
+def test_background_refresh_error(snapshots):
+    snapshots, favorites = snapshots
+    refs = snapshots.refresh("tracks")
+    favorites.requests.request.side_effect = HTTPError
+    snapshots._refresh_quietly("tracks")
+    assert snapshots.get("tracks") == refs
+
+
+def test_tidalapi_favorites(config, mocker):
+    # The favorites of tidalapi 0.7.0 can't be ordered nor counted: the API
+    # is asked directly, and only the new ones are fetched
+    artists = [{"id": i, "name": f"Artist-{i}"} for i in reversed(range(30))]
+    requests = []
+
+    def request(method, url, params, **_):
+        requests.append(params)
+        assert url == "https://api.tidal.com/v1/users/1/favorites/artists"
+        page = artists[params.get("offset", 0) :][: params["limit"]]
+        body = {"items": page, "totalNumberOfItems": len(artists)}
+        return mocker.Mock(ok=True, content=b"{}", json=lambda: body)
+
+    session = tidalapi.Session()
+    session.request_session = mocker.Mock(request=request)
+    session.user = mocker.Mock(id=1, favorites=Favorites(session, 1))
+    snapshots = FavoritesSnapshots(session_getter=lambda: session, head_size=10)
+    refs = snapshots.refresh("artists")
+    assert refs[0] == Ref.artist(uri="tidal:artist:29", name="Artist-29")
+    assert len(refs) == 30
+    assert requests[0]["limit"] == 1
+    assert all(
+        (p["order"], p["orderDirection"]) == ("DATE", "DESC") for p in requests[1:]
+    )
+
+    artists.insert(0, {"id": 30, "name": "Artist-30"})
+    requests.clear()
+    refs = snapshots.refresh("artists")
+    assert refs[:2] == [
+        Ref.artist(uri="tidal:artist:30", name="Artist-30"),
+        Ref.artist(uri="tidal:artist:29", name="Artist-29"),
+    ]
+    assert len(refs) == 31
+    # The count, then the head page of the new artist and 10 known ones
+    assert [p["limit"] for p in requests] == [1, 10, 10]
+    assert snapshots.full_syncs == 1
+    snapshots.close()
@@ -3,6 +3,10 @@ import pytest
 from mopidy_tidal.library import HTTPError, Image, ImagesGetter
 
 
+def sized_images(uri, sizes=(1280, 640, 320, 160, 80)):
+    return [Image(height=size, uri=uri, width=size) for size in sizes]
+
+
 @pytest.fixture
 def images_getter(mocker, config):
     session = mocker.Mock()
@@ -10,30 +14,42 @@ def images_getter(mocker, config):
     return getter, session
 
 
-@pytest.mark.parametrize("dimensions", (750, 640, 480))
+@pytest.mark.parametrize("dimensions", (1280, 640, 80))
 def test_get_album_image_new_api(images_getter, mocker, dimensions):
     ig, session = images_getter
     uri = "tidal:album:1-1-1"
     get_album = mocker.Mock()
 
-    get_uri_args = None
+    get_uri_args = []
 
     def get_uri(dim, *args):
-        nonlocal get_uri_args
-        get_uri_args = [dim] + list(args)
+        get_uri_args.append(dim)
         if dim != dimensions:
             raise ValueError()
         return uri
 
     get_album.image = get_uri
     session.album.return_value = get_album
+    assert ig(uri) == (uri, sized_images(uri, (dimensions,)))
+    assert get_uri_args == [1280, 640, 320, 160, 80]
+
+
+def test_get_album_image_from_cover(images_getter, mocker):
+    ig, session = images_getter
+    uri = "tidal:album:1-1-1"
+    session.album.return_value = mocker.Mock(cover="aaaa-bbbb")
     assert ig(uri) == (
         uri,
         [
-            Image(height=320, uri=uri, width=320)
-        ],  # Why can we just set the dimensions like that?
+            Image(
+                height=size,
+                uri=f"https://resources.tidal.com/images/aaaa/bbbb/{size}x{size}.jpg",
+                width=size,
+            )
+            for size in (1280, 640, 320, 160, 80)
+        ],
     )
-    assert get_uri_args == [dimensions]
+    session.album.return_value.image.assert_not_called()
 
 
 def test_get_album_no_image_new_api(images_getter, mocker):
@@ -65,13 +81,25 @@ def test_get_track_image(images_getter, mocker):
     session.album.return_value = get_album
     assert ig(uri) == (
         uri,
-        [
-            Image(height=320, uri="tidal:album:1-1-1", width=320)
-        ],  # Why can we just set the dimensions like that?
+        sized_images("tidal:album:1-1-1"),
     )
     session.album.assert_called_once_with("1-1-1")
 
 
+def test_get_short_track_image(images_getter, mocker):
+    ig, session = images_getter
+    ig._track_cache = mocker.Mock(**{"get_album_id.return_value": "1-1-1"})
+    get_album = mocker.Mock()
+    get_album.image.return_value = "tidal:album:1-1-1"
+    session.album.return_value = get_album
+    assert ig("tidal:track:2-2-2") == (
+        "tidal:track:2-2-2",
+        sized_images("tidal:album:1-1-1"),
+    )
+    session.album.assert_called_once_with("1-1-1")
+    session.track.assert_not_called()
+
+
 def test_get_artist_image(images_getter, mocker):
     ig, session = images_getter
     uri = "tidal:artist:2-2-2"
@@ -80,9 +108,7 @@ def test_get_artist_image(images_getter, mocker):
     session.artist.return_value = get_artist
     assert ig(uri) == (
         uri,
-        [
-            Image(height=320, uri=uri, width=320)
-        ],  # Why can we just set the dimensions like that?
+        sized_images(uri, (750, 480, 320, 160)),
     )
 
 
@@ -130,9 +156,7 @@ def test_image_getter_cache(images_getter, mocker):
     resp = ig(uri)
     assert resp == (
         uri,
-        [
-            Image(height=320, uri="tidal:album:1-1-1", width=320)
-        ],  # Why can we just set the dimensions like that?
+        sized_images("tidal:album:1-1-1"),
     )
     ig.cache_update({"tidal:album:1-1-1": resp[1]})
     assert ig(uri) == resp
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+from time import sleep
+
+import pytest
+import tornado.web
+from mopidy.models import Image
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from mopidy_tidal import image_proxy
+from mopidy_tidal.image_proxy import ImageNotFound, ImageStore
+
+image_path = "aaaa/bbbb/640x640.jpg"
+
+
+class FakeOriginHandler(BaseHTTPRequestHandler):
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        sleep(server.latency)
+        if self.path.startswith("/images/ffff/"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = f"image:{self.path}".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def origin_handler():
+    return FakeOriginHandler
+
+
+@pytest.fixture
+def store(origin, tmp_path):
+    store = ImageStore(
+        str(tmp_path / "image_files"),
+        origin=origin.url + "/images/",
+    )
+    yield store
+    store.close()
+
+
+def test_local_image():
+    image = Image(
+        uri="https://resources.tidal.com/images/aaaa/bbbb/640x640.jpg",
+        width=640,
+        height=640,
+    )
+    assert image_proxy.local_image(image) == Image(
+        uri="/tidal/images/aaaa/bbbb/640x640.jpg", width=640, height=640
+    )
+    other = Image(uri="https://example.com/image.jpg")
+    assert image_proxy.local_image(other) == other
+
+
+def test_store_caches_on_disk(store, origin, tmp_path):
+    assert store.get(image_path) == b"image:/images/" + image_path.encode()
+    assert store.get(image_path) == b"image:/images/" + image_path.encode()
+    assert origin.requests == ["/images/" + image_path]
+    assert os.path.isfile(tmp_path / "image_files" / "aaaa" / "bbbb" / "640x640.jpg")
+
+    # A new store is served from the same disk cache
+    new_store = ImageStore(str(tmp_path / "image_files"), origin="http://invalid/")
+    assert new_store.get(image_path) == store.get(image_path)
+    assert new_store.fetches == 0
+
+
+def test_store_single_flight(store, origin):
+    origin.latency = 0.2
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(store.get(image_path)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(results) == 8
+    assert len(set(results)) == 1
+    assert origin.requests == ["/images/" + image_path]
+
+
+@pytest.mark.parametrize(
+    "path", ("../../etc/passwd", "aaaa/bbbb/640x640.png", "ffff/0000/80x80.jpg")
+)
+def test_store_not_found(store, origin, path):
+    with pytest.raises(ImageNotFound):
+        store.get(path)
+
+
+def test_store_thumbnails(store, origin, wait_for):
+    store._thumbnails = True
+    store.get(image_path)
+    wait_for(lambda: len(origin.requests) == 3)
+
+    assert sorted(origin.requests) == [
+        "/images/aaaa/bbbb/160x160.jpg",
+        "/images/aaaa/bbbb/320x320.jpg",
+        "/images/aaaa/bbbb/640x640.jpg",
+    ]
+
+
+def test_factory_disabled(config):
+    assert image_proxy.factory(config, None) == []
+
+
+def test_handler(store, origin):
+    async def fetch_all():
+        sock, port = bind_unused_port()
+        app = tornado.web.Application(
+            [(r"/tidal/images/(.+)", image_proxy.ImageHandler, {"store": store})]
+        )
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        client = AsyncHTTPClient()
+        try:
+            return [
+                await client.fetch(
+                    f"http://127.0.0.1:{port}/tidal/images/{path}", raise_error=False
+                )
+                for path in (image_path, image_path, "ffff/0000/80x80.jpg")
+            ]
+        finally:
+            server.stop()
+
+    ok, cached, missing = asyncio.run(fetch_all())
+    assert ok.code == cached.code == 200
+    assert ok.body == cached.body == b"image:/images/" + image_path.encode()
+    assert ok.headers["Content-Type"] == "image/jpeg"
+    assert "immutable" in ok.headers["Cache-Control"]
+    assert missing.code == 404
+    assert origin.requests.count("/images/" + image_path) == 1
@@ -0,0 +1,117 @@
+import os
+from threading import Event, Thread
+
+import pytest
+
+from mopidy_tidal import full_models_mappers, images
+from mopidy_tidal.images import ImagesService
+from mopidy_tidal.library import Image
+
+
+def cover_images(image_id, sizes=(1280, 640, 320, 160, 80)):
+    path = image_id.replace("-", "/")
+    return [
+        Image(
+            uri=f"https://resources.tidal.com/images/{path}/{size}x{size}.jpg",
+            width=size,
+            height=size,
+        )
+        for size in sizes
+    ]
+
+
+@pytest.fixture
+def images_service(mocker, config):
+    session = mocker.Mock()
+    session.album.return_value = mocker.Mock(cover="aaaa-bbbb")
+    service = ImagesService(session_getter=lambda: session)
+    yield service, session
+    service.close()
+
+
+def test_album_dedup(images_service):
+    service, session = images_service
+    uris = [f"tidal:track:0:1:{i}" for i in range(100)] + ["tidal:album:1"]
+    images = service.get_images(uris)
+    assert images == {uri: cover_images("aaaa-bbbb") for uri in uris}
+    session.album.assert_called_once_with("1")
+
+    # The next request is served from memory
+    assert service.get_images(uris[:1]) == {uris[0]: images[uris[0]]}
+    session.album.assert_called_once_with("1")
+
+
+def test_in_flight_dedup(images_service):
+    service, session = images_service
+    started, released = Event(), Event()
+    album = session.album.return_value
+
+    def get_album(album_id):
+        started.set()
+        released.wait(2)
+        return album
+
+    session.album.side_effect = get_album
+    results = []
+    first = Thread(target=lambda: results.append(service.get_images(["tidal:album:1"])))
+    first.start()
+    started.wait(2)
+    second = Thread(
+        target=lambda: results.append(service.get_images(["tidal:track:0:1:2"]))
+    )
+    second.start()
+    released.set()
+    first.join(2)
+    second.join(2)
+
+    assert len(results) == 2
+    assert all(next(iter(res.values())) == cover_images("aaaa-bbbb") for res in results)
+    session.album.assert_called_once_with("1")
+
+
+def test_batch_persistence(images_service, mocker):
+    service, session = images_service
+    session.artist.return_value.picture = "cccc-dddd"
+    update = mocker.spy(service._image_cache, "update")
+    service.get_images(["tidal:album:1", "tidal:album:2", "tidal:artist:3"])
+    update.assert_called_once()
+    assert set(update.call_args.args[0]) == {
+        "tidal:album:1",
+        "tidal:album:2",
+        "tidal:artist:3",
+    }
+    assert os.path.isfile(service._image_cache._cache_filename("tidal:album:2"))
+
+
+def test_errors_not_cached(images_service):
+    service, session = images_service
+    session.album.side_effect = OSError("unreachable")
+    assert service.get_images(["tidal:album:1"]) == {"tidal:album:1": []}
+    session.album.side_effect = None
+    assert service.get_images(["tidal:album:1"]) == {
+        "tidal:album:1": cover_images("aaaa-bbbb")
+    }
+    assert session.album.call_count == 2
+
+
+@pytest.fixture
+def image_ids():
+    images.image_ids.clear()
+    yield images.image_ids
+    images.image_ids.clear()
+
+
+def test_image_url_from_mapped_items(images_service, image_ids, tidal_tracks):
+    service, session = images_service
+    tidal_tracks[0].album.cover = "eeee-ffff"
+    tidal_tracks[0].artist.picture = "cccc-dddd"
+    full_models_mappers.create_mopidy_tracks(tidal_tracks[:1])
+    avoided_calls = image_ids.avoided_calls
+
+    assert service.get_images(["tidal:track:0:0:0", "tidal:artist:0"]) == {
+        "tidal:track:0:0:0": cover_images("eeee-ffff"),
+        "tidal:artist:0": cover_images("cccc-dddd", (750, 480, 320, 160)),
+    }
+    session.album.assert_not_called()
+    session.artist.assert_not_called()
+    assert image_ids.avoided_calls == avoided_calls + 2
@@ -0,0 +1,53 @@
+from threading import Event
+
+import pytest
+
+from mopidy_tidal import lanes
+from mopidy_tidal.lanes import Lanes
+
+
+@pytest.fixture
+def provider_lanes():
+    provider_lanes = Lanes()
+    yield provider_lanes
+    provider_lanes.close()
+
+
+def test_submit(provider_lanes):
+    future = provider_lanes.submit(lanes.PREFETCH, lambda x, y=0: x + y, 1, y=2)
+    assert future.result(2) == 3
+    assert provider_lanes.stats[lanes.PREFETCH].tasks == 1
+
+
+def test_prefetch_not_blocked_by_bulk(provider_lanes):
+    released = Event()
+    bulk = provider_lanes.submit(lanes.BULK, released.wait, 2)
+    queued = provider_lanes.submit(lanes.BULK, lambda: "queued")
+
+    # Bulk work in progress and queued doesn't delay prefetching
+    assert provider_lanes.submit(lanes.PREFETCH, lambda: "url").result(2) == "url"
+    assert not bulk.done() and not queued.done()
+    released.set()
+    assert queued.result(2) == "queued"
+
+
+def test_queue_wait_measured(provider_lanes):
+    released = Event()
+    provider_lanes.submit(lanes.BULK, released.wait, 2)
+    queued = provider_lanes.submit(lanes.BULK, lambda: None)
+    released.wait(0.05)
+    released.set()
+    queued.result(2)
+
+    stats = provider_lanes.stats[lanes.BULK]
+    assert stats.tasks == 2
+    assert stats.max_wait >= 0.05
+    assert stats.mean_wait == pytest.approx(stats.total_wait / 2)
+
+
+def test_errors_propagated(provider_lanes):
+    def fail():
+        raise OSError("unreachable")
+
+    with pytest.raises(OSError):
+        provider_lanes.submit(lanes.PREFETCH, fail).result(2)
@@ -1,16 +1,24 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
 import pytest
 from mopidy.models import Album, Artist, Image, Ref, SearchResult, Track
-from tidalapi.playlist import Playlist
+from tidalapi.album import Album as TidalAlbum
+from tidalapi.media import Track as TidalTrack
 
+from mopidy_tidal.caches import CacheRegistry
 from mopidy_tidal.library import HTTPError, TidalLibraryProvider
 
 
 @pytest.fixture
 def tlp(mocker, config):
-    backend = mocker.Mock()
+    backend = mocker.Mock(caches=CacheRegistry(persist=False))
     lp = TidalLibraryProvider(backend)
-    for cache_type in {"artist", "album", "track", "playlist"}:
+    for cache_type in {"artist", "album", "track"}:
         getattr(lp, f"_{cache_type}_cache")._persist = False
+    lp._album_tracks_index._persist = False
+    lp.favorites._snapshots._persist = False
 
     return lp, backend
 
@@ -32,7 +40,9 @@ def test_search(mocker, tlp):
     assert tlp.search(query=query, exact=exact) == SearchResult(
         artists=artists, albums=albums, tracks=tracks
     )
-    tidal_search.assert_called_once_with(backend.session, query=query, exact=exact)
+    tidal_search.assert_called_once_with(
+        backend.session, query=query, exact=exact, album_index=tlp._album_tracks_index
+    )
 
 
 def test_get_track_images(tlp, mocker):
@@ -42,21 +52,27 @@ def test_get_track_images(tlp, mocker):
     get_album.image.return_value = "tidal:album:1-1-1"
     backend.session.album.return_value = get_album
     assert tlp.get_images(uris) == {
-        uris[0]: [Image(height=320, uri="tidal:album:1-1-1", width=320)]
+        uris[0]: [
+            Image(height=size, uri="tidal:album:1-1-1", width=size)
+            for size in (1280, 640, 320, 160, 80)
+        ]
     }
     backend.session.album.assert_called_once_with("1-1-1")
 
 
-@pytest.mark.xfail
 def test_track_cache(tlp, mocker):
-    # I think the caching logic is broken here
     tlp, backend = tlp
     uris = ["tidal:track:0-0-0:1-1-1:2-2-2"]
     get_album = mocker.Mock()
     get_album.image.return_value = "tidal:album:1-1-1"
     backend.session.album.return_value = get_album
     first = tlp.get_images(uris)
-    assert first == {uris[0]: [Image(height=320, uri="tidal:album:1-1-1", width=320)]}
+    assert first == {
+        uris[0]: [
+            Image(height=size, uri="tidal:album:1-1-1", width=size)
+            for size in (1280, 640, 320, 160, 80)
+        ]
+    }
     assert tlp.get_images(uris) == first
     backend.session.album.assert_called_once_with("1-1-1")
 
@@ -175,33 +191,30 @@ def test_browse_root(tlp):
     ]
 
 
-def test_browse_artists(tlp, mocker, tidal_artists):
+def test_browse_artists(tlp, mocker, tidal_artists, favorites_api):
     tlp, backend = tlp
     session = backend.session
-    session.user.favorites.artists = tidal_artists
-    mocker.patch("mopidy_tidal.library.get_items", lambda x: x)
+    favorites_api(session.user.favorites, tidal_artists)
     assert tlp.browse("tidal:my_artists") == [
         Ref(name="Artist-0", type="artist", uri="tidal:artist:0"),
         Ref(name="Artist-1", type="artist", uri="tidal:artist:1"),
     ]
 
 
-def test_browse_albums(tlp, mocker, tidal_albums):
+def test_browse_albums(tlp, mocker, tidal_albums, favorites_api):
     tlp, backend = tlp
     session = backend.session
-    session.user.favorites.albums = tidal_albums
-    mocker.patch("mopidy_tidal.library.get_items", lambda x: x)
+    favorites_api(session.user.favorites, tidal_albums)
     assert tlp.browse("tidal:my_albums") == [
         Ref(name="Album-0", type="album", uri="tidal:album:0"),
         Ref(name="Album-1", type="album", uri="tidal:album:1"),
     ]
 
 
-def test_browse_tracks(tlp, mocker, tidal_tracks):
+def test_browse_tracks(tlp, mocker, tidal_tracks, favorites_api):
     tlp, backend = tlp
     session = backend.session
-    session.user.favorites.tracks = tidal_tracks
-    mocker.patch("mopidy_tidal.library.get_items", lambda x: x)
+    favorites_api(session.user.favorites, tidal_tracks)
     assert tlp.browse("tidal:my_tracks") == [
         Ref(name="Track-0", type="track", uri="tidal:track:0:0:0"),
         Ref(name="Track-1", type="track", uri="tidal:track:1:1:1"),
@@ -256,9 +269,10 @@ def test_genres_new_api(tlp, mocker):
             "genre.get_genres",
         )
     )
-    genre = mocker.Mock(spec=("name", "path"))
+    genre = mocker.Mock(spec=("name", "path", "playlists"))
     genre.name = "Genre-1"
     genre.path = "1"
+    genre.playlists = True
     session.genre.get_genres.return_value = [genre]
     assert tlp.browse("tidal:genres") == [
         Ref(name="Genre-1", type="directory", uri="tidal:genre:1")
@@ -310,7 +324,7 @@ def test_specific_playlist_new_api(tlp, mocker, tidal_tracks):
 def test_specific_mood_new_api(tlp, mocker):
     tlp, backend = tlp
     session = backend.session
-    session.mock_add_spec(("moods",))
+    session.mock_add_spec(("moods", "page", "page.get"))
     playlist = mocker.Mock()
     playlist.id = 0
     playlist.name = "Playlist-0"
@@ -318,16 +332,16 @@ def test_specific_mood_new_api(tlp, mocker):
     mood.id = 1
     mood.name = "Mood-1"
     mood.api_path = "something/somethingelse/1"
-    mood.get.return_value = [playlist]
     mood_2 = mocker.Mock()
     mood_2.api_path = "0/0/0"
     session.moods.return_value = [mood, mood_2]
+    session.page.get.return_value = [playlist]
     assert tlp.browse("tidal:mood:1") == [
         Ref(name="Playlist-0", type="playlist", uri="tidal:playlist:0"),
     ]
 
     session.moods.assert_called_once_with()
-    mood.get.assert_called_once_with()
+    session.page.get.assert_called_once_with("something/somethingelse/1")
 
 
 def test_specific_mood_new_api_none(tlp, mocker, tidal_tracks):
@@ -343,7 +357,15 @@ def test_specific_mood_new_api_none(tlp, mocker, tidal_tracks):
 def test_specific_genre_new_api(tlp, mocker):
     tlp, backend = tlp
     session = backend.session
-    session.mock_add_spec(("genre", "genre.get_genres"))
+    session.mock_add_spec(
+        (
+            "genre",
+            "genre.get_genres",
+            "request",
+            "request.map_request",
+            "parse_playlist",
+        )
+    )
     playlist = mocker.Mock()
     playlist.id = 0
     playlist.name = "Playlist-0"
@@ -351,15 +373,38 @@ def test_specific_genre_new_api(tlp, mocker):
     genre.id = 1
     genre.name = "Genre-1"
     genre.path = "1"
-    genre.items.return_value = [playlist]
+    genre.playlists = True
     genre_2 = mocker.Mock()
     genre_2.path = "13"
     session.genre.get_genres.return_value = [genre, genre_2]
+    session.request.map_request.return_value = [playlist]
     assert tlp.browse("tidal:genre:1") == [
         Ref(name="Playlist-0", type="playlist", uri="tidal:playlist:0"),
     ]
     session.genre.get_genres.assert_called_once_with()
-    genre.items.assert_called_once_with(Playlist)
+    session.request.map_request.assert_called_once_with(
+        "genres/1/playlists", parse=session.parse_playlist
+    )
+
+
+def test_specific_genre_without_playlists(tlp, mocker):
+    tlp, backend = tlp
+    session = backend.session
+    session.mock_add_spec(
+        (
+            "genre",
+            "genre.get_genres",
+            "request",
+            "request.map_request",
+            "parse_playlist",
+        )
+    )
+    genre = mocker.Mock()
+    genre.path = "1"
+    genre.playlists = False
+    session.genre.get_genres.return_value = [genre]
+    assert not tlp.browse("tidal:genre:1")
+    session.request.map_request.assert_not_called()
 
 
 def test_specific_genre_new_api_none(tlp, mocker, tidal_tracks):
@@ -380,23 +425,65 @@ def test_specific_mix(tlp, mocker, tidal_tracks):
     playlist.id = "1"
     playlist.name = "Playlist-1"
     playlist.items.return_value = tidal_tracks
-    playlist_2 = mocker.Mock()
-    session.mixes.return_value = [playlist, playlist_2]
+    session.mix.return_value = playlist
     assert tlp.browse("tidal:mix:1") == [
         Ref(name="Track-0", type="track", uri="tidal:track:0:0:0"),
         Ref(name="Track-1", type="track", uri="tidal:track:1:1:1"),
     ]
-    session.mixes.assert_called_once_with()
+    session.mix.assert_called_once_with("1")
+    session.mixes.assert_not_called()
     playlist.items.assert_called_once_with()
 
 
 def test_specific_mix_none(tlp, mocker):
     tlp, backend = tlp
     session = backend.session
-    playlist_2 = mocker.Mock()
-    session.mixes.return_value = [playlist_2]
+    session.mix.side_effect = HTTPError
     assert not tlp.browse("tidal:mix:1")
-    session.mixes.assert_called_once_with()
+    session.mix.assert_called_once_with("1")
+
+
+@pytest.fixture
+def catalog_tlp(config, mocker):
+    config["tidal"]["catalog_cache_ttl_secs"] = 60
+    backend = mocker.Mock()
+    lp = TidalLibraryProvider(backend=backend)
+    session = backend.session
+    mood = mocker.Mock(title="Mood-1", api_path="pages/moods/1")
+    session.moods.return_value = [mood]
+    session.page.get.return_value = []
+    return lp, session
+
+
+def test_catalog_cached(catalog_tlp):
+    lp, session = catalog_tlp
+    refs = [Ref(name="Mood-1", type="directory", uri="tidal:mood:1")]
+    assert lp.browse("tidal:moods") == refs
+    assert lp.browse("tidal:moods") == refs
+
+    # Drilling into a mood only fetches the mood itself
+    assert lp.browse("tidal:mood:1") == []
+    session.moods.assert_called_once_with()
+    session.page.get.assert_called_once_with("pages/moods/1")
+
+
+def test_catalog_persisted(catalog_tlp, mocker):
+    lp, session = catalog_tlp
+    lp.browse("tidal:moods")
+    lp = TidalLibraryProvider(backend=mocker.Mock(session=session))
+    assert lp.browse("tidal:moods") == [
+        Ref(name="Mood-1", type="directory", uri="tidal:mood:1")
+    ]
+    session.moods.assert_called_once_with()
+
+
+def test_catalog_expired(catalog_tlp, mocker):
+    lp, session = catalog_tlp
+    lp.browse("tidal:moods")
+    now = time.time()
+    mocker.patch("mopidy_tidal.lru_cache.time.time", return_value=now + 61)
+    lp.browse("tidal:moods")
+    assert session.moods.call_count == 2
 
 
 def test_specific_artist_new_api(tlp, mocker, tidal_albums, tidal_artists):
@@ -413,7 +500,75 @@ def test_specific_artist_new_api(tlp, mocker, tidal_albums, tidal_artists):
     ]
     artist.get_top_tracks.assert_called_once_with()
     artist.get_albums.assert_called_once_with()
-    session.artist.assert_has_calls([mocker.call("1"), mocker.call("1")])
+    session.artist.assert_called_once_with("1")
+
+
+def test_specific_artist_concurrent(tlp, tidal_albums, tidal_artists):
+    tlp, backend = tlp
+    artist = tidal_artists[0]
+    albums_started = Event()
+
+    def get_top_tracks():
+        # Only returns if the albums are being fetched at the same time
+        assert albums_started.wait(2)
+        return []
+
+    def get_albums():
+        albums_started.set()
+        return tidal_albums
+
+    artist.get_albums.side_effect = get_albums
+    artist.get_top_tracks.side_effect = get_top_tracks
+    backend.session.artist.return_value = artist
+    assert tlp.browse("tidal:artist:1") == [
+        Ref(name="Album-0", type="album", uri="tidal:album:0"),
+        Ref(name="Album-1", type="album", uri="tidal:album:1"),
+    ]
+
+
+def test_specific_artist_ep_singles(tlp, config, tidal_albums, tidal_artists):
+    tlp, backend = tlp
+    config["tidal"]["artist_ep_singles"] = True
+    artist = tidal_artists[0]
+    artist.get_albums.return_value = tidal_albums[:1]
+    get_ep_singles = getattr(artist, "get_ep_singles", None) or (
+        artist.get_albums_ep_singles
+    )
+    get_ep_singles.return_value = tidal_albums[1:]
+    artist.get_top_tracks.return_value = []
+    backend.session.artist.return_value = artist
+    assert tlp.browse("tidal:artist:1") == [
+        Ref(name="Album-0", type="album", uri="tidal:album:0"),
+        Ref(name="Album-1", type="album", uri="tidal:album:1"),
+    ]
+    get_ep_singles.assert_called_once_with()
+
+
+def test_specific_artist_cached(config, mocker, tidal_albums, tidal_artists):
+    config["tidal"]["catalog_cache_ttl_secs"] = 60
+    backend = mocker.Mock()
+    lp = TidalLibraryProvider(backend=backend)
+    artist = tidal_artists[0]
+    artist.get_albums.return_value = tidal_albums
+    backend.session.artist.return_value = artist
+    refs = lp.browse("tidal:artist:1")
+    assert lp.browse("tidal:artist:1") == refs
+    backend.session.artist.assert_called_once_with("1")
+    artist.get_albums.assert_called_once_with()
+
+
+def test_specific_artist_error_not_cached(config, mocker, tidal_albums, tidal_artists):
+    config["tidal"]["catalog_cache_ttl_secs"] = 60
+    backend = mocker.Mock()
+    lp = TidalLibraryProvider(backend=backend)
+    artist = tidal_artists[0]
+    artist.get_albums.side_effect = HTTPError
+    backend.session.artist.return_value = artist
+    assert lp.browse("tidal:artist:1") == [
+        Ref(name="Track-100", type="track", uri="tidal:track:0:7:100"),
+    ]
+    lp.browse("tidal:artist:1")
+    assert artist.get_albums.call_count == 2
 
 
 def test_lookup_no_uris(tlp, mocker):
@@ -488,6 +643,43 @@ def test_lookup_track_cached_album(tlp, mocker, tidal_albums, compare):
     session.album.assert_called_once_with("1")
 
 
+def test_lookup_from_several_threads(tlp, mocker, tidal_albums):
+    # Prefetches look up tracks on their own threads, while the backend actor
+    # looks up others, and both write the same caches
+    tlp, backend = tlp
+    tlp._track_cache._max_size = 16
+    artist = tidal_albums[0].artist
+
+    def album(album_id):
+        tidal_album = mocker.Mock(spec=TidalAlbum, id=album_id, artist=artist)
+        tidal_album.name = f"Album-{album_id}"
+        tracks = []
+        for i in range(4):
+            track = mocker.Mock(spec=TidalTrack, id=int(album_id) * 10 + i)
+            track.configure_mock(
+                name=f"Track-{track.id}",
+                artist=artist,
+                album=tidal_album,
+                duration=100,
+                track_num=i,
+                disc_num=1,
+            )
+            tracks.append(track)
+        return mocker.Mock(**{"tracks.return_value": tracks})
+
+    backend.session.album.side_effect = album
+    uris = [f"tidal:track:1234:{a}:{a * 10 + i}" for a in range(40) for i in range(4)]
+
+    def lookup(offset):
+        return [t.uri for t in tlp.lookup(uris[offset::4])]
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lookup, range(4)))
+
+    assert [len(uris) for uris in results] == [40] * 4
+    assert sorted(sum(results, [])) == sorted(uris)
+
+
 def test_lookup_album(tlp, mocker, tidal_tracks, compare):
     tlp, backend = tlp
     session = backend.session
@@ -572,3 +764,99 @@ def test_lookup_playlist_cached(tlp, mocker, tidal_tracks, compare):
 
     session.playlist.assert_called_with("99")
     assert len(playlist.tracks.mock_calls) == 5, "Didn't run five fetches in parallel."
+
+
+def test_lookup_deadline_exceeded(tlp, mocker, tidal_tracks, config):
+    tlp, backend = tlp
+    config["tidal"]["lookup_timeout_secs"] = 0.1
+    session = backend.session
+    released = Event()
+
+    def get_artist(artist_id):
+        artist = mocker.Mock()
+        if artist_id == "2":
+            artist.get_top_tracks.side_effect = lambda: released.wait(2) and []
+        else:
+            artist.get_top_tracks.return_value = tidal_tracks
+        return artist
+
+    session.artist.side_effect = get_artist
+    try:
+        res = tlp.lookup(["tidal:artist:1", "tidal:artist:2"])
+    finally:
+        released.set()
+
+    assert len(res) == len(tidal_tracks)
+    assert "tidal:artist:1" in tlp._artist_cache
+    assert "tidal:artist:2" not in tlp._artist_cache
+
+
+def test_lookup_tracks_batched_by_album(tlp, mocker, tidal_tracks):
+    tlp, backend = tlp
+    session = backend.session
+    album = mocker.Mock()
+    album.tracks.return_value = tidal_tracks
+    session.album.return_value = album
+    artist = mocker.Mock()
+    artist.get_top_tracks.return_value = tidal_tracks[:1]
+    session.artist.return_value = artist
+
+    res = tlp.lookup(
+        [
+            "tidal:track:1:1:1",
+            "tidal:artist:0",
+            "tidal:track:0:1:0",
+            "tidal:track:0:1:99",
+        ]
+    )
+
+    assert [t.name for t in res] == ["Track-1", "Track-0", "Track-0"]
+    session.album.assert_called_once_with("1")
+    assert "tidal:track:0:1:99" not in tlp._track_cache
+
+
+def test_lookup_tracks_from_browsed_album(tlp, mocker, tidal_albums):
+    tlp, backend = tlp
+    session = backend.session
+    album = tidal_albums[0]
+    session.album.return_value = album
+    tlp.browse("tidal:album:0")
+    res = tlp.lookup(["tidal:track:1234:0:0", "tidal:album:0"])
+    assert [t.name for t in res] == ["Track-0", "Track-0"]
+    session.album.assert_called_once_with("0")
+    album.tracks.assert_called_once_with()
+
+
+def test_lookup_track_short_uri_cached(tlp, mocker, tidal_tracks):
+    tlp, backend = tlp
+    session = backend.session
+    album = mocker.Mock()
+    album.tracks.return_value = tidal_tracks
+    session.album.return_value = album
+    (track,) = tlp.lookup("tidal:track:1:1:1")
+    assert tlp.lookup("tidal:track:1") == [track]
+    session.album.assert_called_once_with("1")
+    session.track.assert_not_called()
+
+
+def test_get_images_image_proxy(tlp, mocker, config):
+    tlp, backend = tlp
+    config["tidal"]["image_proxy"] = True
+    config["http"] = {"hostname": "127.0.0.1", "port": 6680}
+    backend.session.album.return_value = mocker.Mock(cover="aaaa-bbbb")
+    images = tlp.get_images(["tidal:album:1"])["tidal:album:1"]
+    assert [image.uri for image in images] == [
+        f"/tidal/images/aaaa/bbbb/{size}x{size}.jpg"
+        for size in (1280, 640, 320, 160, 80)
+    ]
+
+
+def test_get_images_image_proxy_without_http(tlp, mocker, config):
+    tlp, backend = tlp
+    config["tidal"]["image_proxy"] = True
+    config["http"] = {"enabled": False, "port": 6680}
+    backend.session.album.return_value = mocker.Mock(cover="aaaa-bbbb")
+    images = tlp.get_images(["tidal:album:1"])["tidal:album:1"]
+    assert images[0].uri == (
+        "https://resources.tidal.com/images/aaaa/bbbb/1280x1280.jpg"
+    )
@@ -1,10 +1,13 @@
 import os
+import pickle
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pytest
+from mopidy.models import Track
 
-from mopidy_tidal.lru_cache import LruCache, SearchCache
+from mopidy_tidal.lru_cache import LruCache, SearchCache, TrackCache
 
 
 @pytest.fixture
@@ -175,9 +178,66 @@ def test_old_cache_filename(lru_cache):
     assert filename.split(os.sep)[-1] == f"{uri}.cache"
 
 
+def test_hit_rate(lru_cache):
+    assert lru_cache.hit_rate is None
+    lru_cache["tidal:uri:val"] = "hi"
+    assert "tidal:uri:val" in lru_cache
+    assert "tidal:uri:nonsuch" not in lru_cache
+    assert (lru_cache.hits, lru_cache.misses) == (1, 1)
+    assert lru_cache.hit_rate == 0.5
+
+
+def test_track_cache_canonical_keys(config):
+    cache = TrackCache(directory="cache")
+    track = Track(uri="tidal:track:1:2:3", name="Track-3")
+    cache[track.uri] = track
+    assert cache["tidal:track:3"] == track
+    assert cache.get_album_id("3") == "2"
+
+    # Reload the entry from the filesystem
+    cache.clear()
+    cache._aliases.clear()
+    assert cache.get_album_id(3) == "2"
+    assert cache["tidal:track:9:9:3"] == track
+
+    cache.prune(track.uri)
+    assert "tidal:track:3" not in cache
+
+
+def test_track_cache_migration(config):
+    cache = TrackCache(directory="cache")
+    track = Track(uri="tidal:track:1:2:3", name="Track-3")
+    old_filename = os.path.join(
+        cache._cache_dir, "track", "1", "tidal-track-1-2-3.cache"
+    )
+    Path(old_filename).parent.mkdir(parents=True, exist_ok=True)
+    with open(old_filename, "wb") as f:
+        pickle.dump([track], f)
+
+    cache = TrackCache(directory="cache")
+    assert not os.path.isfile(old_filename)
+    assert os.path.isfile(cache._cache_filename("tidal:track:3"))
+    cache.clear()
+    assert cache["tidal:track:3"] == [track]
+    assert cache.get_album_id("3") == "2"
+
+
 @pytest.mark.xfail
 def test_lru(lru_cache):
     lru_cache.update({f"tidal:uri:{val}": val for val in range(8)})
     lru_cache["tidal:uri:0"]
     lru_cache["tidal:uri:8"] = 8
     assert lru_cache == {f"tidal:uri:{val}": val for val in (0, *range(2, 9))}
+
+
+def test_concurrent_writes(lru_cache):
+    def write(i):
+        for j in range(200):
+            lru_cache[f"tidal:uri:{j % 16}"] = i
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(write, range(4)))
+
+    assert len(lru_cache) == 8
+    for key in lru_cache.keys():
+        assert lru_cache[key] in range(4)
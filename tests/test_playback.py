@@ -1,16 +1,168 @@
-from mopidy_tidal.playback import TidalPlaybackProvider
+import os
+import time
 
+import pytest
 
-def test_playback_new_api(mocker):
-    uniq = object()
-    session = mocker.Mock(spec=["track"])
-    session.mock_add_spec(["track"])
-    track = mocker.Mock()
-    track.get_url.return_value = uniq
-    session.track.return_value = track
-    backend = mocker.Mock(session=session)
+from mopidy_tidal import audio_proxy
+from mopidy_tidal.lanes import Lanes
+from mopidy_tidal.playback import StreamUrlCache, TidalPlaybackProvider, get_url_expiry
+from mopidy_tidal.scheduler import Scheduler
+
+
+@pytest.fixture
+def tpp(mocker):
+    session = mocker.Mock(is_pkce=False)
+    session.request.request.return_value.json.return_value = {
+        "urls": ["https://stream.tidal.com/3.flac?token=4102444800~signature"]
+    }
+    backend = mocker.Mock(session=session, scheduler=Scheduler(), lanes=Lanes())
+    backend._config = {"tidal": {"prefetch_tracks": 0}}
     audio = mocker.Mock()
-    tpp = TidalPlaybackProvider(audio, backend)
-    assert tpp.translate_uri("tidal:track:1:2:3") is uniq
-    session.track.assert_called_once_with(3)
-    track.get_url.assert_called_once()
+    yield TidalPlaybackProvider(audio, backend), backend
+    backend.lanes.close()
+
+
+def test_playback_new_api(tpp):
+    tpp, backend = tpp
+    session = backend.session
+    assert (
+        tpp.translate_uri("tidal:track:1:2:3")
+        == "https://stream.tidal.com/3.flac?token=4102444800~signature"
+    )
+    # Only the URL is requested, not the track metadata
+    session.track.assert_not_called()
+    session.request.request.assert_called_once_with(
+        "GET",
+        "tracks/3/urlpostpaywall",
+        {
+            "urlusagemode": "STREAM",
+            "audioquality": session.config.quality,
+            "assetpresentation": "FULL",
+        },
+    )
+
+
+def test_playback_pkce(tpp, mocker):
+    tpp, backend = tpp
+    uniq = "https://stream.tidal.com/3.flac"
+    session = backend.session
+    session.is_pkce = True
+    session.track.return_value.get_url.return_value = uniq
+    assert tpp.translate_uri("tidal:track:1:2:3") == uniq
+    session.track.assert_called_once_with("3")
+
+
+def test_stream_url_cached(tpp):
+    tpp, backend = tpp
+    url = tpp.translate_uri("tidal:track:1:2:3")
+    assert tpp.translate_uri("tidal:track:3") == url
+    backend.session.request.request.assert_called_once()
+
+
+def test_stream_url_dropped_on_playback_error(tpp):
+    tpp, backend = tpp
+    tpp.translate_uri("tidal:track:1:2:3")
+    tpp.audio.start_playback.return_value.get.return_value = False
+    assert not tpp.play()
+    tpp.translate_uri("tidal:track:1:2:3")
+    assert backend.session.request.request.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "url, expiry",
+    [
+        ("https://a/b.flac?token=1700000000~abcdef", 1700000000),
+        ("https://a/b.flac?Expires=1700000000&Signature=x", 1700000000),
+        ("https://a/b.flac?__token__=st%3D1~exp%3D1700000000~acl%3D%2A", 1700000000),
+        ("https://a/b.flac?token=abcdef", None),
+        ("https://a/b.flac", None),
+    ],
+)
+def test_url_expiry(url, expiry):
+    assert get_url_expiry(url) == expiry
+
+
+def test_stream_url_cache_expiry(mocker):
+    cache = StreamUrlCache(default_ttl=60, margin=10)
+    now = 1700000000
+    time = mocker.patch("mopidy_tidal.playback.time.time", return_value=now)
+    cache.add("1", f"https://a/1.flac?token={now + 100}~x")
+    cache.add("2", "https://a/2.flac")
+    cache.add("3", f"https://a/3.flac?token={now + 5}~x")
+    assert cache.get("3") is None
+
+    # URLs without an expiry are kept for the whole default TTL
+    time.return_value = now + 55
+    assert cache.get("2")
+
+    time.return_value = now + 60
+    assert cache.get("1")
+    assert cache.get("2") is None
+
+    time.return_value = now + 90
+    assert cache.get("1") is None
+
+
+def test_audio_proxy(tpp, config, mocker):
+    tpp, backend = tpp
+    mocker.patch("mopidy_tidal.audio_proxy._cache", None)
+    config["tidal"].update({"audio_proxy": True, "prefetch_tracks": 0})
+    config["http"] = {"hostname": "127.0.0.1", "port": 6680}
+    backend._config = config
+    local_url = "http://127.0.0.1:6680/tidal/audio/3-LOSSLESS"
+    assert tpp.translate_uri("tidal:track:1:2:3") == local_url
+
+    cache = audio_proxy.get_cache(config)
+    assert cache._urls["3-LOSSLESS"].endswith("token=4102444800~signature")
+
+    # Tracks in the audio cache, e.g. from a previous run, are played without
+    # asking for a stream URL
+    with open(os.path.join(cache._cache_dir, "4-LOSSLESS.flac"), "wb") as f:
+        f.write(b"fLaC")
+    mocker.patch("mopidy_tidal.audio_proxy._cache", None)
+    assert tpp.translate_uri("tidal:track:4") == local_url.replace("3-", "4-")
+    backend.session.request.request.assert_called_once()
+
+
+def test_adaptive_quality(tpp):
+    tpp, backend = tpp
+    backend._config["tidal"].update(
+        {"adaptive_quality": True, "quality": "LOSSLESS", "min_quality": "LOW"}
+    )
+    tpp.translate_uri("tidal:track:3")
+    assert backend.session.request.request.call_args.args[2]["audioquality"] == (
+        "LOSSLESS"
+    )
+
+    # The source setup doesn't tell when the audio starts
+    tpp._current = ("3", "3-LOSSLESS", time.monotonic() - 10)
+    tpp.on_source_setup(None)
+    assert tpp.quality_selector.startup_latency is None
+
+    # A slow start lowers the quality of the next track
+    tpp._on_stream_start("3-LOSSLESS")
+    tpp._on_stream_start("3-LOSSLESS")
+    assert tpp.quality_selector.startup_latency == pytest.approx(10, abs=1)
+    tpp.translate_uri("tidal:track:4")
+    assert backend.session.request.request.call_args.args[2]["audioquality"] == "HIGH"
+    assert tpp.quality_selector.decisions == {"LOSSLESS": 1, "HIGH": 1}
+
+
+def test_adaptive_quality_pkce(tpp, config, mocker):
+    tpp, backend = tpp
+    session = backend.session
+    session.is_pkce = True
+    session.config.quality = "HI_RES"
+    session.track.return_value.get_url.return_value = "https://a/3.flac"
+    mocker.patch("mopidy_tidal.audio_proxy._cache", None)
+    config["tidal"].update(
+        {"audio_proxy": True, "adaptive_quality": True, "quality": "LOSSLESS"}
+    )
+    config["http"] = {"hostname": "127.0.0.1", "port": 6680}
+    backend._config = config
+
+    # The stream comes at the quality of the session, whatever the selector
+    # would pick
+    url = tpp.translate_uri("tidal:track:3")
+    assert url == "http://127.0.0.1:6680/tidal/audio/3-HI_RES"
+    assert not tpp.quality_selector.decisions
@@ -1,13 +1,19 @@
+import time
 from copy import deepcopy
+from threading import Condition, Event, Thread, current_thread
 from time import sleep
 
 import pytest
 from mopidy.models import Track
 from requests import HTTPError
 
+from mopidy_tidal.caches import CacheRegistry
+from mopidy_tidal.lanes import Lanes
 from mopidy_tidal.playlists import (
+    ITEMS_WORKERS,
     MopidyPlaylist,
     PlaylistCache,
+    PlaylistMetadata,
     Ref,
     TidalPlaylist,
     TidalPlaylistsProvider,
@@ -19,15 +25,17 @@ def tpp(config, mocker):
     mocker.patch("mopidy_tidal.playlists.Timer")
     backend = mocker.Mock()
     backend._config = {"tidal": {"playlist_cache_refresh_secs": 0}}
+    backend.lanes = Lanes()
+    backend.caches = CacheRegistry(persist=False)
 
     tpp = TidalPlaylistsProvider(backend)
-    tpp._playlists = PlaylistCache(persist=False)
     yield tpp, backend
+    backend.lanes.close()
 
 
 def test_create(tpp, mocker):
     tpp, backend = tpp
-    playlist = mocker.Mock(last_updated=9, id="17")
+    playlist = mocker.Mock(last_updated=9, id="17", num_tracks=0)
     playlist.tracks.__name__ = "tracks"
     playlist.tracks.return_value = []
     playlist.name = "playlist name"
@@ -37,6 +45,9 @@ def test_create(tpp, mocker):
         last_modified=9, name="playlist name", uri="tidal:playlist:17"
     )
     backend.session.user.create_playlist.assert_called_once_with("playlist", "")
+    assert tpp.as_list() == [
+        Ref(name="playlist name", type="playlist", uri="tidal:playlist:17")
+    ]
 
 
 def test_delete(tpp):
@@ -163,7 +174,9 @@ def test_save_remove(tpp, mocker, tidal_playlists):
     pl.tracks = pl.tracks[:1]
     tpp.save(pl)
     session.playlist.assert_called_with("101")
-    session.playlist().remove_by_index.assert_called_once_with(1)
+    session.request.request.assert_called_once_with(
+        "DELETE", "playlists/101/items/1", data=None, headers=mocker.ANY
+    )
 
 
 def test_save_add(tpp, mocker, tidal_playlists, tidal_tracks):
@@ -186,7 +199,47 @@ def test_save_add(tpp, mocker, tidal_playlists, tidal_tracks):
     pl.tracks += tidal_tracks[-2:-1]
     tpp.save(pl)
     session.playlist.assert_called_with("101")
-    session.playlist().add.assert_called_once_with(["0"])
+    session.request.request.assert_called_once_with(
+        "POST",
+        "playlists/101/items",
+        data={
+            "onArtifactNotFound": "SKIP",
+            "onDupes": "ADD",
+            "trackIds": "0",
+            "toIndex": 2,
+        },
+        headers=mocker.ANY,
+    )
+
+
+def test_save_insert_first(tpp, mocker, tidal_playlists):
+    tpp, backend = tpp
+    uri = "tidal:playlist:101"
+    tracks = [Track(uri=f"tidal:track:{i}") for i in range(4)]
+    old = MopidyPlaylist(uri=uri, name="Playlist-101", tracks=tracks, last_modified=10)
+    tpp._playlists[uri] = old
+    tpp._current_tidal_playlists = tidal_playlists[:1]
+    tpp._synced_at = time.monotonic()
+    upstream = tidal_playlists[0]
+    upstream._etag = "1"
+    backend.session.playlist.return_value = upstream
+    request = backend.session.request.request
+    request.side_effect = [
+        mocker.Mock(headers={"etag": "2"}),
+        mocker.Mock(headers={"etag": "3"}),
+    ]
+    new_tracks = [Track(uri="tidal:track:new"), *tracks[:3]]
+    tpp.save(old.replace(tracks=new_tracks))
+
+    # One request per edit, each with the ETag left by the previous one
+    assert [(c.args, c.kwargs["headers"]) for c in request.call_args_list] == [
+        (("DELETE", "playlists/101/items/3"), {"If-None-Match": "1"}),
+        (("POST", "playlists/101/items"), {"If-None-Match": "2"}),
+    ]
+    assert request.call_args.kwargs["data"]["toIndex"] == 0
+    upstream.remove_by_index.assert_not_called()
+    upstream.add.assert_not_called()
+    assert tpp._playlists[uri].tracks == tuple(new_tracks)
 
 
 def test_lookup_unmodified_cached(tpp, mocker):
@@ -204,23 +257,22 @@ def test_refresh_metadata(tpp, mocker, tidal_playlists):
     tpp, backend = tpp
     tpp._current_tidal_playlists = tidal_playlists
     assert not len(tpp._playlists_metadata)
-    tpp.refresh(include_items=False)
+    tpp.refresh(include_items=False).result()
 
     listener.send.assert_called_once_with("playlists_loaded")
 
-    tracks = [Track(uri="tidal:track:0:0:0")] * 2
     assert dict(tpp._playlists_metadata) == {
-        "tidal:playlist:101": MopidyPlaylist(
+        "tidal:playlist:101": PlaylistMetadata(
             last_modified=10,
             name="Playlist-101",
             uri="tidal:playlist:101",
-            tracks=tracks,
+            count=2,
         ),
-        "tidal:playlist:222": MopidyPlaylist(
+        "tidal:playlist:222": PlaylistMetadata(
             last_modified=10,
             name="Playlist-222",
             uri="tidal:playlist:222",
-            tracks=tracks[:1],
+            count=1,
         ),
     }
 
@@ -244,7 +296,7 @@ def api_test(tpp, mocker, api_method, tp):
     api_method.return_value = tracks
     api_method.__name__ = "get_playlist_tracks"
 
-    tpp.refresh(include_items=True)
+    tpp.refresh(include_items=True).result()
     listener.send.assert_called_once_with("playlists_loaded")
     assert len(tpp._playlists) == 1
     playlist = tpp._playlists["tidal:playlist:1-1-1"]
@@ -300,9 +352,8 @@ def test_prevent_duplicate_playlist_sync(tpp, mocker, tidal_playlists):
 
 
 def test_playlist_sync_downtime(mocker, tidal_playlists, config):
-    backend = mocker.Mock()
+    backend = mocker.Mock(caches=CacheRegistry(persist=False))
     tpp = TidalPlaylistsProvider(backend)
-    tpp._playlists = PlaylistCache(persist=False)
     mocker.patch("mopidy_tidal.playlists.get_items", lambda x: x)
     backend._config = {"tidal": {"playlist_cache_refresh_secs": 0.1}}
 
@@ -331,11 +382,11 @@ def test_update_changes(tpp, mocker, tidal_playlists):
     tpp, backend = tpp
     tpp._playlists_metadata.update(
         {
-            "tidal:playlist:101": MopidyPlaylist(
-                last_modified=10, name="Playlist-101", uri="tidal:playlist:101"
+            "tidal:playlist:101": PlaylistMetadata(
+                last_modified=10, name="Playlist-101", uri="tidal:playlist:101", count=1
             ),
-            "tidal:playlist:222": MopidyPlaylist(
-                last_modified=9, name="Playlist-222", uri="tidal:playlist:222"
+            "tidal:playlist:222": PlaylistMetadata(
+                last_modified=9, name="Playlist-222", uri="tidal:playlist:222", count=1
             ),
         }
     )
@@ -353,11 +404,11 @@ def test_update_no_changes(tpp, mocker, tidal_playlists):
     tpp, backend = tpp
     tpp._playlists_metadata.update(
         {
-            "tidal:playlist:101": MopidyPlaylist(
-                last_modified=10, name="Playlist-101", uri="tidal:playlist:101"
+            "tidal:playlist:101": PlaylistMetadata(
+                last_modified=10, name="Playlist-101", uri="tidal:playlist:101", count=1
             ),
-            "tidal:playlist:222": MopidyPlaylist(
-                last_modified=10, name="Playlist-222", uri="tidal:playlist:222"
+            "tidal:playlist:222": PlaylistMetadata(
+                last_modified=10, name="Playlist-222", uri="tidal:playlist:222", count=1
             ),
         }
     )
@@ -457,3 +508,272 @@ def test_get_items_mix(tpp, mocker):
         Ref(name="Track-0", type="track", uri="tidal:track:0:0:0"),
         Ref(name="Track-1", type="track", uri="tidal:track:1:1:1"),
     ]
+
+
+def test_refresh_on_bulk_lane(tpp, mocker, tidal_playlists):
+    tpp, backend = tpp
+    mocker.patch("mopidy_tidal.playlists.backend.BackendListener")
+    tpp._current_tidal_playlists = tidal_playlists
+    refreshing, released = Event(), Event()
+    refresh_playlists = tpp._refresh_playlists
+
+    def slow_refresh(*args, **kwargs):
+        refreshing.set()
+        released.wait(2)
+        refresh_playlists(*args, **kwargs)
+
+    mocker.patch.object(tpp, "_refresh_playlists", slow_refresh)
+    future = tpp.refresh(include_items=False)
+    assert refreshing.wait(2)
+
+    # The caller isn't blocked by the refresh in progress
+    assert not future.done()
+    released.set()
+    future.result(2)
+    assert len(tpp._playlists_metadata) == 2
+    assert backend.lanes.stats["bulk"].tasks == 1
+
+
+def test_served_from_cache_during_sync(tpp, mocker, tidal_playlists):
+    tpp, backend = tpp
+    mocker.patch("mopidy_tidal.playlists.get_items", lambda x: x)
+    mocker.patch("mopidy_tidal.playlists.backend.BackendListener")
+    uri = "tidal:playlist:101"
+    playlist = MopidyPlaylist(uri=uri, name="Playlist-101", last_modified=10)
+    tpp._playlists[uri] = playlist
+    tpp._playlists_metadata[uri] = PlaylistMetadata(
+        uri=uri, name="Playlist-101", count=0, last_modified=10
+    )
+    syncing, released = Event(), Event()
+
+    def slow_playlists():
+        syncing.set()
+        released.wait(2)
+        return tidal_playlists
+
+    backend.session.configure_mock(**{"user.favorites.playlists": []})
+    backend.session.user.playlists.side_effect = slow_playlists
+    sync = Thread(target=tpp.sync)
+    sync.start()
+    assert syncing.wait(2)
+
+    # Neither listing nor opening a cached playlist waits for the sync
+    assert tpp.as_list() == [Ref.playlist(uri=uri, name="Playlist-101")]
+    assert tpp.lookup(uri) is playlist
+    backend.session.playlist.assert_not_called()
+    released.set()
+    sync.join(2)
+    assert backend.session.user.playlists.call_count == 1
+
+
+def test_refresh_items_concurrently(tpp, mocker, tidal_tracks):
+    tpp, backend = tpp
+    listener = mocker.Mock()
+    mocker.patch("mopidy_tidal.playlists.backend.BackendListener", listener)
+    loading = Condition()
+    active = peak = 0
+
+    def fake_playlist(i):
+        track = tidal_tracks[i % 2]
+
+        def tracks(limit, offset):
+            nonlocal active, peak
+            if offset:
+                return []
+
+            with loading:
+                active += 1
+                peak = max(peak, active)
+                loading.notify_all()
+                # Give the loads of the other playlists the time to start
+                loading.wait_for(lambda: peak >= ITEMS_WORKERS, 1)
+                active -= 1
+            return [track]
+
+        tracks.__name__ = "tracks"
+        tp = mocker.Mock(spec=TidalPlaylist, id=f"pl-{i}", last_updated=10)
+        tp.name = f"Playlist-{i}"
+        tp.tracks = tracks
+        return tp
+
+    tpp._current_tidal_playlists = [fake_playlist(i) for i in range(8)]
+    tpp.refresh(include_items=True).result()
+
+    assert peak == ITEMS_WORKERS
+    listener.send.assert_called_once_with("playlists_loaded")
+    assert list(tpp._playlists.keys()) == [f"tidal:playlist:pl-{i}" for i in range(8)]
+    assert tpp._playlists["tidal:playlist:pl-3"].tracks[0].uri == tidal_tracks[1].uri
+
+
+def test_lookup_fresh_from_synced_list(tpp, mocker, tidal_playlists):
+    tpp, backend = tpp
+    mocker.patch("mopidy_tidal.playlists.get_items", lambda x: x)
+    backend.session.configure_mock(**{"user.favorites.playlists": tidal_playlists[:1]})
+    backend.session.user.playlists.return_value = tidal_playlists[1:]
+    tpp.sync()
+    playlist = MopidyPlaylist(uri="tidal:playlist:101", last_modified=10)
+    tpp._playlists[playlist.uri] = playlist
+
+    assert tpp.lookup("tidal:playlist:101") is playlist
+    # Playlist opens don't ask the API
+    backend.session.playlist.assert_not_called()
+    backend.session.user.playlists.assert_called_once()
+
+
+def test_lookup_stale_list_synced_once(tpp, mocker, tidal_playlists):
+    tpp, backend = tpp
+    mocker.patch("mopidy_tidal.playlists.get_items", lambda x: x)
+    backend.session.configure_mock(**{"user.favorites.playlists": tidal_playlists[:1]})
+    backend.session.user.playlists.return_value = tidal_playlists[1:]
+    tpp.sync()
+    for uri in ("tidal:playlist:101", "tidal:playlist:222"):
+        tpp._playlists[uri] = MopidyPlaylist(uri=uri, last_modified=10)
+    tpp._synced_at -= 1000
+
+    tpp.lookup("tidal:playlist:101")
+    tpp.lookup("tidal:playlist:222")
+    assert backend.session.user.playlists.call_count == 2
+    backend.session.playlist.assert_not_called()
+
+
+def test_lookup_unlisted_playlist(tpp, mocker, tidal_playlists):
+    tpp, backend = tpp
+    tpp._current_tidal_playlists = tidal_playlists
+    tpp._synced_at = time.monotonic()
+    backend.session.playlist.return_value = mocker.Mock(last_updated=9)
+    playlist = MopidyPlaylist(uri="tidal:playlist:0-1-2", last_modified=9)
+    tpp._playlists[playlist.uri] = playlist
+
+    assert tpp.lookup("tidal:playlist:0-1-2") is playlist
+    backend.session.playlist.assert_called_once_with("0-1-2")
+
+
+def test_save_large_edit(tpp, mocker):
+    tpp, backend = tpp
+    uri = "tidal:playlist:101"
+    tracks = [Track(uri=f"tidal:track:{i}", name=f"Track-{i}") for i in range(5000)]
+    old = MopidyPlaylist(uri=uri, name="Big", tracks=tracks, last_modified=10)
+    tpp._playlists[uri] = old
+    tpp._current_tidal_playlists = [mocker.Mock(id="101", last_updated=10)]
+    tpp._synced_at = time.monotonic()
+    upstream = backend.session.playlist.return_value
+    upstream.last_updated = 20
+    request = backend.session.request.request
+
+    # Drop every 10th track, and insert 150 new tracks in the middle
+    new_tracks = [t for i, t in enumerate(tracks) if i % 10]
+    new_tracks[2000:2000] = [Track(uri=f"tidal:track:new-{i}") for i in range(150)]
+    new = old.replace(tracks=new_tracks)
+
+    started_at = time.monotonic()
+    tpp.save(new)
+    assert time.monotonic() - started_at < 1
+
+    # 500 removals in batches of 50, from the last ones, then the insertions
+    # in runs of up to 100 tracks
+    calls = request.call_args_list
+    assert [c.args[0] for c in calls] == ["DELETE"] * 10 + ["POST"] * 2
+    assert calls[0].args[1] == "playlists/101/items/" + ",".join(
+        map(str, range(4500, 5000, 10))
+    )
+    assert calls[9].args[1] == "playlists/101/items/" + ",".join(
+        map(str, range(0, 500, 10))
+    )
+    assert [c.kwargs["data"]["toIndex"] for c in calls[10:]] == [2000, 2100]
+    assert calls[10].kwargs["data"]["trackIds"].split(",")[0] == "new-0"
+
+    # The cache is patched, without listing the playlists again
+    assert tpp._playlists[uri] == new.replace(last_modified=20)
+    assert tpp._playlists_metadata[uri].count == 4650
+    backend.session.user.playlists.assert_not_called()
+
+
+def test_playlist_index_maintained(tpp, mocker, tidal_playlists):
+    tpp, backend = tpp
+    mocker.patch("mopidy_tidal.playlists.get_items", lambda x: x)
+    mocker.patch("mopidy_tidal.playlists.backend.BackendListener")
+    backend.session.configure_mock(**{"user.favorites.playlists": tidal_playlists[:1]})
+    backend.session.user.playlists.return_value = tidal_playlists[1:]
+    tpp.sync()
+    assert set(tpp._tidal_playlists) == {"101", "222"}
+
+    created = mocker.Mock(
+        spec=TidalPlaylist, id="150", tracks=[], num_tracks=0, last_updated=10
+    )
+    created.name = "Playlist-150"
+    backend.session.user.create_playlist.return_value = created
+    tpp.create("Playlist-150")
+    assert [ref.name for ref in tpp.as_list()] == [
+        "Playlist-101",
+        "Playlist-150",
+        "Playlist-222",
+    ]
+
+    tpp.delete("tidal:playlist:101")
+    assert set(tpp._tidal_playlists) == {"150", "222"}
+    assert [ref.name for ref in tpp.as_list()] == ["Playlist-150", "Playlist-222"]
+
+
+@pytest.fixture
+def large_playlist(tpp, mocker, tidal_tracks):
+    tpp, _ = tpp
+    total = 1000
+    # Offsets requested, and whether the background load may proceed
+    requests, release = [], Event()
+    main_thread = current_thread()
+
+    def tracks(limit, offset):
+        requests.append(offset)
+        if current_thread() is not main_thread:
+            release.wait(2)
+        return [tidal_tracks[i % 2] for i in range(offset, min(offset + limit, total))]
+
+    tracks.__name__ = "tracks"
+    tp = mocker.Mock(spec=TidalPlaylist, id="big", num_tracks=total, last_updated=10)
+    tp.name = "Big"
+    tp.tracks = tracks
+    tpp._current_tidal_playlists = [tp]
+    tpp._synced_at = time.monotonic()
+    return "tidal:playlist:big", total, requests, release
+
+
+def test_large_playlist_windowed(tpp, mocker, large_playlist):
+    tpp, backend = tpp
+    listener = mocker.Mock()
+    mocker.patch("mopidy_tidal.playlists.backend.BackendListener", listener)
+    refresh = mocker.spy(tpp, "refresh")
+    uri, total, requests, release = large_playlist
+
+    # The first window is returned while the whole playlist is still loading
+    refs = tpp.get_items(uri)
+    assert len(refs) == 100
+    assert uri not in tpp._playlists
+
+    release.set()
+    refresh.spy_return.result(2)
+    listener.send.assert_called_once_with("playlists_loaded")
+    assert len(tpp._playlists[uri].tracks) == total
+    fetched = len(requests)
+    assert len(tpp.get_items(uri)) == total
+    assert len(requests) == fetched
+
+
+def test_large_playlist_lookup_complete(tpp, mocker, large_playlist):
+    tpp, backend = tpp
+    mocker.patch("mopidy_tidal.playlists.backend.BackendListener")
+    uri, total, requests, release = large_playlist
+    tpp.get_items(uri)
+
+    # A lookup waits for the whole playlist being loaded, rather than
+    # returning its first window or loading it again
+    Thread(target=lambda: sleep(0.05) or release.set(), daemon=True).start()
+    assert len(tpp.lookup(uri).tracks) == total
+    assert sorted(requests).count(0) == 2
+
+
+def test_large_playlist_lookup_uncached(tpp, mocker, large_playlist):
+    tpp, backend = tpp
+    uri, total, requests, release = large_playlist
+    release.set()
+    assert len(tpp.lookup(uri).tracks) == total
+    assert not tpp._filling
@@ -2,20 +2,55 @@ from pathlib import Path
 
 import pytest
 
-from mopidy_tidal.playlists import PlaylistCache, PlaylistMetadataCache, TidalPlaylist
+from mopidy_tidal.playlists import (
+    PlaylistCache,
+    PlaylistMetadata,
+    PlaylistMetadataCache,
+    TidalPlaylist,
+)
 
 
 def test_metadata_cache(config):
     cache = PlaylistMetadataCache(directory="cache")
-    uniq = object()
-    outf = (
-        Path(config["core"]["cache_dir"], "tidal/cache/playlist_metadata/00")
-        / "tidal:playlist:00-1-2.cache"
+    metadata = PlaylistMetadata(
+        uri="tidal:playlist:00-1-2",
+        name="Playlist",
+        count=2000,
+        last_modified=10,
+        owner="me",
+        image_id="1-2-3",
+    )
+    index = Path(config["core"]["cache_dir"], "tidal/cache/playlist_metadata.index")
+    assert not index.exists()
+    cache["tidal:playlist:00-1-2"] = metadata
+    assert index.exists()
+    assert cache["tidal:playlist:00-1-2"] is metadata
+    # No list of tracks is stored
+    assert index.stat().st_size < 200
+
+    cache = PlaylistMetadataCache(directory="cache")
+    assert dict(cache) == {"tidal:playlist:00-1-2": metadata}
+    cache.prune("tidal:playlist:00-1-2")
+    assert not PlaylistMetadataCache(directory="cache")
+
+
+def test_metadata_cache_old_format(config):
+    old_dir = Path(config["core"]["cache_dir"], "tidal/playlist_metadata/00")
+    old_dir.mkdir(parents=True)
+    (old_dir / "tidal:playlist:00-1-2.cache").write_bytes(b"")
+    cache = PlaylistMetadataCache()
+    assert not cache
+    assert not old_dir.exists()
+
+
+def test_metadata_from_tidal(mocker):
+    pl = mocker.Mock(spec=TidalPlaylist, id="0-1-2", num_tracks=3, last_updated=10)
+    pl.name = "Playlist"
+    pl.creator.name = "me"
+    pl.square_picture = "1-2-3"
+    assert PlaylistMetadata.from_tidal(pl) == PlaylistMetadata(
+        "tidal:playlist:0-1-2", "Playlist", 3, 10, "me", "1-2-3"
     )
-    assert not outf.exists()
-    cache["tidal:playlist:00-1-2"] = uniq
-    assert outf.exists()
-    assert cache["tidal:playlist:00-1-2"] is uniq
 
 
 def test_cached_as_str(config):
@@ -52,3 +87,24 @@ def test_updated(config, mocker):
     cache["tidal:playlist:0-1-2"] = playlist
     with pytest.raises(KeyError):
         cache[key]
+
+
+def test_metadata_sorted_by_name(config):
+    cache = PlaylistMetadataCache(directory="cache")
+    cache.update(
+        {
+            f"tidal:playlist:{i}": PlaylistMetadata(f"tidal:playlist:{i}", name, 1, 10)
+            for i, name in enumerate(["b", "c", "a"])
+        }
+    )
+    assert [pl.name for pl in cache.by_name()] == ["a", "b", "c"]
+
+    # Renames and removals keep the view sorted
+    cache["tidal:playlist:1"] = PlaylistMetadata("tidal:playlist:1", "0", 1, 10)
+    cache.prune("tidal:playlist:2")
+    cache["tidal:playlist:3"] = PlaylistMetadata("tidal:playlist:3", None, 1, 10)
+    assert [pl.name for pl in cache.by_name()] == [None, "0", "b"]
+
+    # The view is rebuilt from the index
+    cache = PlaylistMetadataCache(directory="cache")
+    assert [pl.name for pl in cache.by_name()] == [None, "0", "b"]
@@ -0,0 +1,143 @@
+import time
+
+import pytest
+from mopidy.models import TlTrack, Track
+from pykka import ThreadingFuture
+
+from mopidy_tidal.lanes import Lanes
+from mopidy_tidal.playback import TidalPlaybackProvider
+from mopidy_tidal.prefetch import Prefetcher
+from mopidy_tidal.scheduler import Scheduler
+
+LATENCY = 0.2
+
+
+class FakeResponse:
+    def __init__(self, track_id):
+        self._track_id = track_id
+
+    def json(self):
+        return {"urls": [f"https://stream.tidal.com/{self._track_id}.flac"]}
+
+
+class FakeRequest:
+    def __init__(self):
+        self.calls = []
+
+    def request(self, method, path, params=None):
+        self.calls.append(path)
+        time.sleep(LATENCY)
+        return FakeResponse(path.split("/")[1])
+
+
+class FakeSession:
+    """Session whose stream URL requests take `LATENCY` seconds."""
+
+    is_pkce = False
+
+    def __init__(self, mocker):
+        self.config = mocker.Mock(quality="LOSSLESS")
+        self.request = FakeRequest()
+
+
+def done(value):
+    future = ThreadingFuture()
+    future.set(value)
+    return future
+
+
+class FakeTracklist:
+    def __init__(self, uris):
+        self.tl_tracks = [
+            TlTrack(tlid=i, track=Track(uri=uri)) for i, uri in enumerate(uris)
+        ]
+
+    def filter(self, criteria):
+        return done([t for t in self.tl_tracks if t.track.uri in criteria["uri"]])
+
+    def next_track(self, tl_track):
+        i = self.tl_tracks.index(tl_track) + 1
+        return done(self.tl_tracks[i] if i < len(self.tl_tracks) else None)
+
+
+@pytest.fixture
+def tpp(mocker):
+    session = FakeSession(mocker)
+    backend = mocker.Mock(session=session, scheduler=Scheduler(), lanes=Lanes())
+    backend._config = {"tidal": {"prefetch_tracks": 2}}
+    tpp = TidalPlaybackProvider(mocker.Mock(), backend)
+    backend.playback = tpp
+    tracklist = FakeTracklist(
+        [
+            "tidal:track:0:0:1",
+            "tidal:track:0:0:2",
+            "local:track:song.mp3",
+            "tidal:track:3",
+            "tidal:track:0:0:4",
+        ]
+    )
+    core = mocker.Mock(tracklist=tracklist)
+    tpp.prefetcher._core_getter = lambda: core
+    yield tpp, session
+    backend.lanes.close()
+
+
+def test_next_uris(tpp):
+    tpp, _ = tpp
+    assert tpp.prefetcher.next_uris("tidal:track:0:0:1") == [
+        "tidal:track:0:0:2",
+        "tidal:track:3",
+    ]
+    assert tpp.prefetcher.next_uris("tidal:track:0:0:4") == []
+    assert tpp.prefetcher.next_uris("tidal:track:0:0:5") == []
+
+
+def test_next_track_starts_without_latency(tpp, wait_for):
+    tpp, session = tpp
+    started = time.monotonic()
+    assert tpp.translate_uri("tidal:track:0:0:1").endswith("/1.flac")
+    assert time.monotonic() - started >= LATENCY
+
+    wait_for(lambda: len(session.request.calls) == 3)
+    wait_for(lambda: not tpp._resolving)
+    started = time.monotonic()
+    assert tpp.translate_uri("tidal:track:0:0:2").endswith("/2.flac")
+    assert tpp.translate_uri("tidal:track:3").endswith("/3.flac")
+    assert time.monotonic() - started < LATENCY / 2
+
+    # Track 4 is prefetched after track 2 starts
+    wait_for(lambda: len(session.request.calls) == 4)
+
+
+def test_prefetch_in_flight_not_repeated(tpp):
+    tpp, session = tpp
+    tpp.prefetch(["tidal:track:0:0:2"])
+    assert tpp.translate_uri("tidal:track:0:0:2").endswith("/2.flac")
+    assert session.request.calls.count("tracks/2/urlpostpaywall") == 1
+
+
+def test_prefetch_disabled(mocker):
+    backend = mocker.Mock()
+    prefetcher = Prefetcher(backend, count=0)
+    prefetcher.schedule("tidal:track:1")
+    backend.lanes.submit.assert_not_called()
+
+
+def test_prefetch_metadata(mocker):
+    backend = mocker.Mock()
+    tracklist = FakeTracklist(["tidal:track:1", "tidal:track:2"])
+    prefetcher = Prefetcher(
+        backend,
+        count=1,
+        metadata=True,
+        core_getter=lambda: mocker.Mock(tracklist=tracklist),
+    )
+    assert prefetcher._prefetch_after("tidal:track:1") == ["tidal:track:2"]
+    backend.playback.prefetch.assert_called_once_with(["tidal:track:2"])
+    backend.library.lookup.assert_called_once_with(uris=["tidal:track:2"])
+    backend.library.images.get_images.assert_called_once_with(["tidal:track:2"])
+
+
+def test_no_core(mocker):
+    prefetcher = Prefetcher(mocker.Mock(), core_getter=lambda: None)
+    assert prefetcher.next_uris("tidal:track:1") == []
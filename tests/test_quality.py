@@ -0,0 +1,62 @@
+import pytest
+
+from mopidy_tidal.quality import QualitySelector
+
+
+def test_max_quality_without_measurements():
+    selector = QualitySelector(max_quality="HIGH")
+    assert selector.choose() == "HIGH"
+    assert selector.decisions == {"HIGH": 1}
+
+
+@pytest.mark.parametrize(
+    "kbps, quality",
+    [
+        (10000, "LOSSLESS"),
+        (1000, "HIGH"),
+        (200, "LOW"),
+        (10, "LOW"),
+    ],
+)
+def test_quality_follows_throughput(kbps, quality):
+    selector = QualitySelector()
+    selector.record_throughput(kbps * 1000 // 8, 1)
+    assert selector.choose() == quality
+
+
+def test_quality_bounds():
+    selector = QualitySelector(min_quality="HIGH", max_quality="HIGH")
+    selector.record_throughput(1000, 1)
+    assert selector.choose() == "HIGH"
+
+    selector = QualitySelector(max_quality="HIGH")
+    selector.record_throughput(10**9, 1)
+    assert selector.choose() == "HIGH"
+
+
+def test_slow_startup_lowers_quality():
+    selector = QualitySelector(slow_startup=2)
+    selector.record_startup(1)
+    assert selector.choose() == "LOSSLESS"
+
+    selector.record_startup(10)
+    assert selector.choose() == "HIGH"
+    assert selector.decisions == {"LOSSLESS": 1, "HIGH": 1}
+    assert selector.last_quality == "HIGH"
+
+
+def test_throughput_moving_average():
+    selector = QualitySelector(alpha=0.5)
+    selector.record_throughput(1000, 1)
+    selector.record_throughput(3000, 1)
+    assert selector.throughput == pytest.approx(16)
+    # Empty samples are ignored
+    selector.record_throughput(0, 1)
+    assert selector.throughput == pytest.approx(16)
+
+
+def test_unrecorded_choice():
+    selector = QualitySelector()
+    assert selector.choose(record=False) == "LOSSLESS"
+    assert not selector.decisions
+    assert selector.last_quality is None
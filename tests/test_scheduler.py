@@ -0,0 +1,56 @@
+import time
+from threading import Event
+
+import pytest
+
+from mopidy_tidal.scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(initial_delay=0, busy_delay=0.01)
+    yield scheduler
+    scheduler.stop(1)
+
+
+def test_periodic_job(scheduler, wait_for):
+    scheduler.add_job("job", lambda: None, 0.01)
+    scheduler.start()
+    wait_for(lambda: scheduler.runs["job"] >= 3)
+
+
+def test_jittered_interval(scheduler, mocker):
+    uniform = mocker.patch("mopidy_tidal.scheduler.random.uniform", return_value=1.1)
+    assert scheduler._jittered(100) == pytest.approx(110)
+    uniform.assert_called_once_with(0.9, 1.1)
+
+
+def test_failing_job_rescheduled(scheduler, wait_for):
+    def fail():
+        raise OSError("unreachable")
+
+    scheduler.add_job("job", fail, 0.01)
+    scheduler.start()
+    wait_for(lambda: scheduler.runs["job"] >= 2)
+
+
+def test_postponed_during_critical_work(scheduler):
+    ran = Event()
+    scheduler.add_job("job", ran.set, 0.01)
+    with scheduler.critical():
+        assert scheduler.busy
+        scheduler.start()
+        assert not ran.wait(0.1)
+
+    assert not scheduler.busy
+    assert ran.wait(2)
+
+
+def test_stop(scheduler, wait_for):
+    scheduler.add_job("job", lambda: None, 0.01)
+    scheduler.start()
+    wait_for(lambda: scheduler.runs["job"] >= 1)
+    scheduler.stop(1)
+    runs = scheduler.runs["job"]
+    time.sleep(0.05)
+    assert scheduler.runs["job"] == runs
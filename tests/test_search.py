@@ -143,3 +143,16 @@ def test_malformed_api_response(mocker, tidal_search, tidal_tracks, compare):
     assert not artists
     assert not albums
     compare(tidal_tracks, tracks, "track")
+
+
+def test_search_indexes_album_tracks(mocker, tidal_search, tidal_albums):
+    session = mocker.Mock()
+    session.search.return_value = {"albums": tidal_albums}
+    album_index = mocker.Mock()
+    tidal_search(
+        session, query={"album": ["Album"]}, exact=False, album_index=album_index
+    )
+    assert [c.args[0] for c in album_index.add_album.call_args_list] == [0, 1]
+    assert [t.name for t in album_index.add_album.call_args_list[1].args[1]] == [
+        "Track-1"
+    ]
@@ -0,0 +1,89 @@
+from time import sleep
+
+import pytest
+
+from mopidy_tidal.workers import (
+    Deadline,
+    current_deadline,
+    deadline,
+    get_items,
+    with_deadline,
+)
+
+
+def paginated(total, latency=0, slow_offsets=()):
+    def get_page(limit, offset):
+        if offset in slow_offsets:
+            sleep(latency)
+        return list(range(offset, min(offset + limit, total)))
+
+    get_page.__name__ = "get_page"
+    return get_page
+
+
+def test_deadline_no_limit():
+    d = Deadline()
+    assert d.remaining() is None
+    assert not d.expired
+
+
+def test_deadline_expires():
+    d = Deadline(0.01)
+    assert not d.expired
+    sleep(0.02)
+    assert d.expired
+    assert d.remaining() == 0
+
+
+def test_current_deadline_default():
+    assert current_deadline().remaining() is None
+
+
+def test_nested_deadline_cannot_extend_outer():
+    with deadline(1) as outer:
+        with deadline(10) as inner:
+            assert inner is outer
+        with deadline(0.5) as inner:
+            assert inner is not outer
+            assert inner.remaining() <= 0.5
+            assert current_deadline() is inner
+        assert current_deadline() is outer
+    assert current_deadline().remaining() is None
+
+
+def test_with_deadline(config):
+    config["tidal"]["browse_timeout_secs"] = 3
+
+    @with_deadline("browse")
+    def browse():
+        return current_deadline().remaining()
+
+    assert 2 < browse() <= 3
+    assert current_deadline().remaining() is None
+
+
+def test_get_items():
+    assert get_items(paginated(1234)) == list(range(1234))
+
+
+def test_get_items_deadline_returns_ordered_prefix():
+    func = paginated(1234, latency=0.5, slow_offsets=(300,))
+    with deadline(0.1):
+        items = get_items(func)
+    assert items == list(range(300))
+
+
+def test_get_items_deadline_cancels_next_pages():
+    calls = []
+
+    def get_page(limit, offset):
+        calls.append(offset)
+        if offset == 400:
+            sleep(0.3)
+        return list(range(offset, offset + limit))
+
+    get_page.__name__ = "get_page"
+    with deadline(0.1):
+        items = get_items(get_page)
+    assert items == list(range(400))
+    assert max(calls) == 400, "Didn't stop paginating after the deadline"